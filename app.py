@@ -4,31 +4,26 @@ import random
 from datetime import datetime, timedelta
 from urllib.error import URLError
 
-import pandas as pd
-import pygal
-import twitter
 from authlib.common.errors import AuthlibBaseError
 from authlib.integrations._client import MissingRequestTokenError
 from flask import Flask, flash, g, redirect, render_template, request, session, url_for
 from flask_migrate import Migrate
 from authlib.integrations.flask_client import OAuth
 from flask_sqlalchemy import SQLAlchemy
-from httplib2 import ServerNotFoundError
-from instagram.client import InstagramAPI
-from instagram.helper import datetime_to_timestamp
-from instagram.oauth2 import OAuth2AuthExchangeError
 from mastodon import Mastodon
 from mastodon.Mastodon import MastodonAPIError, MastodonIllegalArgumentError, MastodonNetworkError, \
     MastodonUnauthorizedError
 from pymysql import DataError
-from sentry_sdk.integrations.logging import LoggingIntegration
-from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 from sqlalchemy import exc, func
 from twitter import TwitterError
 
+from moa.chart_cache import ChartCache, FileBackend, MemoryBackend
+from moa.clients import ClientFactory
 from moa.forms import MastodonIDForm, SettingsForm
+from moa.health import HealthMonitor
 from moa.helpers import blacklisted, email_bridge_details, send_blacklisted_email, timespan, FORMAT
-from moa.models import Bridge, MastodonHost, TSettings, WorkerStat, metadata, BridgeStat, BridgeMetadata
+from moa.models import Bridge, MastodonHost, TSettings, metadata, BridgeStat, BridgeMetadata, UserRollup
+from moa.stats import period_starts, worker_series
 
 app = Flask(__name__)
 
@@ -57,6 +52,8 @@ if app.config['TRUST_PROXY_HEADERS']:
 if app.config['SENTRY_DSN']:
     import sentry_sdk
     from sentry_sdk.integrations.flask import FlaskIntegration
+    from sentry_sdk.integrations.logging import LoggingIntegration
+    from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 
     sentry_logging = LoggingIntegration(
             level=logging.INFO,  # Capture info and above as breadcrumbs
@@ -73,6 +70,9 @@ migrate = Migrate(app, db)
 
 db.init_app(app)
 oauth = OAuth(app)
+clients = ClientFactory(app.config['TWITTER_CONSUMER_KEY'],
+                        app.config['TWITTER_CONSUMER_SECRET'],
+                        pool_size=app.config['HTTP_POOL_SIZE'])
 
 if app.config.get('TWITTER_CONSUMER_KEY', None):
     oauth.register(
@@ -89,6 +89,21 @@ if app.config.get('TWITTER_CONSUMER_KEY', None):
             client_kwargs=None,
     )
 
+if app.config['STATS_CACHE_DIR']:
+    chart_cache_backend = FileBackend(app.config['STATS_CACHE_DIR'], app.config['STATS_CACHE_SIZE'])
+else:
+    chart_cache_backend = MemoryBackend(app.config['STATS_CACHE_SIZE'])
+
+chart_cache = ChartCache(chart_cache_backend, app.config['STATS_CACHE_TTL'])
+
+
+def check_database():
+    with app.app_context():
+        db.engine.execute('SELECT 1 from bridge')
+
+
+db_health = HealthMonitor(check_database, app.config['HEALTH_CHECK_INTERVAL'])
+
 # mastodon_scopes = ["write:statuses", "write:media", "read:accounts", "read:statuses"]
 mastodon_scopes = ["write", "read"]
 
@@ -97,9 +112,7 @@ mastodon_scopes = ["write", "read"]
 def before_request():
     g.bridge = None
 
-    try:
-        db.engine.execute('SELECT 1 from bridge')
-    except exc.SQLAlchemyError as e:
+    if request.endpoint != 'health' and not db_health.healthy:
         return "Moa is unavailable at the moment", 503
 
     app.logger.debug(session)
@@ -158,6 +171,9 @@ def options():
         if not bridge.md:
             bridge.md = BridgeMetadata()
 
+        # poll the bridge on the next worker pass so new settings take effect right away
+        bridge.md.next_poll = None
+
         catch_up_twitter(bridge)
         catch_up_mastodon(bridge)
 
@@ -176,13 +192,7 @@ def options():
 def catch_up_twitter(bridge):
     if bridge.twitter_last_id == 0 and bridge.twitter_oauth_token:
         # get twitter ID
-        twitter_api = twitter.Api(
-                consumer_key=app.config['TWITTER_CONSUMER_KEY'],
-                consumer_secret=app.config['TWITTER_CONSUMER_SECRET'],
-                access_token_key=bridge.twitter_oauth_token,
-                access_token_secret=bridge.twitter_oauth_secret,
-                tweet_mode='extended'  # Allow tweets longer than 140 raw characters
-        )
+        twitter_api = clients.twitter(bridge.twitter_oauth_token, bridge.twitter_oauth_secret)
         try:
             tl = twitter_api.GetUserTimeline()
         except TwitterError as e:
@@ -316,7 +326,8 @@ def get_or_create_host(hostname):
                     scopes=mastodon_scopes,
                     api_base_url=f"https://{hostname}",
                     website="https://moa.party/",
-                    redirect_uris=url_for("mastodon_oauthorized", _external=True)
+                    redirect_uris=url_for("mastodon_oauthorized", _external=True),
+                    session=clients.session(hostname)
             )
 
             app.logger.info(f"New host created for {hostname}")
@@ -344,15 +355,7 @@ def mastodon_api(hostname, access_code=None):
     mastodonhost = get_or_create_host(hostname)
 
     if mastodonhost:
-        api = Mastodon(
-                client_id=mastodonhost.client_id,
-                client_secret=mastodonhost.client_secret,
-                api_base_url=f"https://{mastodonhost.hostname}",
-                access_token=access_code,
-                debug_requests=False
-        )
-
-        return api
+        return clients.mastodon(mastodonhost, access_code)
     return None
 
 
@@ -513,6 +516,9 @@ def mastodon_oauthorized():
 
 @app.route('/instagram_activate', methods=["GET"])
 def instagram_activate():
+    from httplib2 import ServerNotFoundError
+    from instagram.client import InstagramAPI
+
     client_id = app.config['INSTAGRAM_CLIENT_ID']
     client_secret = app.config['INSTAGRAM_SECRET']
     redirect_uri = url_for('instagram_oauthorized', _external=True)
@@ -532,6 +538,11 @@ def instagram_activate():
 
 @app.route('/instagram_oauthorized')
 def instagram_oauthorized():
+    from httplib2 import ServerNotFoundError
+    from instagram.client import InstagramAPI
+    from instagram.helper import datetime_to_timestamp
+    from instagram.oauth2 import OAuth2AuthExchangeError
+
     code = request.args.get('code', None)
 
     if code:
@@ -629,148 +640,97 @@ def deactivate():
 
 
 @app.route('/stats/times.svg')
+@chart_cache.cached
 def time_graph():
-    hours = int(request.args.get('hours', 24))
-
-    since = datetime.now() - timedelta(hours=hours)
-    stats_query = db.session.query(WorkerStat).filter(WorkerStat.created > since).with_entities(WorkerStat.created,
-                                                                                                WorkerStat.time,
-                                                                                                WorkerStat.worker)
+    import pygal
 
-    df = pd.read_sql(stats_query.statement, stats_query.session.bind)
-
-    dfs = {}
-    rs = {}
-    l_1 = 0
-    times = {}
-    main_times = pd.DataFrame({'A': []})
+    hours = int(request.args.get('hours', 24))
+    starts, rows = worker_series(db.session, hours)
 
     chart = pygal.Line(title=f"Worker run time (s) ({timespan(hours)})",
                        stroke_style={'width': 2},
                        legend_at_bottom=True)
 
-    i = 1
+    for i in range(1, app.config['WORKER_JOBS'] + 1):
+        # the average run of each hour or day
+        times = {r.start: r.time / max(r.runs, 1) for r in rows if r.worker == i}
 
-    while i <= app.config['WORKER_JOBS']:
-        dfs[i] = df[df['worker'] == i]
+        chart.add(f"{i}", [times.get(start, 0) for start in starts], show_dots=False)
 
-        dfs[i].set_index(['created'], inplace=True)
-        dfs[i].groupby(level=0).mean()
-        rs[i] = dfs[i].resample('h').mean()
-        rs[i] = rs[i].fillna(0)
-        times[i] = rs[i]['time'].tolist()
-
-        if i == 1:
-            l_1 = len(times[i])
+    return chart.render_response()
 
-        c_l = len(times[i])
-        diff = l_1 - c_l
 
-        if diff > 0:
-            new_data = [0] * diff
-            times[i] = new_data + times[i]
+def message_counts(hours):
+    """ The toots, tweets and instas of all workers for each hour or day of a graph """
+    starts, rows = worker_series(db.session, hours)
+    counts = {start: [0, 0, 0] for start in starts}
 
-        chart.add(f"{i}", times[i], show_dots=False)
-        i = i + 1
+    for r in rows:
+        if r.start in counts:
+            totals = counts[r.start]
+            totals[0] += r.toots
+            totals[1] += r.tweets
+            totals[2] += r.instas
 
-    return chart.render_response()
+    return [counts[start] for start in starts]
 
 
 @app.route('/stats/counts.svg')
+@chart_cache.cached
 def count_graph():
-    hours = int(request.args.get('hours', 24))
-    since = datetime.now() - timedelta(hours=hours)
-
-    stats_query = db.session.query(WorkerStat).filter(WorkerStat.created > since).with_entities(WorkerStat.created,
-                                                                                                WorkerStat.toots,
-                                                                                                WorkerStat.tweets,
-                                                                                                WorkerStat.instas)
+    import pygal
 
-    df = pd.read_sql(stats_query.statement, stats_query.session.bind)
-    df.set_index(['created'], inplace=True)
-
-    total = df.to_numpy().sum()
-
-    df.groupby(level=0).sum()
-    r = df.resample('h').sum()
-    r = r.fillna(0)
-
-    toots = r['toots'].tolist()
-    tweets = r['tweets'].tolist()
-    instas = r['instas'].tolist()
+    hours = int(request.args.get('hours', 24))
+    counts = message_counts(hours)
+    total = sum(sum(c) for c in counts)
 
     chart = pygal.StackedBar(title=f"# of Incoming Messages ({timespan(hours)})\n{total} total",
                              human_readable=True,
                              legend_at_bottom=True)
-    chart.add('Toots', toots)
-    chart.add('Tweets', tweets)
-    chart.add('Instas', instas)
+    chart.add('Toots', [c[0] for c in counts])
+    chart.add('Tweets', [c[1] for c in counts])
+    chart.add('Instas', [c[2] for c in counts])
 
     return chart.render_response()
 
 
 @app.route('/stats/percent.svg')
+@chart_cache.cached
 def percent_graph():
-    hours = int(request.args.get('hours', 24))
-    since = datetime.now() - timedelta(hours=hours)
-
-    stats_query = db.session.query(WorkerStat).filter(WorkerStat.created > since).with_entities(WorkerStat.created,
-                                                                                                WorkerStat.toots,
-                                                                                                WorkerStat.tweets,
-                                                                                                WorkerStat.instas)
+    import pygal
 
-    df = pd.read_sql(stats_query.statement, stats_query.session.bind)
-    df.set_index(['created'], inplace=True)
-
-    df.groupby(level=0).sum()
-    r = df.resample('h').sum()
-    r = r.fillna(0)
-
-    r['total'] = r['toots'] + r['tweets'] + r['instas']
-    r['tweets_p'] = r['tweets'] / r['total']
-    r['toots_p'] = r['toots'] / r['total']
-    r['instas_p'] = r['instas'] / r['total']
-
-    toots_p = r['toots_p'].tolist()
-    tweets_p = r['tweets_p'].tolist()
-    instas_p = r['instas_p'].tolist()
+    hours = int(request.args.get('hours', 24))
+    counts = message_counts(hours)
+    ratios = [[n / sum(c) for n in c] if sum(c) else [None, None, None] for c in counts]
 
     chart = pygal.StackedBar(title=f"Ratio of Incoming Messages ({timespan(hours)})",
                              human_readable=True,
                              legend_at_bottom=True)
-    chart.add('Toots', toots_p)
-    chart.add('Tweets', tweets_p)
-    chart.add('Instas', instas_p)
+    chart.add('Toots', [r[0] for r in ratios])
+    chart.add('Tweets', [r[1] for r in ratios])
+    chart.add('Instas', [r[2] for r in ratios])
 
     return chart.render_response()
 
 
 @app.route('/stats/users.svg')
+@chart_cache.cached
 def user_graph():
-    hours = int(request.args.get('hours', 24))
-    since = datetime.now() - timedelta(hours=hours)
+    import pygal
 
-    stats_query = db.session.query(Bridge).filter(Bridge.created > since).filter(Bridge.enabled == 1).with_entities(
-            Bridge.created)
+    hours = int(request.args.get('hours', 24))
+    now = datetime.utcnow()
+    starts = period_starts(now - timedelta(hours=hours), now, 'day')
 
+    new_users = dict(db.session.query(UserRollup.start, UserRollup.users).filter(UserRollup.start >= starts[0]))
     base_count_query = db.session.query(func.count(Bridge.id)).scalar()
 
-    df = pd.read_sql(stats_query.statement, stats_query.session.bind)
-    df.set_index(['created'], inplace=True)
-    df['count'] = 1
-
-    # app.logger.info(df)
-
-    # df.groupby(level=0).sum()
-
-    r = df.resample('d').sum()
-    r = r.fillna(0)
-    r['cum_sum'] = r['count'].cumsum() + base_count_query
-
-    # app.logger.info(r)
+    users = []
+    total = base_count_query
 
-    users = r['cum_sum'].tolist()
-    # app.logger.info(users)
+    for start in starts:
+        total += new_users.get(start, 0)
+        users.append(total)
 
     chart = pygal.Line(title=f"# of Users ({timespan(hours)})",
                        stroke_style={'width': 5},
@@ -785,6 +745,21 @@ def privacy():
     return render_template('privacy.html.j2')
 
 
+@app.route('/health')
+def health():
+    if db_health.check_now():
+        return "OK"
+
+    return "Moa is unavailable at the moment", 503
+
+
+@app.errorhandler(exc.OperationalError)
+def database_unavailable(e):
+    # the database went away since the last check
+    db_health.failed()
+    return "Moa is unavailable at the moment", 503
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
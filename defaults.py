@@ -6,6 +6,8 @@ class DefaultConfig(object):
     # secret key for flask sessions http://flask.pocoo.org/docs/1.0/quickstart/#sessions
     SECRET_KEY = 'this-really-needs-to-be-changed'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # replace pooled connections the database has dropped instead of failing the request
+    SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True}
     TWITTER_CONSUMER_KEY = ''
     TWITTER_CONSUMER_SECRET = ''
     INSTAGRAM_CLIENT_ID = ''
@@ -26,8 +28,33 @@ class DefaultConfig(object):
     TWITTER_BLACKLIST = []
     MASTODON_BLACKLIST = []
     WORKER_JOBS = 1
+    # Keep-alive connections kept open per Mastodon instance (and for Twitter)
+    HTTP_POOL_SIZE = 10
+    # Number of bridges each worker process handles at the same time
+    WORKER_CONCURRENCY = 1
+
+    # Bridges are polled more often the more recently they posted
+    POLL_INTERVAL_MIN = 60
+    POLL_INTERVAL_MAX = 30 * 60
+    # and at least this long after a failed poll
+    POLL_RETRY_INTERVAL = 5 * 60
+
+    # Settings for workers started with --daemon
+    DAEMON_REFRESH_INTERVAL = 300  # seconds between reloads of the bridge list
+    DAEMON_STATS_INTERVAL = 300  # seconds between WorkerStat rows
+
+    # Workers started with --lease share all the bridges instead of using their worker_id
+    WORKER_LEASES = False
+    LEASE_TIME = 600  # seconds before a crashed worker's bridges can be claimed by another
+    LEASE_POLL_INTERVAL = 10  # seconds to wait before looking again when nothing is due
+
     MAX_MESSAGES_PER_RUN = 5
 
+    # Downloaded attachments are kept here so boosts and retries don't fetch them again. None disables it.
+    MEDIA_CACHE_DIR = 'tmp/media'
+    MEDIA_CACHE_SIZE = 1024 * 1024 * 1024  # bytes
+    MEDIA_CACHE_TTL = 24 * 60 * 60  # seconds
+
     # This option prevents Twitter replies and mentions from occuring when a toot contains @user@twitter.com. This
     # behavior is against Twitter's rules.
     SANITIZE_TWITTER_HANDLES = True
@@ -35,6 +62,14 @@ class DefaultConfig(object):
     SEND_DEFERRED_EMAIL = False
     SEND_DEFER_FAILED_EMAIL = False
     MAINTENANCE_MODE = False
+    # seconds between the app's background database checks
+    HEALTH_CHECK_INTERVAL = 15
+
+    # Rendered /stats charts are reused for this long. They're kept in memory unless a directory is set,
+    # which lets every app process share them.
+    STATS_CACHE_TTL = 5 * 60  # seconds
+    STATS_CACHE_DIR = None
+    STATS_CACHE_SIZE = 16 * 1024 * 1024  # bytes
 
     STATS_POSTER_BASE_URL = None
     STATS_POSTER_ACCESS_TOKEN = None
@@ -0,0 +1,30 @@
+"""add bridgemetadata lease columns
+
+Revision ID: 4b8e0d1f6c37
+Revises: 9f2d6b3e8a15
+Create Date: 2020-05-26 09:31:47.206518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b8e0d1f6c37'
+down_revision = '9f2d6b3e8a15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('bridgemetadata', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('lease_owner', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('lease_expires', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_bridgemetadata_next_poll', ['next_poll'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('bridgemetadata', schema=None) as batch_op:
+        batch_op.drop_index('ix_bridgemetadata_next_poll')
+        batch_op.drop_column('lease_expires')
+        batch_op.drop_column('lease_owner')
@@ -0,0 +1,26 @@
+"""add bridgemetadata next_poll
+
+Revision ID: 7c1e5a9d2b40
+Revises: 3ac471544742
+Create Date: 2020-05-20 10:12:31.480112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e5a9d2b40'
+down_revision = '3ac471544742'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('bridgemetadata', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('next_poll', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('bridgemetadata', schema=None) as batch_op:
+        batch_op.drop_column('next_poll')
@@ -0,0 +1,26 @@
+"""index bridgemetadata on worker_id and next_poll
+
+Revision ID: 9f2d6b3e8a15
+Revises: 7c1e5a9d2b40
+Create Date: 2020-05-22 18:40:03.118924
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9f2d6b3e8a15'
+down_revision = '7c1e5a9d2b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('bridgemetadata', schema=None) as batch_op:
+        batch_op.create_index('ix_bridgemetadata_worker_id_next_poll', ['worker_id', 'next_poll'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('bridgemetadata', schema=None) as batch_op:
+        batch_op.drop_index('ix_bridgemetadata_worker_id_next_poll')
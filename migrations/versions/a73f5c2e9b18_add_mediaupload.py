@@ -0,0 +1,35 @@
+"""add mediaupload table
+
+Revision ID: a73f5c2e9b18
+Revises: e61c2a7b94d0
+Create Date: 2020-06-02 11:47:30.518274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a73f5c2e9b18'
+down_revision = 'e61c2a7b94d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('mediaupload',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created', sa.DateTime(), nullable=True),
+    sa.Column('bridge_id', sa.Integer(), nullable=False),
+    sa.Column('target', sa.String(length=10), nullable=False),
+    sa.Column('url_hash', sa.String(length=64), nullable=False),
+    sa.Column('media_id', sa.String(length=64), nullable=False),
+    sa.ForeignKeyConstraint(['bridge_id'], ['bridge.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_mediaupload_bridge_id_target_url_hash', 'mediaupload', ['bridge_id', 'target', 'url_hash'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_mediaupload_bridge_id_target_url_hash', table_name='mediaupload')
+    op.drop_table('mediaupload')
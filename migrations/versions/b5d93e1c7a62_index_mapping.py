@@ -0,0 +1,28 @@
+"""index mapping on mastodon_id and twitter_id
+
+Revision ID: b5d93e1c7a62
+Revises: a73f5c2e9b18
+Create Date: 2020-06-09 10:12:44.730165
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d93e1c7a62'
+down_revision = 'a73f5c2e9b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('mapping', schema=None) as batch_op:
+        batch_op.create_index('ix_mapping_mastodon_id_created', ['mastodon_id', 'created'], unique=False)
+        batch_op.create_index('ix_mapping_twitter_id_created', ['twitter_id', 'created'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('mapping', schema=None) as batch_op:
+        batch_op.drop_index('ix_mapping_twitter_id_created')
+        batch_op.drop_index('ix_mapping_mastodon_id_created')
@@ -0,0 +1,37 @@
+"""hourly workerstat and bridgestat rows
+
+Revision ID: c2e48a9f1d73
+Revises: b5d93e1c7a62
+Create Date: 2020-06-12 16:03:27.845110
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e48a9f1d73'
+down_revision = 'b5d93e1c7a62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('workerstat', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('runs', sa.Integer(), server_default='0', nullable=True))
+        batch_op.create_index('ix_workerstat_created', ['created'], unique=False)
+
+    # every row used to be a single run
+    op.execute("UPDATE workerstat SET runs = 1")
+
+    with op.batch_alter_table('bridgestat', schema=None) as batch_op:
+        batch_op.create_index('ix_bridgestat_bridge_id_created', ['bridge_id', 'created'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('bridgestat', schema=None) as batch_op:
+        batch_op.drop_index('ix_bridgestat_bridge_id_created')
+
+    with op.batch_alter_table('workerstat', schema=None) as batch_op:
+        batch_op.drop_index('ix_workerstat_created')
+        batch_op.drop_column('runs')
@@ -0,0 +1,46 @@
+"""add statrollup and userrollup tables
+
+Revision ID: d8a1f4b7c3e5
+Revises: c2e48a9f1d73
+Create Date: 2020-06-15 09:21:53.402716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8a1f4b7c3e5'
+down_revision = 'c2e48a9f1d73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('statrollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.String(length=4), nullable=False),
+    sa.Column('start', sa.DateTime(), nullable=False),
+    sa.Column('worker', sa.Integer(), nullable=False),
+    sa.Column('toots', sa.Integer(), nullable=True),
+    sa.Column('tweets', sa.Integer(), nullable=True),
+    sa.Column('instas', sa.Integer(), nullable=True),
+    sa.Column('time', sa.Float(), nullable=True),
+    sa.Column('runs', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_statrollup_period_start', 'statrollup', ['period', 'start'], unique=False)
+    op.create_table('userrollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('start', sa.DateTime(), nullable=False),
+    sa.Column('users', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_userrollup_start', 'userrollup', ['start'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_userrollup_start', table_name='userrollup')
+    op.drop_table('userrollup')
+    op.drop_index('ix_statrollup_period_start', table_name='statrollup')
+    op.drop_table('statrollup')
@@ -0,0 +1,26 @@
+"""add bridgemetadata avg_time
+
+Revision ID: e61c2a7b94d0
+Revises: 4b8e0d1f6c37
+Create Date: 2020-05-28 14:05:12.661903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e61c2a7b94d0'
+down_revision = '4b8e0d1f6c37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('bridgemetadata', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('avg_time', sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('bridgemetadata', schema=None) as batch_op:
+        batch_op.drop_column('avg_time')
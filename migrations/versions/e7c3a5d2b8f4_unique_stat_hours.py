@@ -0,0 +1,60 @@
+"""one workerstat and bridgestat row per hour
+
+Revision ID: e7c3a5d2b8f4
+Revises: d8a1f4b7c3e5
+Create Date: 2020-06-18 11:42:09.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7c3a5d2b8f4'
+down_revision = 'd8a1f4b7c3e5'
+branch_labels = None
+depends_on = None
+
+
+def merge_duplicates(table, key, columns):
+    """ Fold rows that share a key into the first of them so the key can be made unique """
+    conn = op.get_bind()
+    duplicates = conn.execute(sa.text(
+            f"SELECT {', '.join(key)} FROM {table} GROUP BY {', '.join(key)} HAVING COUNT(*) > 1")).fetchall()
+    where = ' AND '.join(f"{c} = :{c}" for c in key)
+
+    for row in duplicates:
+        params = dict(zip(key, row))
+        totals = conn.execute(sa.text(
+                f"SELECT MIN(id), {', '.join(f'SUM({c})' for c in columns)} FROM {table} WHERE {where}"),
+                params).fetchone()
+        keep = totals[0]
+
+        conn.execute(sa.text(f"UPDATE {table} SET {', '.join(f'{c} = :new_{c}' for c in columns)} WHERE id = :id"),
+                     dict(id=keep, **{f"new_{c}": v for c, v in zip(columns, totals[1:])}))
+        conn.execute(sa.text(f"DELETE FROM {table} WHERE {where} AND id != :id"), dict(params, id=keep))
+
+
+def upgrade():
+    # two workers could both insert the same hour before this
+    merge_duplicates('workerstat', ['worker', 'created'], ['toots', 'tweets', 'instas', 'time', 'runs'])
+    merge_duplicates('bridgestat', ['bridge_id', 'created'], ['toots', 'tweets', 'instas'])
+
+    with op.batch_alter_table('workerstat', schema=None) as batch_op:
+        batch_op.create_index('ix_workerstat_worker_created', ['worker', 'created'], unique=True)
+
+    with op.batch_alter_table('bridgestat', schema=None) as batch_op:
+        batch_op.drop_index('ix_bridgestat_bridge_id_created')
+        batch_op.create_index('ix_bridgestat_bridge_id_created', ['bridge_id', 'created'], unique=True)
+
+    # the hourly rows were added to without updating avg
+    op.execute("UPDATE workerstat SET avg = time / (toots + tweets + instas) WHERE toots + tweets + instas > 0")
+
+
+def downgrade():
+    with op.batch_alter_table('bridgestat', schema=None) as batch_op:
+        batch_op.drop_index('ix_bridgestat_bridge_id_created')
+        batch_op.create_index('ix_bridgestat_bridge_id_created', ['bridge_id', 'created'], unique=False)
+
+    with op.batch_alter_table('workerstat', schema=None) as batch_op:
+        batch_op.drop_index('ix_workerstat_worker_created')
@@ -1,13 +1,17 @@
+import argparse
 import importlib
 import logging
 import os
+import statistics
 import sys
+from collections import Counter
 
 from sqlalchemy import create_engine, exc
 from sqlalchemy.orm import Session
 
 from moa.helpers import FORMAT
 from moa.models import Bridge, Mapping, WorkerStat, BridgeMetadata
+from moa.scheduler import bridge_cost, pack_bridges
 
 moa_config = os.environ.get('MOA_CONFIG', 'DevelopmentConfig')
 c = getattr(importlib.import_module('config'), moa_config)
@@ -22,6 +26,11 @@ if c.SENTRY_DSN:
     )
     sentry_sdk.init(dsn=c.SENTRY_DSN, integrations=[sentry_logging])
 
+parser = argparse.ArgumentParser(description='Spread the bridges over the workers by how long they take to process')
+parser.add_argument('--dry-run', dest='dry_run', action='store_true',
+                    help="Report each worker's projected load without changing anything")
+args = parser.parse_args()
+
 logging.basicConfig(format=FORMAT)
 
 l = logging.getLogger('balance')
@@ -43,18 +52,37 @@ except exc.SQLAlchemyError as e:
 
 session = Session(engine)
 
-bridges = session.query(Bridge).filter_by(enabled=True)
-w = 1
+bridges = session.query(Bridge).filter_by(enabled=True).all()
 
 for b in bridges:
-    print(w, b)
-
     if not b.md:
         b.md = BridgeMetadata()
 
-    b.md.worker_id = w
-    w += 1
-    if w > c.WORKER_JOBS:
-        w = 1
+# bridges that haven't been timed yet are assumed to be typical
+timed = [b.md.avg_time for b in bridges if b.md.avg_time is not None]
+default_time = statistics.median(timed) if timed else 1.0
+
+costs = {b.id: bridge_cost(b.md, c, default_time) for b in bridges}
+assignment, loads = pack_bridges(costs, c.WORKER_JOBS)
+
+current_loads = Counter()
+counts = Counter(assignment.values())
+
+for b in bridges:
+    current_loads[b.md.worker_id] += costs[b.id]
+
+print(f"{len(bridges)} bridges, {len(timed)} timed, {default_time:.2f}s per run for the rest")
+print("worker  bridges  current load  projected load  (busy seconds per hour)")
+
+for worker_id in sorted(loads):
+    print(f"{worker_id:>6}  {counts[worker_id]:>7}  {current_loads[worker_id]:>12.0f}  {loads[worker_id]:>14.0f}")
+
+if args.dry_run:
+    session.rollback()
+    sys.exit()
+
+for b in bridges:
+    l.debug(f"{b.id}: worker {b.md.worker_id} -> {assignment[b.id]}")
+    b.md.worker_id = assignment[b.id]
 
 session.commit()
@@ -0,0 +1,154 @@
+import hashlib
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import Response, request
+
+CacheEntry = namedtuple('CacheEntry', ['expires', 'etag', 'mimetype', 'body'])
+
+
+class MemoryBackend:
+    """ Keeps rendered charts in this process, dropping the least recently used past max_size bytes """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry:
+                self._entries.move_to_end(key)
+
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+
+            if old:
+                self._size -= len(old.body)
+
+            self._entries[key] = entry
+            self._size += len(entry.body)
+
+            while self._size > self.max_size and self._entries:
+                _, dropped = self._entries.popitem(last=False)
+                self._size -= len(dropped.body)
+
+
+class FileBackend:
+    """
+    Keeps rendered charts in a directory so every app process shares them. The least
+    recently written files are removed once they add up to more than max_size bytes.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        try:
+            with open(self._file_name(key), 'rb') as f:
+                expires, etag, mimetype, body = f.read().split(b'\n', 3)
+
+        except (OSError, ValueError):
+            return None
+
+        return CacheEntry(float(expires), etag.decode(), mimetype.decode(), body)
+
+    def set(self, key, entry):
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+        with os.fdopen(fd, 'wb') as f:
+            f.write(f"{entry.expires}\n{entry.etag}\n{entry.mimetype}\n".encode())
+            f.write(entry.body)
+
+        os.replace(tmp_name, self._file_name(key))
+        self.evict()
+
+    def evict(self):
+        files = []
+
+        for e in os.scandir(self.directory):
+            try:
+                stat = e.stat()
+            except FileNotFoundError:
+                continue
+
+            files.append((stat.st_mtime, stat.st_size, e.path))
+
+        files.sort()
+        size = sum(s for _, s, _ in files)
+
+        for _, file_size, path in files:
+            if size <= self.max_size:
+                break
+
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+            size -= file_size
+
+    def _file_name(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+
+class ChartCache:
+    """
+    Caches the rendered output of the stats chart views for ttl seconds, keyed by the route
+    and the hours it covers.
+
+    Responses carry an ETag and a max-age so browsers and proxies can reuse them too, and a
+    request whose If-None-Match still matches gets an empty 304.
+    """
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+
+    def cached(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = f"{request.path}?hours={request.args.get('hours', 24, type=int)}"
+            now = time.time()
+            entry = self.backend.get(key)
+
+            if entry is None or entry.expires <= now:
+                response = view(*args, **kwargs)
+
+                if response.status_code != 200:
+                    return response
+
+                body = response.get_data()
+                entry = CacheEntry(now + self.ttl, hashlib.sha1(body).hexdigest(), response.mimetype, body)
+                self.backend.set(key, entry)
+
+            return self.respond(entry, now)
+
+        return wrapper
+
+    @staticmethod
+    def respond(entry, now):
+        if entry.etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(entry.body, mimetype=entry.mimetype)
+
+        response.set_etag(entry.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = max(math.ceil(entry.expires - now), 0)
+
+        return response
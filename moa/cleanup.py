@@ -7,7 +7,8 @@ from moa.helpers import FORMAT
 from sqlalchemy import create_engine, exc
 from sqlalchemy.orm import Session
 
-from moa.models import Bridge, Mapping, WorkerStat, MastodonHost, TSettings, BridgeStat
+from moa.models import Bridge, Mapping, WorkerStat, MastodonHost, TSettings, BridgeStat, MediaUpload, StatRollup, \
+    MEDIA_UPLOAD_TTL
 
 moa_config = os.environ.get('MOA_CONFIG', 'DevelopmentConfig')
 c = getattr(importlib.import_module('config'), moa_config)
@@ -48,6 +49,8 @@ target_date = datetime.now() - timedelta(days=30)
 
 bridges = session.query(Bridge).filter_by(enabled=False).filter_by(updated=None)
 for b in bridges:
+    session.query(MediaUpload).filter(MediaUpload.bridge_id == b.id).delete()
+
     settings = b.t_settings
     md = b.md
     session.delete(b)
@@ -59,6 +62,7 @@ for b in bridges:
 bridges = session.query(Bridge).filter_by(enabled=False).filter(Bridge.updated < target_date)
 for b in bridges:
     bridge_stats = session.query(BridgeStat).filter(BridgeStat.bridge_id == b.id).delete()
+    session.query(MediaUpload).filter(MediaUpload.bridge_id == b.id).delete()
     session.commit()
 
     settings = b.t_settings
@@ -80,9 +84,16 @@ target_date = datetime.now() - timedelta(days=120)
 session.query(Mapping).filter(Mapping.created < target_date).delete()
 session.commit()
 
+# Remove uploads that are too old to be attached to a post any more
+target_date = datetime.utcnow() - timedelta(seconds=MEDIA_UPLOAD_TTL)
+session.query(MediaUpload).filter(MediaUpload.created < target_date).delete()
+session.commit()
+
 # Remove worker stats older than 4 months
 target_date = datetime.now() - timedelta(days=120)
 session.query(WorkerStat).filter(WorkerStat.created < target_date).delete()
+# the daily rollups are kept for the long term graphs
+session.query(StatRollup).filter(StatRollup.period == 'hour', StatRollup.start < target_date).delete()
 session.commit()
 
 # Remove hosts with no bridges
@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+
+import requests
+import twitter
+from mastodon import Mastodon
+from requests.adapters import HTTPAdapter
+
+TWITTER_SESSION_KEY = 'twitter'
+
+
+class ClientFactory:
+    """
+    Hands out Mastodon and Twitter API clients that share pooled HTTP sessions.
+
+    There is one requests.Session per Mastodon hostname (and one for Twitter) so all the
+    bridges on a big instance reuse the same warm TLS connections. Clients are cached by
+    host and credentials. Mastodon clients without an access token are used for the
+    OAuth dance and get mutated by log_in() so those are never cached.
+    """
+
+    def __init__(self, twitter_consumer_key='', twitter_consumer_secret='', pool_size=10,
+                 max_sessions=256, max_clients=5000):
+        self.twitter_consumer_key = twitter_consumer_key
+        self.twitter_consumer_secret = twitter_consumer_secret
+        self.pool_size = pool_size
+        self.max_sessions = max_sessions
+        self.max_clients = max_clients
+
+        self._sessions = OrderedDict()
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def session(self, hostname):
+        """ The shared, pooled session for a host """
+        with self._lock:
+            s = self._sessions.get(hostname)
+
+            if s:
+                self._sessions.move_to_end(hostname)
+                return s
+
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+            s.mount('https://', adapter)
+            s.mount('http://', adapter)
+
+            self._sessions[hostname] = s
+
+            while len(self._sessions) > self.max_sessions:
+                _, old = self._sessions.popitem(last=False)
+                # clients still holding on to it will simply open new connections
+                old.close()
+
+            return s
+
+    def mastodon(self, host, access_token=None, **kwargs):
+        """
+        A Mastodon client for a MastodonHost. Extra keyword arguments are passed on to
+        Mastodon() and are part of the cache key.
+        """
+        key = ('mastodon', host.hostname, host.client_id, access_token, tuple(sorted(kwargs.items())))
+
+        if access_token:
+            api = self._cached(key)
+
+            if api:
+                return api
+
+        api = Mastodon(
+                client_id=host.client_id,
+                client_secret=host.client_secret,
+                api_base_url=f"https://{host.hostname}",
+                access_token=access_token,
+                debug_requests=False,
+                session=self.session(host.hostname),
+                **kwargs
+        )
+
+        if access_token:
+            self._store(key, api)
+
+        return api
+
+    def twitter(self, access_token_key, access_token_secret):
+        key = ('twitter', access_token_key, access_token_secret)
+        api = self._cached(key)
+
+        if not api:
+            api = twitter.Api(
+                    consumer_key=self.twitter_consumer_key,
+                    consumer_secret=self.twitter_consumer_secret,
+                    access_token_key=access_token_key,
+                    access_token_secret=access_token_secret,
+                    tweet_mode='extended'  # Allow tweets longer than 140 raw characters
+            )
+
+            # python-twitter signs every request itself so one session can serve every account
+            api._session = self.session(TWITTER_SESSION_KEY)
+
+            self._store(key, api)
+
+        return api
+
+    def _cached(self, key):
+        with self._lock:
+            api = self._clients.get(key)
+
+            if api:
+                self._clients.move_to_end(key)
+
+            return api
+
+    def _store(self, key, api):
+        with self._lock:
+            self._clients[key] = api
+
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
@@ -0,0 +1,69 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger('health')
+
+
+class HealthMonitor:
+    """
+    Keeps the result of a health check up to date from a background thread so requests can
+    read it for free.
+
+    check() should raise if the service is down. The thread is started by the first call to
+    healthy rather than on import so that each process forked by the app server runs its own.
+    """
+
+    def __init__(self, check, interval):
+        self.check = check
+        self.interval = interval
+        self.last_checked = None
+        self._healthy = True
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def healthy(self):
+        if self._thread is None:
+            self.start()
+
+        return self._healthy
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self.check_now()
+                self._thread = threading.Thread(target=self._run, name='health', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def check_now(self):
+        try:
+            self.check()
+
+        except Exception as e:
+            if self._healthy:
+                logger.error(f"Health check failed: {e}")
+
+            self._healthy = False
+
+        else:
+            if not self._healthy:
+                logger.info("Health check passed again")
+
+            self._healthy = True
+
+        self.last_checked = time.time()
+
+        return self._healthy
+
+    def failed(self):
+        """ Mark the service down until the next check, e.g. when a request couldn't reach it """
+        self._healthy = False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check_now()
@@ -1,11 +1,6 @@
 import re
 import smtplib
 
-import twitter
-from flask import render_template
-from flask_mail import Message, Mail
-from twitter import TwitterError
-
 FORMAT = "%(asctime)-15s [%(process)d] [%(filename)s:%(lineno)s : %(funcName)s()] %(message)s"
 
 def blacklisted(name, bl):
@@ -17,6 +12,12 @@ def blacklisted(name, bl):
 
 
 def email_bridge_details(app, bridge):
+    # only the web app sends these, so the scripts importing FORMAT don't load flask and twitter
+    import twitter
+    from flask import render_template
+    from flask_mail import Message, Mail
+    from twitter import TwitterError
+
     if app.config.get('MAIL_SERVER', None):
         mail = Mail(app)
 
@@ -55,6 +56,9 @@ def email_bridge_details(app, bridge):
 
 
 def send_blacklisted_email(app, username):
+    from flask import render_template
+    from flask_mail import Message, Mail
+
     if app.config.get('MAIL_SERVER', None):
         mail = Mail(app)
         body = render_template('access_denied.txt.j2', user=f"https://twitter.com/{username}")
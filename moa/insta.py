@@ -3,9 +3,7 @@ import logging
 import re
 from datetime import datetime, timezone
 
-from instagram.helper import datetime_to_timestamp
-
-from moa.message import Message
+from moa.message import Message, memoized_property
 from moa.models import CON_XP_ONLYIF, CON_XP_ONLYIF_TAGS, CON_XP_UNLESS, CON_XP_UNLESS_TAGS
 from moa.tweet import HOUR_CUTOFF
 
@@ -13,6 +11,7 @@ logger = logging.getLogger('worker')
 
 
 class Insta(Message):
+    __slots__ = ('__content',)
 
     def __init__(self, settings, data):
         super().__init__(settings, data)
@@ -20,8 +19,10 @@ class Insta(Message):
         self.type = 'Insta'
         self.__content = None
 
-    @property
+    @memoized_property
     def id(self):
+        from instagram.helper import datetime_to_timestamp
+
         ts = datetime_to_timestamp(self.data.created_time)
 
         return ts
@@ -54,7 +55,7 @@ class Insta(Message):
 
         return self.__content
 
-    @property
+    @memoized_property
     def media_attachments(self):
         """ Array of { 'url': 'blah', 'description': 'blah'} """
 
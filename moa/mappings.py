@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from moa.models import Mapping
+
+
+class MappingBuffer:
+    """
+    The Mappings between toots and tweets of one bridge.
+
+    The posters flush() the new mappings in the same commit as the last_id they advance,
+    which is one INSERT per posted part, so a crash never loses a part that was posted.
+    Every mapping that has been added or looked up is remembered, so a thread posted in
+    one run finds the parts it replies to without going back to the DB.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.pending = []
+        self._tweets = {}
+        self._toots = {}
+
+    def add(self, mastodon_id, twitter_id):
+        self.pending.append({'mastodon_id': mastodon_id,
+                             'twitter_id': twitter_id,
+                             'created': datetime.utcnow()})
+
+        # a toot split over several tweets is replied to from its last part
+        self._tweets[mastodon_id] = twitter_id
+        self._toots.setdefault(twitter_id, mastodon_id)
+
+    def twitter_id(self, mastodon_id):
+        """ The last tweet a toot was posted as, or None """
+        if mastodon_id not in self._tweets:
+            row = self.session.query(Mapping.twitter_id) \
+                .filter(Mapping.mastodon_id == mastodon_id) \
+                .order_by(Mapping.created.desc(), Mapping.id.desc()) \
+                .first()
+
+            self._tweets[mastodon_id] = row.twitter_id if row else None
+
+        return self._tweets[mastodon_id]
+
+    def mastodon_id(self, twitter_id):
+        """ The toot a tweet was posted as, or None """
+        if twitter_id not in self._toots:
+            row = self.session.query(Mapping.mastodon_id) \
+                .filter(Mapping.twitter_id == twitter_id) \
+                .order_by(Mapping.created, Mapping.id) \
+                .first()
+
+            self._toots[twitter_id] = row.mastodon_id if row else None
+
+        return self._toots[twitter_id]
+
+    def flush(self):
+        """ Insert the new mappings. They are committed along with the rest of the session. """
+        if self.pending:
+            self.session.bulk_insert_mappings(Mapping, self.pending)
+            self.pending = []
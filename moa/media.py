@@ -0,0 +1,283 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError
+
+from moa.helpers import MoaMediaUploadException
+
+logger = logging.getLogger('worker')
+
+# Attachments are copied to disk this many bytes at a time
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 30
+
+PROBE_CONCURRENCY = 4
+PROBE_CACHE_SIZE = 4096
+
+# Sizes of media URLs we've already asked about. Media URLs never change what they point to.
+_probe_cache = OrderedDict()
+_probe_lock = threading.Lock()
+_probe_session = requests.Session()
+_probe_session.mount('https://', HTTPAdapter(pool_maxsize=PROBE_CONCURRENCY))
+
+
+def download(url, max_size, directory=None):
+    """
+    Stream an attachment into a temporary file, a chunk at a time so a large video never
+    has to fit in memory, and give up as soon as it turns out to be bigger than max_size.
+
+    Returns the name of the file and the response, whose headers are still available.
+    """
+    fd, file_name = tempfile.mkstemp(dir=directory)
+
+    try:
+        with os.fdopen(fd, 'wb') as f, requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            # don't hand an error page to the upload as if it was the attachment
+            response.raise_for_status()
+
+            length = response.headers.get('Content-Length')
+
+            if length and length.isdigit() and int(length) > max_size:
+                raise MoaMediaUploadException(f"Attachment is too big ({length} bytes)")
+
+            size = 0
+
+            for chunk in response.iter_content(CHUNK_SIZE):
+                size += len(chunk)
+
+                if size > max_size:
+                    raise MoaMediaUploadException(f"Attachment is bigger than {max_size} bytes")
+
+                f.write(chunk)
+
+    except requests.HTTPError as e:
+        logger.error(f"{e}")
+        os.unlink(file_name)
+        raise MoaMediaUploadException(f"Download failed ({e.response.status_code})") from e
+
+    except (requests.RequestException, HTTPError, OSError) as e:
+        logger.error(f"{e}")
+        os.unlink(file_name)
+        raise MoaMediaUploadException("Connection Error downloading attachments") from e
+
+    except MoaMediaUploadException as e:
+        logger.error(f"{url}: {e}")
+        os.unlink(file_name)
+        raise
+
+    return file_name, response
+
+
+def probe_size(url):
+    """ The size of the file at url according to a HEAD request, or None if it isn't available """
+    with _probe_lock:
+        if url in _probe_cache:
+            _probe_cache.move_to_end(url)
+            return _probe_cache[url]
+
+    try:
+        response = _probe_session.head(url, timeout=DOWNLOAD_TIMEOUT)
+    except (requests.RequestException, HTTPError) as e:
+        logger.error(f"{e}")
+        raise MoaMediaUploadException("Connection Error fetching attachments") from e
+
+    if not response.ok:
+        # might be a temporary problem so it isn't cached
+        return None
+
+    length = response.headers.get('content-length', '')
+    size = int(length) if length.isdigit() else None
+
+    with _probe_lock:
+        _probe_cache[url] = size
+
+        while len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+
+    return size
+
+
+def file_hash(file_name):
+    h = hashlib.sha256()
+
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+class MediaCache:
+    """
+    Keeps downloaded attachments on disk so media that shows up again, because a toot
+    was boosted by several bridged accounts or a post is retried on the next run, is
+    only downloaded once.
+
+    Files are stored by the hash of their content, so the same image behind different
+    URLs is stored once, and looked up through small index files named after the hash of
+    the URL. Index entries and files expire after ttl seconds, and the least recently
+    used files are evicted early when the cache grows past max_size bytes. Everything is
+    written with atomic renames so several worker processes can share the directory.
+    """
+
+    def __init__(self, directory, max_size, ttl):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._urls = os.path.join(directory, 'urls')
+        self._files = os.path.join(directory, 'files')
+        self._tmp = os.path.join(directory, 'tmp')
+        self._lock = threading.Lock()
+        self._evicted = time.time()
+
+        for d in (self._urls, self._files, self._tmp):
+            os.makedirs(d, exist_ok=True)
+
+        self._size = sum(entry.stat().st_size for entry in os.scandir(self._files))
+
+    def fetch(self, url, max_size):
+        """
+        Return a private copy of the attachment at url, which the caller may rename or
+        delete, and its content type.
+        """
+        entry = self._lookup(url)
+
+        if entry:
+            content_hash, content_type = entry
+
+            try:
+                copy = self._copy(content_hash)
+            except FileNotFoundError:
+                # evicted by another worker since we looked it up
+                pass
+            else:
+                with self._lock:
+                    self.hits += 1
+
+                return copy, content_type
+
+        with self._lock:
+            self.misses += 1
+
+        file_name, response = download(url, max_size, directory=self._tmp)
+        content_type = response.headers.get('Content-Type', '')
+
+        if response.ok:
+            try:
+                self._store(url, file_name, content_type)
+            except OSError as e:
+                # the cache is only an optimisation
+                logger.warning(f"Media cache: {e}")
+
+        return file_name, content_type
+
+    def _lookup(self, url):
+        index_name = self._index_name(url)
+
+        try:
+            if time.time() - os.path.getmtime(index_name) > self.ttl:
+                os.unlink(index_name)
+                return None
+
+            with open(index_name) as f:
+                content_hash, content_type = f.read().split('\n', 1)
+
+        except (OSError, ValueError):
+            return None
+
+        return content_hash, content_type
+
+    def _copy(self, content_hash):
+        cached_name = os.path.join(self._files, content_hash)
+        fd, copy = tempfile.mkstemp(dir=self._tmp)
+        os.close(fd)
+        os.unlink(copy)
+
+        try:
+            os.link(cached_name, copy)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            # no hard links on this filesystem
+            shutil.copyfile(cached_name, copy)
+
+        # mtime records when a file was last used for the LRU
+        os.utime(cached_name)
+
+        return copy
+
+    def _store(self, url, file_name, content_type):
+        content_hash = file_hash(file_name)
+        cached_name = os.path.join(self._files, content_hash)
+
+        try:
+            os.link(file_name, cached_name)
+        except FileExistsError:
+            # keep the file at least as fresh as the index entries pointing at it
+            os.utime(cached_name)
+        else:
+            with self._lock:
+                self._size += os.path.getsize(cached_name)
+
+        fd, index_tmp = tempfile.mkstemp(dir=self._tmp)
+
+        with os.fdopen(fd, 'w') as f:
+            f.write(f"{content_hash}\n{content_type}")
+
+        os.replace(index_tmp, self._index_name(url))
+
+        if self._size > self.max_size or time.time() - self._evicted > self.ttl:
+            self.evict()
+
+    def evict(self, now=None):
+        """ Drop expired index entries and files, then the least recently used files until the cache fits """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            self._evicted = now
+
+            for entry in os.scandir(self._urls):
+                try:
+                    if now - entry.stat().st_mtime > self.ttl:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+            files = []
+
+            for entry in os.scandir(self._files):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+            files.sort()
+            self._size = sum(size for _, size, _ in files)
+
+            for mtime, size, path in files:
+                if self._size <= self.max_size and now - mtime <= self.ttl:
+                    continue
+
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+                self._size -= size
+
+    def _index_name(self, url):
+        return os.path.join(self._urls, hashlib.sha256(url.encode('utf-8')).hexdigest())
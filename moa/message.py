@@ -3,7 +3,34 @@ from typing import Any, List
 from moa.models import TSettings
 
 
+class memoized_property:
+    """
+    A property that is worked out the first time it's read and then remembered. The data
+    behind a message doesn't change once it has been fetched so nothing is invalidated.
+
+    Messages have no __dict__ so the values are kept in their _cache.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        try:
+            return instance._cache[self.name]
+        except KeyError:
+            value = instance._cache[self.name] = self.func(instance)
+            return value
+
+
 class Message:
+    # workers hold a whole batch of these
+    __slots__ = ('message_parts', 'settings', 'data', 'type', 'cw', '_cache')
+
     class Meta:
         abstract = True
 
@@ -13,6 +40,7 @@ class Message:
         self.data = data
         self.type = 'Message'
         self.cw = None
+        self._cache = {}
 
     def prepare_for_post(self, length=1):
         raise Exception("Needs Implementation")
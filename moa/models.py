@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
 from sqlalchemy import MetaData, Column, Integer, String, DateTime, BigInteger, ForeignKey, Boolean, PickleType, Float, \
-    event
+    event, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -150,6 +150,12 @@ class Bridge(Base):
 
 class Mapping(Base):
     __tablename__ = 'mapping'
+    __table_args__ = (
+        # replies are threaded onto the most recent post of the status they reply to
+        Index('ix_mapping_mastodon_id_created', 'mastodon_id', 'created'),
+        Index('ix_mapping_twitter_id_created', 'twitter_id', 'created'),
+    )
+
     id = Column(Integer, primary_key=True)
     mastodon_id = Column(BigInteger, default=0)
     twitter_id = Column(BigInteger, default=0)
@@ -157,7 +163,13 @@ class Mapping(Base):
 
 
 class WorkerStat(Base):
+    """ A worker's messages, busy time and runs for an hour, see moa.stats """
     __tablename__ = 'workerstat'
+    __table_args__ = (
+        Index('ix_workerstat_created', 'created'),
+        Index('ix_workerstat_worker_created', 'worker', 'created', unique=True),
+    )
+
     id = Column(Integer, primary_key=True)
     created = Column(DateTime, default=datetime.utcnow)
 
@@ -167,6 +179,7 @@ class WorkerStat(Base):
 
     time = Column(Float, default=0.0)
     avg = Column(Float, default=0.0)
+    runs = Column(Integer, default=0, server_default="0")
 
     worker = Column(Integer, nullable=False)
 
@@ -196,7 +209,12 @@ class WorkerStat(Base):
 
 
 class BridgeStat(Base):
+    """ The messages posted for a bridge in an hour, see moa.stats """
     __tablename__ = 'bridgestat'
+    __table_args__ = (
+        Index('ix_bridgestat_bridge_id_created', 'bridge_id', 'created', unique=True),
+    )
+
     id = Column(Integer, primary_key=True)
     created = Column(DateTime, default=datetime.utcnow)
     bridge_id = Column(Integer, ForeignKey('bridge.id'), nullable=True)
@@ -225,8 +243,65 @@ class BridgeStat(Base):
         self.instas += 1
 
 
+class StatRollup(Base):
+    """ WorkerStat added up per worker by hour or by day for the stats graphs, see moa.rollup """
+    __tablename__ = 'statrollup'
+    __table_args__ = (
+        Index('ix_statrollup_period_start', 'period', 'start'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    period = Column(String(4), nullable=False)  # hour or day
+    start = Column(DateTime, nullable=False)
+    worker = Column(Integer, nullable=False)
+
+    toots = Column(Integer, default=0)
+    tweets = Column(Integer, default=0)
+    instas = Column(Integer, default=0)
+    time = Column(Float, default=0.0)
+    runs = Column(Integer, default=0)
+
+
+class UserRollup(Base):
+    """ The number of enabled bridges created each day, see moa.rollup """
+    __tablename__ = 'userrollup'
+    __table_args__ = (
+        Index('ix_userrollup_start', 'start'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    start = Column(DateTime, nullable=False)
+    users = Column(Integer, default=0)
+
+
+# Both Twitter and Mastodon throw away media that hasn't been attached to a post after a day
+MEDIA_UPLOAD_TTL = 12 * 60 * 60
+
+
+class MediaUpload(Base):
+    """ An attachment that was uploaded for a post, so a retried post doesn't have to upload it again """
+    __tablename__ = 'mediaupload'
+    __table_args__ = (
+        Index('ix_mediaupload_bridge_id_target_url_hash', 'bridge_id', 'target', 'url_hash'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    created = Column(DateTime, default=datetime.utcnow)
+    bridge_id = Column(Integer, ForeignKey('bridge.id'), nullable=False)
+    target = Column(String(10), nullable=False)  # the service it was uploaded to, twitter or mastodon
+    url_hash = Column(String(64), nullable=False)  # sha256 of the source URL
+    media_id = Column(String(64), nullable=False)
+
+
 class BridgeMetadata(Base):
     __tablename__ = 'bridgemetadata'
+    __table_args__ = (
+        # workers select their due bridges in next_poll order
+        Index('ix_bridgemetadata_worker_id_next_poll', 'worker_id', 'next_poll'),
+        # leasing workers claim due bridges from the whole table
+        Index('ix_bridgemetadata_next_poll', 'next_poll'),
+    )
+
     id = Column(Integer, primary_key=True)
     created = Column(DateTime, default=datetime.utcnow)
 
@@ -235,6 +310,10 @@ class BridgeMetadata(Base):
     last_toot = Column(DateTime, default=datetime.utcnow)
     is_bot = Column(Boolean, default=0, server_default="0")
     worker_id = Column(Integer, default=1)
+    next_poll = Column(DateTime)  # UTC, NULL means the bridge is due now
+    lease_owner = Column(String(100))  # host:pid of the worker processing the bridge
+    lease_expires = Column(DateTime)  # UTC, after which another worker may claim the bridge
+    avg_time = Column(Float)  # moving average of the seconds a worker spends on the bridge
 
 
 @event.listens_for(WorkerStat.time, 'set')
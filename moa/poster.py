@@ -1,10 +1,154 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from typing import Optional
+
+from moa.helpers import MoaMediaUploadException
+from moa.mappings import MappingBuffer
+from moa.media import download
+from moa.message import Message
+from moa.models import MEDIA_UPLOAD_TTL, MediaUpload
+
+logger = logging.getLogger('worker')
+
+# Attachments of a single post that are transferred at the same time
+MEDIA_CONCURRENCY = 4
+
+
+def url_hash(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
 
 class Poster:
+    # set by the subclasses to remember their uploads in MediaUpload
+    media_target = None
+    media_id_type = str
 
-    def __init__(self, send, session):
+    def __init__(self, send, session, media_cache=None, mappings=None):
         self.send = send
         self.session = session
+        self.media_cache = media_cache
+        # shared by the posters of a bridge, flushed in the commit that moves last_id
+        self.mappings = mappings if mappings is not None else MappingBuffer(session)
         self.media_ids = []
+        self.media_hashes = []
+        self.transfers_cancelled = threading.Event()
 
     def reset(self) -> None:
         self.media_ids = []
+        self.media_hashes = []
+        self.transfers_cancelled = threading.Event()
+
+    def transfer_attachments(self, post: Message) -> bool:
+        """
+        Download a post's attachments and upload them to the other side, several at a time.
+
+        media_ids keeps the order of the attachments. When one of them fails the transfers
+        that haven't started yet are cancelled, the running ones stop before uploading, and
+        the MoaMediaUploadException is raised.
+
+        Attachments that were already uploaded by an earlier attempt at the same post are
+        reused instead of being transferred again.
+        """
+        attachments = list(post.media_attachments)
+
+        if not attachments:
+            return True
+
+        self.media_hashes = [url_hash(attachment.get("url")) for attachment in attachments]
+        uploaded = self.previous_uploads(self.media_hashes)
+        pending = [(h, a) for h, a in zip(self.media_hashes, attachments) if h not in uploaded]
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(MEDIA_CONCURRENCY, len(pending))) as executor:
+                futures = {executor.submit(self.transfer_attachment, attachment): h for h, attachment in pending}
+                done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+
+                # the uploads that made it can still be reused by the next attempt
+                for future in done:
+                    if not future.exception() and future.result() is not None:
+                        uploaded[futures[future]] = future.result()
+                        self.record_upload(futures[future], future.result())
+
+                failed = [f for f in futures if f in done and f.exception()]
+
+                if failed:
+                    self.transfers_cancelled.set()
+
+                    for future in not_done:
+                        future.cancel()
+
+                    raise failed[0].exception()
+
+        self.media_ids = [uploaded[h] for h in self.media_hashes if h in uploaded]
+
+        return True
+
+    def previous_uploads(self, hashes):
+        """ The recent uploads of these attachments by this bridge, by URL hash """
+        if not self.media_target:
+            return {}
+
+        cutoff = datetime.utcnow() - timedelta(seconds=MEDIA_UPLOAD_TTL)
+
+        uploads = self.session.query(MediaUpload).filter(MediaUpload.bridge_id == self.bridge.id,
+                                                         MediaUpload.target == self.media_target,
+                                                         MediaUpload.url_hash.in_(hashes),
+                                                         MediaUpload.created > cutoff)
+
+        return {upload.url_hash: self.media_id_type(upload.media_id) for upload in uploads}
+
+    def record_upload(self, media_hash, media_id):
+        if not self.media_target:
+            return
+
+        self.session.add(MediaUpload(bridge_id=self.bridge.id,
+                                     target=self.media_target,
+                                     url_hash=media_hash,
+                                     media_id=str(media_id)))
+
+    def forget_uploads(self):
+        """ Once the post is out its media is attached and can't be used again """
+        if not self.media_target or not self.media_hashes:
+            return
+
+        self.session.query(MediaUpload).filter(MediaUpload.bridge_id == self.bridge.id,
+                                               MediaUpload.target == self.media_target,
+                                               MediaUpload.url_hash.in_(self.media_hashes)) \
+            .delete(synchronize_session=False)
+
+    def transfer_attachment(self, attachment) -> Optional[int]:
+        """ Move one attachment across and return its media id, or None if it was skipped """
+        file_name = self.download_attachment(attachment)
+
+        if not file_name:
+            return None
+
+        try:
+            if self.transfers_cancelled.is_set():
+                raise MoaMediaUploadException("Another attachment of this post failed")
+
+            return self.upload_attachment(attachment, file_name)
+
+        finally:
+            os.unlink(file_name)
+
+    def fetch_attachment(self, url, max_size):
+        """ Download an attachment, through the media cache if there is one. Returns the file name and content type """
+        if self.media_cache:
+            return self.media_cache.fetch(url, max_size)
+
+        file_name, response = download(url, max_size)
+
+        return file_name, response.headers.get('Content-Type', '')
+
+    def download_attachment(self, attachment) -> Optional[str]:
+        """ Fetch an attachment into a temporary file and return its name, or None to skip it """
+        raise NotImplementedError
+
+    def upload_attachment(self, attachment, file_name):
+        """ Upload a downloaded attachment and return its media id """
+        raise NotImplementedError
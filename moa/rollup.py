@@ -0,0 +1,55 @@
+"""
+Keeps the hourly and daily rollups the stats graphs are drawn from up to date. Run it from
+cron every few minutes. Each run only recomputes the latest buckets of worker stats and
+recounts the users from scratch.
+"""
+import importlib
+import logging
+import os
+import sys
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.orm import Session
+
+from moa.helpers import FORMAT
+from moa.stats import rollup_users, rollup_worker_stats
+
+moa_config = os.environ.get('MOA_CONFIG', 'DevelopmentConfig')
+c = getattr(importlib.import_module('config'), moa_config)
+
+if c.SENTRY_DSN:
+    import sentry_sdk
+    from sentry_sdk.integrations.logging import LoggingIntegration
+
+    sentry_logging = LoggingIntegration(
+            level=logging.INFO,  # Capture info and above as breadcrumbs
+            event_level=logging.FATAL  # Only send fatal errors as events
+    )
+    sentry_sdk.init(dsn=c.SENTRY_DSN, integrations=[sentry_logging])
+
+logging.basicConfig(format=FORMAT)
+
+l = logging.getLogger('rollup')
+
+if c.DEBUG:
+    l.setLevel(logging.DEBUG)
+else:
+    l.setLevel(logging.INFO)
+
+engine = create_engine(c.SQLALCHEMY_DATABASE_URI)
+session = Session(engine)
+
+try:
+    for period in ['hour', 'day']:
+        count = rollup_worker_stats(session, period)
+        l.info(f"{count} {period} buckets of worker stats")
+
+    count = rollup_users(session)
+    l.info(f"{count} days of users")
+
+except exc.SQLAlchemyError as e:
+    l.error(e)
+    sys.exit(1)
+
+finally:
+    session.close()
@@ -0,0 +1,327 @@
+import calendar
+import heapq
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import case, or_
+from sqlalchemy.orm import contains_eager, joinedload
+
+from moa.models import Bridge, BridgeMetadata
+
+# How much faster than an account's idle time we poll it. An account that last posted
+# an hour ago is polled every 6 minutes, one that posted 10 minutes ago every minute.
+IDLE_POLL_RATIO = 10
+
+# Weight of the latest run in a bridge's average processing time
+COST_SMOOTHING = 0.2
+
+
+def utc_naive(d):
+    """ Datetimes come back from the DB naive but the APIs hand us aware ones """
+    if d is not None and d.tzinfo is not None:
+        d = d.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return d
+
+
+def poll_interval(last_activity, now, min_interval, max_interval):
+    """ Seconds to wait before polling an account whose most recent post was at last_activity """
+    if not last_activity:
+        return max_interval
+
+    idle = (now - utc_naive(last_activity)).total_seconds()
+
+    return int(min(max(idle / IDLE_POLL_RATIO, min_interval), max_interval))
+
+
+def schedule_next_poll(md, c, now=None, failed=False):
+    """
+    Work out when a bridge is next due based on its posting activity and store it in its metadata.
+
+    A bridge whose poll failed waits at least POLL_RETRY_INTERVAL so a broken account or
+    host isn't retried on every run.
+    """
+    if now is None:
+        now = datetime.utcnow()
+
+    activity = [utc_naive(d) for d in (md.last_toot, md.last_tweet) if d]
+    last_activity = max(activity) if activity else None
+    interval = poll_interval(last_activity, now, c.POLL_INTERVAL_MIN, c.POLL_INTERVAL_MAX)
+
+    if failed:
+        interval = max(interval, c.POLL_RETRY_INTERVAL)
+
+    md.next_poll = now + timedelta(seconds=interval)
+
+    return md.next_poll
+
+
+def record_time(md, seconds):
+    """ Fold the time a run took into the bridge's moving average """
+    if md.avg_time is None:
+        md.avg_time = seconds
+    else:
+        md.avg_time = md.avg_time + COST_SMOOTHING * (seconds - md.avg_time)
+
+
+def bridge_cost(md, c, default_time, now=None):
+    """
+    Expected busy seconds per hour a bridge costs its worker: how long a run takes times
+    how often it is polled. Bridges that have never been timed cost default_time per run.
+    """
+    if now is None:
+        now = datetime.utcnow()
+
+    activity = [utc_naive(d) for d in (md.last_toot, md.last_tweet) if d]
+    last_activity = max(activity) if activity else None
+    interval = poll_interval(last_activity, now, c.POLL_INTERVAL_MIN, c.POLL_INTERVAL_MAX)
+
+    avg_time = default_time if md.avg_time is None else md.avg_time
+
+    return avg_time * 3600 / interval
+
+
+def pack_bridges(costs, workers):
+    """
+    Spread bridges over workers 1..workers so they all end up with about the same load.
+
+    costs maps a bridge id to its cost. Bridges are handed out most expensive first, each
+    to the least loaded worker, which is never more than 4/3 of the best possible split.
+
+    Returns the worker for each bridge and the total cost for each worker.
+    """
+    loads = [(0, worker_id) for worker_id in range(1, workers + 1)]
+    assignment = {}
+
+    for bridge_id, cost in sorted(costs.items(), key=lambda item: (-item[1], item[0])):
+        load, worker_id = heapq.heappop(loads)
+        assignment[bridge_id] = worker_id
+        heapq.heappush(loads, (load + cost, worker_id))
+
+    return assignment, {worker_id: load for load, worker_id in loads}
+
+
+def worker_bridges(session, worker_id):
+    """ The enabled bridges assigned to a worker """
+    return session.query(Bridge).join(Bridge.md).filter(Bridge.enabled == True,
+                                                        BridgeMetadata.worker_id == worker_id)
+
+
+def due_bridges(query, now=None):
+    """
+    Limit a bridge query to the bridges whose next poll time has passed, most overdue first.
+
+    next_poll doubles as a rotation cursor: bridges that were cut off by the time limit
+    keep their old next_poll and are first in line on the next run. Never polled bridges
+    have a NULL next_poll, which sorts first in both MySQL and SQLite.
+    """
+    if now is None:
+        now = datetime.utcnow()
+
+    query = query.filter(or_(BridgeMetadata.next_poll == None, BridgeMetadata.next_poll <= now))
+
+    return query.order_by(BridgeMetadata.next_poll, BridgeMetadata.id)
+
+
+def with_related(query):
+    """
+    Load the metadata, settings and host along with each bridge so a batch of bridges
+    costs a single round trip. The query has to be joined to Bridge.md already.
+    """
+    return query.options(contains_eager(Bridge.md),
+                         joinedload(Bridge.t_settings),
+                         joinedload(Bridge.mastodon_host))
+
+
+def load_bridges(session, bridge_ids):
+    """ Fetch a batch of bridges and everything the worker needs for them in one query """
+    if not bridge_ids:
+        return []
+
+    query = session.query(Bridge).join(Bridge.md).filter(Bridge.enabled == True, Bridge.id.in_(bridge_ids))
+
+    return with_related(query).all()
+
+
+def lease_owner():
+    """ Identifies this worker process in BridgeMetadata.lease_owner """
+    return f"{socket.gethostname()}:{os.getpid()}"[:100]
+
+
+def claim_bridges(session, owner, limit, lease_time, now=None):
+    """
+    Lease up to limit due bridges to a worker and return their ids, most overdue first.
+
+    A lease stops other workers from claiming the bridge until it is released or it
+    expires, so a crashed worker's bridges are picked up again after lease_time seconds.
+
+    MySQL skips rows another worker has locked. Elsewhere the claim is optimistic: the
+    UPDATE only matches leases that are still free so when two workers race for the same
+    bridges each row goes to one of them and the loser just gets a smaller batch.
+    """
+    if now is None:
+        now = datetime.utcnow()
+
+    expires = now + timedelta(seconds=lease_time)
+    lease_free = or_(BridgeMetadata.lease_expires == None, BridgeMetadata.lease_expires < now)
+
+    # a subquery rather than a join so that FOR UPDATE only locks the bridgemetadata rows,
+    # SQLAlchemy drops of= when compiling for MySQL
+    enabled = session.query(Bridge.metadata_id).filter(Bridge.enabled == True)
+
+    query = session.query(BridgeMetadata.id) \
+        .filter(BridgeMetadata.id.in_(enabled.subquery()), lease_free)
+    query = due_bridges(query, now).limit(limit)
+
+    if session.bind.dialect.name == 'mysql':
+        query = query.with_for_update(skip_locked=True)
+
+    md_ids = [md_id for md_id, in query]
+
+    if not md_ids:
+        session.commit()
+        return []
+
+    session.query(BridgeMetadata) \
+        .filter(BridgeMetadata.id.in_(md_ids), lease_free) \
+        .update({BridgeMetadata.lease_owner: owner, BridgeMetadata.lease_expires: expires},
+                synchronize_session=False)
+    session.commit()
+
+    claimed = session.query(Bridge.id) \
+        .join(Bridge.md) \
+        .filter(BridgeMetadata.id.in_(md_ids), BridgeMetadata.lease_owner == owner) \
+        .order_by(BridgeMetadata.next_poll, BridgeMetadata.id)
+    bridge_ids = [bridge_id for bridge_id, in claimed]
+    session.commit()
+
+    return bridge_ids
+
+
+def release_bridge(connectable, metadata_id, owner, retry_at=None, now=None):
+    """
+    Give up a bridge's lease, as long as it is still ours.
+
+    A bridge that was processed but is still overdue, because its run died before it
+    could be rescheduled, isn't due again until retry_at so it isn't claimed straight back.
+    """
+    if now is None:
+        now = datetime.utcnow()
+
+    table = BridgeMetadata.__table__
+    values = {'lease_owner': None, 'lease_expires': None}
+
+    if retry_at is not None:
+        values['next_poll'] = case([(or_(table.c.next_poll == None, table.c.next_poll <= now), retry_at)],
+                                   else_=table.c.next_poll)
+
+    connectable.execute(table.update()
+                        .where(table.c.id == metadata_id)
+                        .where(table.c.lease_owner == owner)
+                        .values(values))
+
+
+def timestamp(d):
+    """ Convert a naive UTC datetime to a unix timestamp """
+    return calendar.timegm(d.timetuple())
+
+
+class BridgeScheduler:
+    """
+    Keeps track of when each bridge is next due to be polled by a long running worker.
+
+    Bridges are held in a heap ordered by their due time. A bridge that has been handed
+    out by pop_due() isn't handed out again until it has been rescheduled, so the same
+    bridge is never processed by two threads at once.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._heap = []
+        self._due = {}
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._due) + len(self._running)
+
+    def refresh(self, bridges, now=None):
+        """
+        Start tracking new bridges and forget about the ones that went away.
+
+        bridges maps a bridge id to the timestamp it is first due, or None if it's due now
+        """
+        if now is None:
+            now = time.time()
+
+        bridge_ids = set(bridges)
+
+        with self._lock:
+            for bridge_id in list(self._due):
+                if bridge_id not in bridge_ids:
+                    del self._due[bridge_id]
+
+            self._running &= bridge_ids
+
+            for bridge_id, due in bridges.items():
+                if bridge_id not in self._due and bridge_id not in self._running:
+                    self._push(bridge_id, due or now)
+
+            # drop stale heap entries so the heap doesn't grow forever
+            self._heap = [(due, b) for due, b in self._heap if self._due.get(b) == due]
+            heapq.heapify(self._heap)
+
+    def pop_due(self, now=None):
+        """ Return the ids of all bridges whose due time has passed, oldest first """
+        if now is None:
+            now = time.time()
+
+        due_ids = []
+
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, bridge_id = heapq.heappop(self._heap)
+
+                if self._due.get(bridge_id) != due:
+                    # superseded by a later entry or no longer tracked
+                    continue
+
+                del self._due[bridge_id]
+                self._running.add(bridge_id)
+                due_ids.append(bridge_id)
+
+        return due_ids
+
+    def reschedule(self, bridge_id, delay=None, now=None):
+        """ Put a bridge back in the queue once it has been processed """
+        if now is None:
+            now = time.time()
+
+        if delay is None:
+            delay = self.interval
+
+        with self._lock:
+            if bridge_id not in self._running:
+                # it was removed by refresh() while it was being processed
+                return
+
+            self._running.discard(bridge_id)
+            self._push(bridge_id, now + delay)
+
+    def next_due(self):
+        """ The time the next bridge is due or None if nothing is queued """
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+
+            if self._heap:
+                return self._heap[0][0]
+
+        return None
+
+    def _push(self, bridge_id, due):
+        self._due[bridge_id] = due
+        heapq.heappush(self._heap, (due, bridge_id))
@@ -0,0 +1,240 @@
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, func, literal
+from sqlalchemy.dialects import mysql
+
+from moa.models import Bridge, BridgeStat, StatRollup, UserRollup, WorkerStat
+
+# Rollups are recomputed from a little before their latest bucket because the workers keep
+# adding to an hour's stats until their next flush
+ROLLUP_LOOKBACK = timedelta(hours=2)
+
+# Graphs of up to a week are drawn by the hour, longer ones by the day
+HOURLY_GRAPH_LIMIT = 24 * 7
+
+
+def stat_hour(d):
+    """ The hour a stat is counted in, which is also the created time of its row """
+    return d.replace(minute=0, second=0, microsecond=0)
+
+
+def add_to_row(session, table, key, counts, computed=None):
+    """
+    Add counts to the row whose columns match key, or insert it if there isn't one yet.
+
+    The key columns have a unique index. MySQL does this in a single INSERT ... ON DUPLICATE
+    KEY UPDATE. On SQLite the row is updated, then inserted with INSERT OR IGNORE if it was
+    missing, and updated again if another process inserted it first.
+
+    computed maps more columns to a function of a column getter that returns their value
+    once the counts have been added.
+    """
+    computed = computed or {}
+    insert_values = dict(key, **counts)
+
+    for column, f in computed.items():
+        insert_values[column] = f(lambda c: literal(float(counts.get(c, 0))))
+
+    # the computed columns come first so MySQL, which assigns left to right, sees the old counts
+    updates = [(column, f(lambda c: table.c[c] + counts.get(c, 0))) for column, f in computed.items()]
+    updates += [(column, table.c[column] + value) for column, value in counts.items()]
+
+    if session.bind.dialect.name == 'mysql':
+        session.execute(mysql.insert(table).values(**insert_values).on_duplicate_key_update(updates))
+        return
+
+    where = and_(*[table.c[column] == value for column, value in key.items()])
+    update = table.update(preserve_parameter_order=True).where(where).values(updates)
+
+    if session.execute(update).rowcount:
+        return
+
+    insert = table.insert().prefix_with('OR IGNORE', dialect='sqlite').values(**insert_values)
+
+    if session.execute(insert).rowcount == 0:
+        session.execute(update)
+
+
+def average_time(column):
+    """ WorkerStat.avg, the seconds spent per message """
+    items = column('toots') + column('tweets') + column('instas')
+
+    return case([(items > 0, column('time') / items)], else_=0.0)
+
+
+class StatsAggregator:
+    """
+    Counts the messages a worker posts, its busy time and its runs in memory and adds them
+    to one WorkerStat row per worker and one BridgeStat row per bridge for each hour,
+    instead of inserting rows for every run.
+
+    Shared by the bridge threads. Nothing is written until flush().
+    """
+
+    def __init__(self, worker):
+        self.worker = worker
+        self._lock = threading.Lock()
+        self._worker_counts = defaultdict(Counter)
+        self._bridge_counts = defaultdict(Counter)
+
+    def add(self, bridge_id, toots=0, tweets=0, instas=0, now=None):
+        """ Count messages posted for a bridge """
+        hour = stat_hour(now or datetime.utcnow())
+        counts = {'toots': toots, 'tweets': tweets, 'instas': instas}
+
+        with self._lock:
+            self._worker_counts[hour].update(counts)
+            self._bridge_counts[bridge_id, hour].update(counts)
+
+    def add_time(self, seconds, runs=0, now=None):
+        """ Count time the worker spent working and how many runs it took """
+        hour = stat_hour(now or datetime.utcnow())
+
+        with self._lock:
+            self._worker_counts[hour].update({'time': seconds, 'runs': runs})
+
+    @property
+    def items(self):
+        """ Messages counted since the last flush """
+        with self._lock:
+            return sum(c['toots'] + c['tweets'] + c['instas'] for c in self._worker_counts.values())
+
+    @property
+    def time(self):
+        """ Seconds counted since the last flush """
+        with self._lock:
+            return sum(c['time'] for c in self._worker_counts.values())
+
+    @property
+    def formatted_time(self):
+        m, s = divmod(self.time, 60)
+        return f"{m:02.0f}:{s:02.0f}"
+
+    def flush(self, session):
+        """ Add everything counted since the last flush to the hourly rows and commit """
+        with self._lock:
+            worker_counts, self._worker_counts = self._worker_counts, defaultdict(Counter)
+            bridge_counts, self._bridge_counts = self._bridge_counts, defaultdict(Counter)
+
+        for hour, counts in worker_counts.items():
+            add_to_row(session, WorkerStat.__table__, {'worker': self.worker, 'created': hour}, counts,
+                       computed={'avg': average_time})
+
+        for (bridge_id, hour), counts in bridge_counts.items():
+            if sum(counts.values()) > 0:
+                add_to_row(session, BridgeStat.__table__, {'bridge_id': bridge_id, 'created': hour}, counts)
+
+        session.commit()
+
+
+def period_start(d, period):
+    """ The start of the hour or day d is in """
+    d = stat_hour(d)
+
+    return d.replace(hour=0) if period == 'day' else d
+
+
+def period_starts(since, until, period):
+    """ The start of every hour or day from the one since is in to the one until is in """
+    step = timedelta(days=1) if period == 'day' else timedelta(hours=1)
+    start = period_start(since, period)
+    end = period_start(until, period)
+    starts = []
+
+    while start <= end:
+        starts.append(start)
+        start += step
+
+    return starts
+
+
+def hourly_message_counts(session, since, until):
+    """
+    The toots, tweets and instas of all workers for every hour from the one since is in to
+    the one until is in, read straight from WorkerStat. Rows from before the stats were
+    hourly are counted in the hour they're in.
+    """
+    query = session.query(WorkerStat.created,
+                          func.sum(WorkerStat.toots),
+                          func.sum(WorkerStat.tweets),
+                          func.sum(WorkerStat.instas)) \
+        .filter(WorkerStat.created >= stat_hour(since), WorkerStat.created <= until) \
+        .group_by(WorkerStat.created)
+
+    counts = defaultdict(Counter)
+
+    for created, toots, tweets, instas in query:
+        counts[stat_hour(created)].update(toots=toots or 0, tweets=tweets or 0, instas=instas or 0)
+
+    return [(counts[start]['toots'], counts[start]['tweets'], counts[start]['instas'])
+            for start in period_starts(since, until, 'hour')]
+
+
+def rollup_worker_stats(session, period, lookback=ROLLUP_LOOKBACK):
+    """
+    Bring the StatRollup rows of a period up to date and return how many were written.
+
+    Only the buckets from just before the latest one onwards are recomputed, so a run only
+    reads the last few hours of WorkerStat. The first run reads all of it.
+    """
+    latest = session.query(func.max(StatRollup.start)).filter(StatRollup.period == period).scalar()
+    since = period_start(latest - lookback, period) if latest else None
+
+    query = session.query(WorkerStat.worker, WorkerStat.created, WorkerStat.toots, WorkerStat.tweets,
+                          WorkerStat.instas, WorkerStat.time, WorkerStat.runs)
+
+    if since:
+        query = query.filter(WorkerStat.created >= since)
+
+    buckets = defaultdict(Counter)
+
+    for worker, created, toots, tweets, instas, time, runs in query.yield_per(10000):
+        buckets[worker, period_start(created, period)].update(toots=toots or 0, tweets=tweets or 0,
+                                                              instas=instas or 0, time=time or 0,
+                                                              runs=runs or 0)
+
+    stale = session.query(StatRollup).filter(StatRollup.period == period)
+
+    if since:
+        stale = stale.filter(StatRollup.start >= since)
+
+    stale.delete(synchronize_session=False)
+    session.bulk_insert_mappings(StatRollup, [dict(period=period, start=start, worker=worker, **counts)
+                                              for (worker, start), counts in buckets.items()])
+    session.commit()
+
+    return len(buckets)
+
+
+def rollup_users(session):
+    """
+    Rebuild the UserRollup rows: the enabled bridges by the day they were created.
+
+    Bridges can be disabled at any time after they're created so every day is recounted.
+    That's one small row per bridge, unlike the stats rows.
+    """
+    query = session.query(Bridge.created).filter(Bridge.enabled == True, Bridge.created != None)
+    days = Counter(period_start(created, 'day') for created, in query.yield_per(10000))
+
+    session.query(UserRollup).delete(synchronize_session=False)
+    session.bulk_insert_mappings(UserRollup, [dict(start=start, users=users) for start, users in days.items()])
+    session.commit()
+
+    return len(days)
+
+
+def worker_series(session, hours, now=None):
+    """
+    The rolled up worker stats for a graph of the last hours: the start of every bucket
+    and the StatRollup rows, by the hour for up to a week and by the day beyond that.
+    """
+    if now is None:
+        now = datetime.utcnow()
+
+    period = 'hour' if hours <= HOURLY_GRAPH_LIMIT else 'day'
+    starts = period_starts(now - timedelta(hours=hours), now, period)
+    rows = session.query(StatRollup).filter(StatRollup.period == period, StatRollup.start >= starts[0]).all()
+
+    return starts, rows
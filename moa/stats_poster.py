@@ -4,14 +4,14 @@ import os
 import sys
 from datetime import datetime, timedelta
 
-import pandas as pd
 import pygal
 from mastodon import Mastodon
 from sqlalchemy import create_engine, exc
 from sqlalchemy.orm import Session
 
 from moa.helpers import FORMAT
-from moa.models import Bridge, WorkerStat
+from moa.models import Bridge
+from moa.stats import hourly_message_counts
 
 """
 You need an app access code for this run. Create one at Preferences->Development->New Application
@@ -59,21 +59,15 @@ user_count = session.query(Bridge).filter_by(enabled=1).count()
 msg = f"Active Users: {user_count}"
 
 # Create count graph
-since = datetime.now() - timedelta(hours=24 * 7)
+now = datetime.utcnow()
+since = now - timedelta(hours=24 * 7)
 
-stats_query = session.query(WorkerStat).filter(WorkerStat.created > since).with_entities(WorkerStat.created, WorkerStat.toots, WorkerStat.tweets, WorkerStat.instas)
+hours = hourly_message_counts(session, since, now)
+total = sum(sum(c) for c in hours)
 
-df = pd.read_sql(stats_query.statement, stats_query.session.bind)
-df.set_index(['created'], inplace=True)
-total = df.to_numpy().sum()
-
-df.groupby(level=0).sum()
-r = df.resample('h').sum()
-r = r.fillna(0)
-
-toots = r['toots'].tolist()
-tweets = r['tweets'].tolist()
-instas = r['instas'].tolist()
+toots = [c[0] for c in hours]
+tweets = [c[1] for c in hours]
+instas = [c[2] for c in hours]
 
 chart = pygal.StackedBar(title=f"# of messages per hour over the previous week\n{total} Total",
                          human_readable=True,
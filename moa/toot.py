@@ -4,7 +4,7 @@ import re
 from datetime import datetime, timezone
 from urllib.parse import urlparse
 
-from moa.message import Message
+from moa.message import Message, memoized_property
 from moa.models import CON_XP_ONLYIF, CON_XP_ONLYIF_TAGS, CON_XP_UNLESS, CON_XP_UNLESS_TAGS
 from moa.tweet import HOUR_CUTOFF
 
@@ -16,8 +16,77 @@ URL_REGEXP = re.compile(r"([--:\w?@%&+~#=]*\.[a-z]{2,4}\/{0,2})((?:[?&](?:\w+)=(
 
 logger = logging.getLogger('worker')
 
+# Everything clean_content does to Mastodon's HTML: links, line breaks, paragraphs and other tags
+HTML_TOKEN = re.compile(r'<(?:a [^>]*href="([^"]+)">[^<]*</a>|(?i:(br ?/?>)|(/p><p>))|.*?>)')
+
+# A media URL on any instance, whose host is checked against the toot's
+MEDIA_URL = re.compile(r'(https?://[^/\s]+)/media/[\w-]+\s?')
+
+MENTION = re.compile(r'@(\w+)(?![\w@])')
+
+TWITTER_HANDLE = re.compile(r'@(\w{1,15})@twitter.com')
+
+# What sanitize_twitter_handles looks for
+TWITTER_ADDRESS = re.compile(r'@?(\w{1,15})@twitter.com')
+POSSIBLE_TWITTER_HANDLE = re.compile(r'@(\w{1,15})')
+MASTODON_HANDLE = re.compile(r'@\w+@[\w.]+')
+MASTODON_PROFILE = re.compile(r'https://[\w.]+/@[\w.]+')
+
+
+def html_token_text(m):
+    if m.group(1) is not None:
+        return m.group(1)
+
+    elif m.group(2):
+        return "\n"
+
+    elif m.group(3):
+        return "\n\n"
+
+    return ""
+
+
+def html_to_text(content, instance_url, mentions):
+    """
+    Turn the HTML of a toot into plain text, drop links to its own media and expand
+    mentions of local accounts to their full handle.
+    """
+    # We trust mastodon to return valid HTML. Links become their URL, line breaks and
+    # new paragraphs become new lines and all other tags are dropped.
+    content = HTML_TOKEN.sub(html_token_text, content)
+
+    # Then we can unescape the string
+    content = html.unescape(content.strip())
+
+    # Trim out media URLs
+    if '/media/' in content:
+        content = MEDIA_URL.sub(lambda m: "" if m.group(1) == instance_url else m.group(0), content)
+
+    # and fix up masto mentions
+    if mentions:
+        handles = {}
+
+        for username, handle in mentions:
+            handles.setdefault(username, handle)
+
+        content = MENTION.sub(lambda m: handles.get(m.group(1), m.group(0)), content)
+
+    return content
+
+
+def weighted_length(string, url_length):
+    """ The length Twitter counts for a string, where every URL counts as url_length """
+    status_length = len(string.encode('utf-16-le')) // 2
+
+    for m in URL_REGEXP.finditer(string):
+        # swap the length of the URL for the length of Twitter's URLs
+        status_length += url_length - len(m.group(0))
+
+    return status_length
+
 
 class Toot(Message):
+    __slots__ = ('content', 'url_length', 'config')
 
     def __init__(self, settings, toot_data, config):
 
@@ -71,39 +140,39 @@ class Toot(Message):
     def is_self_reply(self):
         return self.is_reply and self.data['in_reply_to_account_id'] == self.data['account']['id']
 
-    @property
+    @memoized_property
     def is_boost(self):
         return self.data['reblog'] is not None
 
-    @property
+    @memoized_property
     def is_sensitive(self):
         if self.is_boost:
             return self.data['reblog']['sensitive']
         else:
             return self.data['sensitive']
 
-    @property
+    @memoized_property
     def spoiler_text(self):
         if self.is_boost:
             return self.data['reblog']['spoiler_text']
         else:
             return self.data['spoiler_text']
 
-    @property
+    @memoized_property
     def media_attachments(self):
         if self.is_boost:
             return self.data['reblog']['media_attachments']
         else:
             return self.data['media_attachments']
 
-    @property
+    @memoized_property
     def url(self):
         if self.is_boost:
             return self.data['reblog']['url']
         else:
             return self.data['url']
 
-    @property
+    @memoized_property
     def instance_url(self):
         o = urlparse(self.url)
 
@@ -163,7 +232,7 @@ class Toot(Message):
 
         return False
 
-    @property
+    @memoized_property
     def mentions(self):
 
         mentions = []
@@ -174,7 +243,7 @@ class Toot(Message):
 
         return mentions
 
-    @property
+    @memoized_property
     def boost_author(self):
 
         if not self.is_boost:
@@ -191,95 +260,65 @@ class Toot(Message):
 
     def expected_status_length(self, string):
 
-        status_length = len(string.encode('utf-16-le')) // 2
-
-        matches = re.finditer(URL_REGEXP, string)
-        for m in matches:
-            url = m.group(0)
-            # subtract the length of the URL
-            status_length -= len(url)
-            # add the length of Twitter's URLs
-            status_length += self.url_length
+        return weighted_length(string, self.url_length) + self.status_length_extra
 
+    @property
+    def status_length_extra(self):
+        """ What Twitter will count on top of the text itself """
         if self.is_sensitive and self.settings.post_sensitive_behind_link:
-            status_length += len(f"\n{self.settings.sensitive_link_text}\n{self.url}")
+            return len(f"\n{self.settings.sensitive_link_text}\n{self.url}")
 
-        return status_length
+        return 0
 
     def sanitize_twitter_handles(self):
-        self.content = re.sub(r'@?(\w{1,15})@twitter.com', '\g<1>', self.content)
-
-        # find possible twitter handles so we can get their ranges
-        tm = list(re.finditer(r'@(\w{1,15})', self.content))
-
-        # find all masto handles so we can get their ranges
-        mm = list(re.finditer(r'@\w+@[\w.]+', self.content))
-
-        # find all masto profile links
-        mm += list(re.finditer(r'https://[\w.]+/@[\w.]+', self.content))
-
-        handles = set(tm)
-
-        # remove all potential twitter handles that overlap a masto handle
-        for m in mm:
-            good_handles = set()
-            ms = m.span()
-
-            for t in tm:
-                ts = t.span()
-
-                # do the ranges overlap?
-                overlap = not ((ts[-1] < ms[0]) or (ms[-1] < ts[0]))
-
-                if overlap:
-                    continue
-
-                good_handles.add(t)
-
-            handles = handles & good_handles
-
-        handles = list(handles)
-        handles = sorted(handles, key=lambda x: x.span()[0], reverse=True)
-
-        for h in handles:
-            front = self.content[:h.span()[0]]
-            middle = h.group(1)
-            back = self.content[h.span()[1]:]
-            self.content = front + middle + back
+        """
+        Strip the @ from anything that looks like a Twitter handle so it doesn't mention
+        someone unrelated on Twitter, leaving Mastodon handles and profile links alone.
+        """
+        content = TWITTER_ADDRESS.sub(r'\g<1>', self.content)
+
+        # find all masto handles and profile links, ordered by where they start
+        masto_spans = [m.span() for m in MASTODON_HANDLE.finditer(content)]
+        masto_spans += [m.span() for m in MASTODON_PROFILE.finditer(content)]
+        masto_spans.sort()
+
+        parts = []
+        position = 0
+        next_span = 0
+        masto_end = -1
+
+        # possible twitter handles come out in order and never overlap each other, so one
+        # sweep over both lists finds the ones that don't touch a masto handle
+        for t in POSSIBLE_TWITTER_HANDLE.finditer(content):
+            start, end = t.span()
+
+            # the furthest end of the masto handles that start before this one ends
+            while next_span < len(masto_spans) and masto_spans[next_span][0] <= end:
+                masto_end = max(masto_end, masto_spans[next_span][1])
+                next_span += 1
+
+            if masto_end >= start:
+                continue
+
+            parts.append(content[position:start])
+            parts.append(t.group(1))
+            position = end
+
+        parts.append(content[position:])
+        self.content = "".join(parts)
 
     @property
     def clean_content(self):
 
-        media_regexp = re.compile(re.escape(self.instance_url) + "\/media\/[\w-]+\s?")
-
         if not self.content:
 
-            self.content = self.raw_content
-
-            # We trust mastodon to return valid HTML
-            self.content = re.sub(r'<a [^>]*href="([^"]+)">[^<]*</a>', '\g<1>', self.content)
-
-            # We replace html br with new lines
-            self.content = "\n".join(re.compile(r'<br ?/?>', re.IGNORECASE).split(self.content))
-
-            # We must also replace new paragraphs with double line skips
-            self.content = "\n\n".join(re.compile(r'</p><p>', re.IGNORECASE).split(self.content))
-
-            # Then we can delete the other html contents and unescape the string
-            self.content = html.unescape(str(re.compile(r'<.*?>').sub("", self.content).strip()))
-
-            # Trim out media URLs
-            self.content = re.sub(media_regexp, "", self.content)
-
-            # fix up masto mentions
-            for mention in self.mentions:
-                self.content = re.sub(f'@({mention[0]})(?!@)', f"{mention[1]}", self.content)
+            self.content = html_to_text(self.raw_content, self.instance_url, self.mentions)
 
             if self.config.SANITIZE_TWITTER_HANDLES:
                 self.sanitize_twitter_handles()
 
             else:
-                self.content = re.sub(r'@(\w{1,15})@twitter.com', '@\g<1>', self.content)
+                self.content = TWITTER_HANDLE.sub(r'@\g<1>', self.content)
 
             self.content = self.content.strip()
 
@@ -314,30 +353,59 @@ class Toot(Message):
 
         else:
 
-            current_part = ""
             words = self.clean_content.split(" ")
 
             if self.settings.split_twitter_messages:
                 logger.info(f'Toot bigger than {max_length} characters, need to split...')
 
+                # Each part is built as words joined by spaces with its leading whitespace
+                # stripped. URLs never contain spaces so a part's length is the sum of its
+                # words' lengths, which are only worked out once.
+                part_limit = max_length - 6 - self.status_length_extra
+                part_words = [""]
+                part_length = 0  # of " ".join(part_words)
+                part_lead = 0  # its leading whitespace
+                part_blank = True  # it's only whitespace
+                stripped = 0  # how much of the leading whitespace has been stripped
+
                 for next_word in words:
+                    word_length = weighted_length(next_word, self.url_length)
+                    word_lead = len(next_word) - len(next_word.lstrip())
+                    word_blank = word_lead == len(next_word)
 
-                    possible_part = f"{current_part} {next_word}".lstrip()
-                    length = self.expected_status_length(possible_part)
+                    joined_length = part_length + 1 + word_length
 
-                    # logger.debug(f"length of possible part is {length}")
+                    if part_blank:
+                        # the whole part, the space and the word's own leading whitespace get stripped
+                        joined_lead = joined_length if word_blank else part_length + 1 + word_lead
+                    else:
+                        joined_lead = part_lead
 
-                    if length > max_length - 6:
+                    # logger.debug(f"length of possible part is {joined_length - joined_lead}")
 
+                    if joined_length - joined_lead > part_limit:
+
+                        current_part = " ".join(part_words)[stripped:]
                         current_part = f"{current_part} XXXXX".lstrip()
 
                         # logger.debug(f'Part is full ({self.expected_status_length(current_part)}):{current_part}')
 
                         self.message_parts.append(current_part)
-                        current_part = next_word
+
+                        part_words = [next_word]
+                        part_length = word_length
+                        part_lead = word_lead
+                        part_blank = word_blank
+                        stripped = 0
 
                     else:
-                        current_part = possible_part
+                        part_words.append(next_word)
+                        part_length = joined_length
+                        part_lead = joined_lead
+                        part_blank = part_blank and word_blank
+                        stripped = joined_lead
+
+                current_part = " ".join(part_words)[stripped:]
 
                 # Insert last part
                 length = len(current_part.strip().encode('utf-8'))
@@ -1,22 +1,17 @@
 import logging
 import os
 import sys
-import tempfile
 import time
 from os.path import splitext
 from typing import Optional
 from urllib.parse import urlparse
 import pprint as pp
 
-import requests
 from mastodon.Mastodon import MastodonAPIError, MastodonNetworkError, MastodonRatelimitError, MastodonUnauthorizedError
 from pymysql import OperationalError
-from requests.exceptions import SSLError
-from urllib3.exceptions import ProtocolError, ConnectionError
 
 from moa.helpers import MoaMediaUploadException
 from moa.message import Message
-from moa.models import Mapping
 from moa.poster import Poster
 
 logger = logging.getLogger('worker')
@@ -24,12 +19,15 @@ logger = logging.getLogger('worker')
 MASTODON_RETRIES = 1
 MASTODON_RETRY_DELAY = 5
 MASTODON_TOOT_LENGTH = 495
+# Mastodon's default limit for videos, images are capped lower by the instance
+MASTODON_MAX_MEDIA_SIZE = 40 * 1024 * 1024
 
 
 class TootPoster(Poster):
+    media_target = 'mastodon'
 
-    def __init__(self, send, session, api, bridge):
-        super().__init__(send, session)
+    def __init__(self, send, session, api, bridge, media_cache=None, mappings=None):
+        super().__init__(send, session, media_cache, mappings)
 
         self.api = api
         self.bridge = bridge
@@ -56,10 +54,9 @@ class TootPoster(Poster):
                 visibility = 'unlisted'
 
             if post.is_self_reply:
-                mapping = self.session.query(Mapping).filter_by(twitter_id=post.in_reply_to_id).first()
+                reply_to = self.mappings.mastodon_id(post.in_reply_to_id)
 
-                if mapping:
-                    reply_to = mapping.mastodon_id
+                if reply_to:
                     logger.info(f"Replying to mastodon status {reply_to}")
                 else:
                     # we don't know about this message which means it wasn't posted so let's skip it
@@ -76,12 +73,13 @@ class TootPoster(Poster):
                                                   visibility=visibility)
 
                 if mastodon_last_id:
-                    m = Mapping()
-                    m.mastodon_id = mastodon_last_id
-                    m.twitter_id = post.id
-                    self.session.add(m)
+                    self.mappings.add(mastodon_last_id, post.id)
 
                     self.bridge.mastodon_last_id = mastodon_last_id
+                    self.forget_uploads()
+
+                # the mappings go in with last_id so a thread can always find its parts
+                self.mappings.flush()
 
                 try:
                     self.session.commit()
@@ -150,57 +148,42 @@ class TootPoster(Poster):
 
         return reply_to
 
-    def transfer_attachments(self, post: Message) -> bool:
-
-        # logger.debug(post.media_attachments)
+    def download_attachment(self, attachment) -> Optional[str]:
+        attachment_url = attachment.get("url")
+        attachment_desc = attachment.get("description")
 
-        for attachment in post.media_attachments:
+        logger.info(f"Downloading {attachment_desc}  {attachment_url}")
 
-            attachment_url = attachment.get("url")
-            attachment_desc = attachment.get("description")
+        temp_file_name, _ = self.fetch_attachment(attachment_url, MASTODON_MAX_MEDIA_SIZE)
 
-            logger.info(f"Downloading {attachment_desc}  {attachment_url}")
-            try:
-                attachment_file = requests.get(attachment_url, stream=True)
-                attachment_file.raw.decode_content = True
-                temp_file = tempfile.NamedTemporaryFile(delete=False)
-                temp_file.write(attachment_file.raw.read())
-                temp_file.close()
+        path = urlparse(attachment_url).path
+        file_extension = splitext(path)[1]
 
-            except (SSLError, ProtocolError, ConnectionError, OSError) as e:
-                logger.error(f"{e}")
-                raise MoaMediaUploadException("Connection Error downloading attachments")
+        # file_extension = mimetypes.guess_extension(attachment_file.headers['Content-type'])
 
-            path = urlparse(attachment_url).path
-            file_extension = splitext(path)[1]
+        # ffs
+        if file_extension == '.jpe':
+            file_extension = '.jpg'
 
-            # file_extension = mimetypes.guess_extension(attachment_file.headers['Content-type'])
+        upload_file_name = temp_file_name + file_extension
+        os.rename(temp_file_name, upload_file_name)
 
-            # ffs
-            if file_extension == '.jpe':
-                file_extension = '.jpg'
+        return upload_file_name
 
-            upload_file_name = temp_file.name + file_extension
-            os.rename(temp_file.name, upload_file_name)
+    def upload_attachment(self, attachment, upload_file_name):
+        attachment_desc = attachment.get("description")
 
-            # self.attachments.append((upload_file_name, attachment.ext_alt_text))
+        logger.debug(f'Uploading {attachment_desc}: {upload_file_name}')
 
-            logger.debug(f'Uploading {attachment_desc}: {upload_file_name}')
+        try:
+            return self.api.media_post(upload_file_name, description=attachment_desc)['id']
 
-            try:
-                self.media_ids.append(self.api.media_post(upload_file_name, description=attachment_desc))
+        except (MastodonAPIError, MastodonUnauthorizedError) as e:
+            logger.error(e)
+            if 'Forbidden' in repr(e) or 'Unauthorized' in repr(e):
+                self.bridge.enabled = False
+            raise MoaMediaUploadException("API Error uploading attachments") from e
 
-            except (MastodonAPIError, MastodonUnauthorizedError) as e:
-                logger.error(e)
-                if 'Forbidden' in repr(e) or 'Unauthorized' in repr(e):
-                    self.bridge.enabled = False
-                raise MoaMediaUploadException("API Error uploading attachments") from e
-
-            except (MastodonNetworkError, MastodonRatelimitError) as e:
-                logger.error(e)
-                raise MoaMediaUploadException("Connection Error uploading attachments") from e
-
-            finally:
-                os.unlink(upload_file_name)
-
-        return True
+        except (MastodonNetworkError, MastodonRatelimitError) as e:
+            logger.error(e)
+            raise MoaMediaUploadException("Connection Error uploading attachments") from e
@@ -4,13 +4,11 @@ import logging
 import re
 from datetime import datetime, timezone
 
-import requests
-from twitter import TwitterError
-from urllib3.exceptions import NewConnectionError
+from twitter import Status, TwitterError
 from requests import ConnectionError
 
-from moa.helpers import MoaMediaUploadException
-from moa.message import Message
+from moa.media import probe_size
+from moa.message import Message, memoized_property
 from moa.models import CON_XP_ONLYIF, CON_XP_ONLYIF_TAGS, CON_XP_UNLESS, CON_XP_UNLESS_TAGS
 
 logger = logging.getLogger('worker')
@@ -18,8 +16,124 @@ logger = logging.getLogger('worker')
 HOUR_CUTOFF = 8
 HANDLE_SUFFIX = ''
 
+MAX_VIDEO_SIZE = 8 * 1024 * 1024
+# Estimates are trusted when they are this far below or above the limit, anything in between is checked
+SIZE_ESTIMATE_MARGIN = 0.8
+
+
+CW_REGEX = re.compile(r'[TtCc][Ww]: (.*)\n')
+QUOTED_TWEET_URL = re.compile(r'https://twitter.com/.*$')
+
+
+def entity_indices(entity):
+    """ Where an entity is in the text of its tweet. Entities without indices are never where they say they are. """
+    return getattr(entity, '_json', {}).get('indices', (0, 0))
+
+
+def rewrite_entities(text, entities):
+    """
+    Replace the entities of a tweet in a single pass over its text and unescape the text
+    around them.
+
+    entities are (indices, original, replacement) with the indices Twitter gives us, which
+    point into the escaped text. A link that isn't where its indices say is replaced
+    wherever it appears instead, a mention is left as it is.
+    """
+    parts = []
+    position = 0
+    misplaced = []
+
+    for (start, end), original, replacement in sorted(entities, key=lambda e: e[0][0]):
+
+        if start < position or text[start:end].lower() != original.lower():
+            if not original.startswith('@'):
+                misplaced.append((original, replacement))
+
+            continue
+
+        parts.append(html.unescape(text[position:start]))
+        parts.append(replacement)
+        position = end
+
+    parts.append(html.unescape(text[position:]))
+    text = "".join(parts)
+
+    for original, replacement in misplaced:
+        text = text.replace(original, replacement)
+
+    return text
+
+
+def estimated_size(variant, duration_millis):
+    """ Bytes a video variant should take up, going by its bitrate, or None if we can't tell """
+    if not duration_millis or variant.get('bitrate') is None:
+        return None
+
+    return variant['bitrate'] * duration_millis // 8000
+
+
+def choose_variant(video_info):
+    """
+    Pick the URL of the best video variant that isn't too large to post, or None.
+
+    Most variants can be sized from their bitrate and the video's duration. Only the ones
+    that come too close to the limit to be sure, or have no duration, are checked with
+    HEAD requests, largest first, stopping at the first one that fits.
+    """
+    duration_millis = video_info.get('duration_millis')
+
+    # variants without a bitrate are streaming playlists
+    variants = sorted((v for v in video_info['variants'] if 'bitrate' in v),
+                      key=lambda v: v['bitrate'], reverse=True)
+
+    for variant in variants:
+        size = estimated_size(variant, duration_millis)
+
+        if size is not None and size > MAX_VIDEO_SIZE / SIZE_ESTIMATE_MARGIN:
+            continue
+
+        if size is not None and size <= MAX_VIDEO_SIZE * SIZE_ESTIMATE_MARGIN:
+            return variant['url']
+
+        size = probe_size(variant['url'])
+
+        if size is not None and size <= MAX_VIDEO_SIZE:
+            return variant['url']
+
+        logger.info(f"{variant['url']}: too large ({size} bytes, the limit is {MAX_VIDEO_SIZE})")
+
+    return None
+
+
+def lookup_statuses(api, status_ids):
+    """
+    Like Api.GetStatuses() but with alt text, which it has no option for. Takes up to 100 ids.
+
+    The request goes through the private helpers GetStatuses() itself uses, which is why
+    python-twitter is pinned. Should they go away the statuses are fetched one at a time
+    with the public GetStatus() instead.
+    """
+    if not (hasattr(api, '_RequestUrl') and hasattr(api, '_ParseAndCheckTwitter')):
+        logger.warning("python-twitter has no _RequestUrl, looking up statuses one by one")
+
+        return [api.GetStatus(status_id, trim_user=True, include_ext_alt_text=True) for status_id in status_ids]
+
+    parameters = {
+        'id':                   ','.join(str(status_id) for status_id in status_ids),
+        'trim_user':            True,
+        'include_entities':     True,
+        'include_ext_alt_text': True,
+    }
+
+    resp = api._RequestUrl(f'{api.base_url}/statuses/lookup.json', 'GET', data=parameters)
+    data = api._ParseAndCheckTwitter(resp.content.decode('utf-8'))
+
+    return [Status.NewFromJsonDict(item) for item in data]
+
 
 class Tweet(Message):
+    __slots__ = ('__fetched_attachments', '__content', 'api')
+
     def __init__(self, settings, data, api):
 
         super().__init__(settings, data)
@@ -36,7 +150,7 @@ class Tweet(Message):
     def dump_data(self):
         return json.dumps(self.data._json)
 
-    @property
+    @memoized_property
     def created_at(self):
         return datetime.strptime(self.data.created_at, '%a %b %d %H:%M:%S %z %Y')
 
@@ -46,45 +160,74 @@ class Tweet(Message):
         td = now - self.created_at
         return td.total_seconds() >= 60 * 60 * HOUR_CUTOFF
 
+    @memoized_property
+    def media_source(self):
+        """ The status whose media is posted along with this tweet """
+        if self.is_retweet:
+            return self.data.retweeted_status
+
+        elif self.is_quoted:
+
+            if self.data.media and len(self.data.media) > 0:
+                # Does the user's tweet have media?
+                return self.data
+            else:
+                # If not, use the media from the quoted tweet
+                return self.data.quoted_status
+
+        return self.data
+
     @property
     def media(self):
 
-        if not self.__fetched_attachments:
+        if self.__fetched_attachments is None:
+            Tweet.load_media([self], self.api)
 
-            if self.is_retweet:
-                target_id = self.data.retweeted_status.id
+        return self.__fetched_attachments
 
-            elif self.is_quoted:
+    @classmethod
+    def load_media(cls, tweets, api):
+        """
+        Fill in the media of a batch of tweets with at most one request.
 
-                if self.data.media and len(self.data.media) > 0:
-                    # Does the user's tweet have media?
-                    target_id = self.data.id
-                else:
-                    # If not, use the media from the quoted tweet
-                    target_id = self.data.quoted_status.id
+        The timeline already has each tweet's media but only includes alt text when it's
+        asked for. Media that is complete is used as it is and the rest is looked up in a
+        single statuses/lookup call.
+        """
+        missing = {}
+
+        for tweet in tweets:
+            if tweet.__fetched_attachments is not None:
+                continue
+
+            media = tweet.media_source.media or []
 
+            if all('ext_alt_text' in getattr(m, '_json', {}) for m in media):
+                tweet.__fetched_attachments = media
             else:
-                target_id = self.data.id
+                missing.setdefault(tweet.media_source.id, []).append(tweet)
 
-            try:
-                fetched_tweet = self.api.GetStatus(
-                        status_id=target_id,
-                        trim_user=True,
-                        include_my_retweet=False,
-                        include_entities=True,
-                        include_ext_alt_text=True
-                )
-                self.__fetched_attachments = fetched_tweet.media
+        if not missing:
+            return
 
-            except (TwitterError, ConnectionError) as e:
-                logger.error(e)
+        statuses = {}
 
-            if not self.__fetched_attachments:
-                self.__fetched_attachments = []
+        try:
+            for status in lookup_statuses(api, list(missing)):
+                statuses[status.id] = status
 
-        return self.__fetched_attachments
+        except (TwitterError, ConnectionError) as e:
+            logger.error(e)
 
-    @property
+        for status_id, waiting in missing.items():
+            for tweet in waiting:
+                if status_id in statuses:
+                    tweet.__fetched_attachments = statuses[status_id].media or []
+                else:
+                    # deleted since, or the lookup failed. Post the media without alt text.
+                    tweet.__fetched_attachments = tweet.media_source.media or []
+
+    @memoized_property
     def should_skip(self):
 
         if self.too_old:
@@ -128,7 +271,7 @@ class Tweet(Message):
 
         return False
 
-    @property
+    @memoized_property
     def url(self):
         base = "https://twitter.com"
         user = self.data.user.screen_name
@@ -144,11 +287,11 @@ class Tweet(Message):
 
         return f"{base}/{user}/status/{status}"
 
-    @property
+    @memoized_property
     def is_retweet(self):
         return self.data.retweeted_status is not None
 
-    @property
+    @memoized_property
     def is_quoted(self):
         return self.data.quoted_status is not None
 
@@ -168,7 +311,7 @@ class Tweet(Message):
     def is_self_reply(self):
         return self.data.in_reply_to_user_id == self.data.user.id
 
-    @property
+    @memoized_property
     def urls(self):
         if self.is_retweet:
             return self.data.retweeted_status.urls
@@ -177,11 +320,11 @@ class Tweet(Message):
         else:
             return self.data.urls
 
-    @property
+    @memoized_property
     def is_sensitive(self):
         return bool(self.data.possibly_sensitive)
 
-    @property
+    @memoized_property
     def mentions(self):
 
         if self.is_retweet:
@@ -191,7 +334,7 @@ class Tweet(Message):
 
         return m
 
-    @property
+    @memoized_property
     def quoted_mentions(self):
 
         if self.data.quoted_status:
@@ -199,77 +342,55 @@ class Tweet(Message):
 
         return m
 
-    def expand_handles(self, content, mentions):
+    def expand_entities(self, status, mentions, media=False):
+        """
+        The text of status with its mentions expanded, its t.co links unshortened and,
+        if media is set, the links to its media removed.
+        """
+        entities = [(indices, f"@{mention}", f"@{mention}{HANDLE_SUFFIX}") for mention, indices in mentions]
+        entities += [(entity_indices(url), url.url, url.expanded_url) for url in status.urls or []]
 
-        if content:
+        if media:
+            entities += [(entity_indices(m), m.url, "") for m in status.media or []]
 
-            if mentions:
-                index = 0
-                rt_pad = 0
-
-                for mention, indices in mentions:
-
-                    pad = (index * len(HANDLE_SUFFIX)) - rt_pad
-                    s = indices[0] + pad
-                    e = indices[1] + pad
-                    replacement = f"@{mention}{HANDLE_SUFFIX}"
-
-                    content = content[:s] + replacement + content[e:]
-
-                    index += 1
-        return content
+        return rewrite_entities(status.full_text, entities)
 
     @property
     def clean_content(self):
 
         quoted_text = None
-        cw_regex = r'[TtCc][Ww]: (.*)\n'
 
         if not self.__content:
 
             if self.is_retweet:
-                content = self.data.retweeted_status.full_text
-                content = self.expand_handles(content, self.mentions)
+                content = self.expand_entities(self.data.retweeted_status, self.mentions, media=True)
 
             elif self.is_quoted:
-                content = self.data.full_text
-
-                # Handles have to be expanded before URLs are unfurled or the indices
-                # will be wrong
-                content = self.expand_handles(content, self.mentions)
+                quoted_status = self.data.quoted_status
 
-                for url in self.data.urls:
-                    # Unshorten URLs
-                    content = re.sub(url.url, url.expanded_url, content)
+                content = self.expand_entities(self.data, self.mentions,
+                                               media=self.media_source is self.data)
 
                 # remove the trailing URL of the quoted tweet
-                content = re.sub(r'https://twitter.com/.*$', '', content)
+                content = QUOTED_TWEET_URL.sub('', content)
 
-                quoted_text = self.data.quoted_status.full_text
-                quoted_text = self.expand_handles(quoted_text, self.quoted_mentions)
-                quoted_text = html.unescape(quoted_text)
+                for url in quoted_status.urls or []:
+                    # links shared with the quoted tweet are only in its entities
+                    content = content.replace(url.url, url.expanded_url)
 
-                for url in self.data.quoted_status.urls:
-                    # Unshorten URLs
-                    quoted_text = re.sub(url.url, url.expanded_url, quoted_text)
+                quoted_text = self.expand_entities(quoted_status, self.quoted_mentions,
+                                                   media=self.media_source is quoted_status)
 
             else:
-                content = self.data.full_text
-                content = self.expand_handles(content, self.mentions)
+                content = self.expand_entities(self.data, self.mentions, media=True)
 
-                m = re.search(cw_regex, content)
+                m = CW_REGEX.search(content)
 
                 if m:
                     whole_cw = m.group(0)
                     content = content.replace(whole_cw, '').strip()
                     self.cw = m.group(1)
 
-            content = html.unescape(content)
-
-            for url in self.urls:
-                # Unshorten URLs
-                content = re.sub(url.url, url.expanded_url, content)
-
             if self.is_retweet:
                 if len(content) > 0:
                     content = f"RT @{self.data.retweeted_status.user.screen_name}{HANDLE_SUFFIX}\n{content}"
@@ -277,10 +398,6 @@ class Tweet(Message):
                     content = f"RT @{self.data.retweeted_status.user.screen_name}{HANDLE_SUFFIX}\n"
 
             elif self.is_quoted:
-                for attachment in self.media:
-                    # Remove the t.co link to the media
-                    quoted_text = re.sub(attachment.url, "", quoted_text)
-
                 possible_content = f"{content}\n---\nRT @{self.data.quoted_status.user.screen_name}{HANDLE_SUFFIX}\n{quoted_text}\n{self.url}"
 
                 if len(possible_content) > 500:
@@ -293,10 +410,6 @@ class Tweet(Message):
                 else:
                     content = possible_content
 
-            for attachment in self.media:
-                # Remove the t.co link to the media
-                content = re.sub(attachment.url, "", content)
-
             if len(content) == 0:
                 logger.info("Content is empty - adding unicode character.")
                 content = u"\u2063"
@@ -308,66 +421,15 @@ class Tweet(Message):
 
         self.message_parts.append(self.clean_content)
 
-    @property
+    @memoized_property
     def media_attachments(self):
-
         attachments = []
 
         for attachment in self.media:
             # logger.debug(attachment.__dict__)
 
-            type = attachment.type
-            attachment_url = None
-
-            if type in ['video', 'animated_gif']:
-
-                variants = attachment.video_info['variants'].copy()
-                variants.reverse()
-
-                # logger.debug(variants)
-
-                index = 0
-                max = len(variants) - 1
-
-                while not attachment_url and index <= max:
-                    logger.info(f"Examining attachment variant {index}")
-
-                    if 'bitrate' not in variants[index]:
-                        logger.info(f"Missing bitrate")
-
-                        attachment_url = None
-                        index += 1
-
-                        if index > max:
-                            continue
-
-                    attachment_url = variants[index]['url']
-
-                    try:
-                        response = requests.head(attachment_url)
-
-                        if response.ok:
-                            size = int(response.headers['content-length'])
-
-                            if size > (8 * 1024 * 1024):
-                                logger.info(f"Too large")
-                                attachment_url = None
-                                index += 1
-
-                                if index > max:
-                                    continue
-                        else:
-                            attachment_url = None
-                            index += 1
-
-                            if index > max:
-                                continue
-
-                    except (ConnectionError, NewConnectionError) as e:
-                        logger.error(f"{e}")
-                        attachment_url = None
-                        raise MoaMediaUploadException("Connection Error fetching attachments")
-
+            if attachment.type in ['video', 'animated_gif']:
+                attachment_url = choose_variant(attachment.video_info)
             else:
                 attachment_url = attachment.media_url
 
@@ -5,32 +5,32 @@ import platform
 import pprint as pp
 import subprocess
 import sys
-import tempfile
 import time
 from typing import Optional
 
-import requests
 from pymysql import OperationalError
-from requests.exceptions import SSLError
 from twitter import TwitterError
-from urllib3.exceptions import ProtocolError, NewConnectionError, ConnectionError
+from urllib3.exceptions import NewConnectionError, ConnectionError
 
 from moa.helpers import MoaMediaUploadException
 from moa.message import Message
-from moa.models import Mapping
 from moa.poster import Poster
 
 logger = logging.getLogger('worker')
 TWITTER_RETRIES = 3
 TWITTER_RETRY_DELAY = 5
 TWEET_LENGTH = 280
+# Twitter's limit for chunked video uploads, images are rejected by the API well before this
+TWITTER_MAX_MEDIA_SIZE = 512 * 1024 * 1024
 
 
 class TweetPoster(Poster):
+    media_target = 'twitter'
+    media_id_type = int
 
-    def __init__(self, send, session, api, bridge):
+    def __init__(self, send, session, api, bridge, media_cache=None, mappings=None):
 
-        super().__init__(send, session)
+        super().__init__(send, session, media_cache, mappings)
 
         self.api = api
         self.bridge = bridge
@@ -60,11 +60,9 @@ class TweetPoster(Poster):
 
                 # In the case where a toot has been broken into multiple tweets
                 # we want the last one posted
-                mapping = self.session.query(Mapping).filter_by(mastodon_id=post.in_reply_to_id).order_by(
-                        Mapping.created.desc()).first()
+                reply_to = self.mappings.twitter_id(post.in_reply_to_id)
 
-                if mapping:
-                    reply_to = mapping.twitter_id
+                if reply_to:
                     logger.info(f"Replying to Twitter status {reply_to} / masto status {post.in_reply_to_id}")
                 else:
                     # we don't know about this message which means it wasn't posted so let's skip it
@@ -86,16 +84,16 @@ class TweetPoster(Poster):
                     logger.info(f"Tweet ID: {reply_to}")
 
                     if post.type == "Toot":
-                        m = Mapping()
-                        m.mastodon_id = post.id
-                        m.twitter_id = reply_to
-                        self.session.add(m)
+                        self.mappings.add(post.id, reply_to)
                 else:
                     return False
 
                 if post.type == "Toot":
                     self.bridge.mastodon_last_id = post.id
 
+                # the mappings go in with last_id so a thread can always find its parts
+                self.mappings.flush()
+
                 try:
                     self.session.commit()
                 except OperationalError as e:
@@ -103,6 +101,7 @@ class TweetPoster(Poster):
                     logger.error(e)
                     sys.exit()
 
+            self.forget_uploads()
 
             return True
         else:
@@ -158,67 +157,58 @@ class TweetPoster(Poster):
 
         return reply_to
 
-    def transfer_attachments(self, post: Message):
-        # logger.debug(post.media_attachments)
-
-        for attachment in post.media_attachments:
-            attachment_url = attachment.get("url")
+    def download_attachment(self, attachment) -> Optional[str]:
+        attachment_url = attachment.get("url")
 
-            logger.info(f'Downloading {attachment_url}')
-
-            try:
-                attachment_file = requests.get(attachment_url, stream=True)
-                attachment_file.raw.decode_content = True
+        logger.info(f'Downloading {attachment_url}')
 
-                temp_file = tempfile.NamedTemporaryFile(delete=False)
-                temp_file.write(attachment_file.raw.read())
-                temp_file.close()
+        temp_file_name, content_type = self.fetch_attachment(attachment_url, TWITTER_MAX_MEDIA_SIZE)
 
-            except (SSLError, ProtocolError, ConnectionError, NewConnectionError) as e:
-                logger.error(f"{e}")
-                raise MoaMediaUploadException("Connection Error fetching attachments")
+        fsize = os.path.getsize(temp_file_name)
 
-            fsize = os.path.getsize(temp_file.name)
+        if fsize == 0:
+            logger.error("Attachment is 0 length...skipping")
+            os.unlink(temp_file_name)
+            return None
 
-            if fsize == 0:
-                logger.error("Attachment is 0 length...skipping")
-                continue
+        file_extension = mimetypes.guess_extension(content_type)
 
-            file_extension = mimetypes.guess_extension(attachment_file.headers['Content-type'])
+        # ffs
+        if file_extension == '.jpe':
+            file_extension = '.jpg'
+        elif file_extension is None:
+            file_extension = ''
 
-            # ffs
-            if file_extension == '.jpe':
-                file_extension = '.jpg'
-            elif file_extension is None:
-                file_extension = ''
+        upload_file_name = temp_file_name + file_extension
+        os.rename(temp_file_name, upload_file_name)
 
-            upload_file_name = temp_file.name + file_extension
-            os.rename(temp_file.name, upload_file_name)
+        if file_extension == '.webm':
+            converted_file_name = temp_file_name + '.mp4'
+            if platform.system() == 'Darwin':
+                FFMPEG = '/usr/local/bin/ffmpeg'
+            else:
+                FFMPEG = '/usr/bin/ffmpeg'
 
-            if file_extension == '.webm':
-                converted_file_name = temp_file.name + '.mp4'
-                if platform.system() == 'Darwin':
-                    FFMPEG = '/usr/local/bin/ffmpeg'
-                else:
-                    FFMPEG = '/usr/bin/ffmpeg'
+            return_code = subprocess.call([FFMPEG,
+                                           '-loglevel', 'error',
+                                           '-xerror',
+                                           '-i', upload_file_name,
+                                           '-y',
+                                           converted_file_name])
+            os.unlink(upload_file_name)
 
-                return_code = subprocess.call([FFMPEG,
-                                               '-loglevel', 'error',
-                                               '-xerror',
-                                               '-i', upload_file_name,
-                                               '-y',
-                                               converted_file_name])
-                os.unlink(upload_file_name)
+            if return_code == 0:
+                upload_file_name = converted_file_name
 
-                if return_code == 0:
-                    upload_file_name = converted_file_name
+        return upload_file_name
 
-            description = attachment.get('description', "")
-            # self.attachments.append((upload_file_name, description))
+    def upload_attachment(self, attachment, upload_file_name):
+        description = attachment.get('description', "")
+        file_extension = os.path.splitext(upload_file_name)[1]
 
-            temp_file_read = open(upload_file_name, 'rb')
-            logger.info(f'Uploading {description} {upload_file_name}')
+        logger.info(f'Uploading {description} {upload_file_name}')
 
+        with open(upload_file_name, 'rb') as temp_file_read:
             try:
                 if file_extension in ['.webm', '.mp4', '.mov']:
                     media_id = self.api.UploadMediaChunked(media=temp_file_read,
@@ -229,13 +219,8 @@ class TweetPoster(Poster):
                 if description:
                     self.api.PostMediaMetadata(media_id, alt_text=description)
 
-                self.media_ids.append(media_id)
+                return media_id
 
             except (TwitterError, ConnectionError, NewConnectionError) as e:
-                logger.error(f"Twitter upload error: {e.message}")
+                logger.error(f"Twitter upload error: {e}")
                 raise MoaMediaUploadException("Connection Error uploading attachments")
-
-            finally:
-                temp_file_read.close()
-                os.unlink(upload_file_name)
-        return True
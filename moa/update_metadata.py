@@ -4,12 +4,12 @@ import os
 import sys
 from datetime import datetime
 
-import twitter
-from mastodon import Mastodon, MastodonAPIError, MastodonNetworkError
+from mastodon import MastodonAPIError, MastodonNetworkError
 from sqlalchemy import create_engine, exc
 from sqlalchemy.orm import Session
 from twitter import TwitterError
 
+from moa.clients import ClientFactory
 from moa.helpers import FORMAT
 from moa.models import Bridge, Mapping, WorkerStat, BridgeMetadata
 
@@ -46,6 +46,7 @@ except exc.SQLAlchemyError as e:
     sys.exit()
 
 session = Session(engine)
+clients = ClientFactory(c.TWITTER_CONSUMER_KEY, c.TWITTER_CONSUMER_SECRET, pool_size=c.HTTP_POOL_SIZE)
 
 bridges = session.query(Bridge).filter_by(enabled=True)
 
@@ -58,15 +59,10 @@ for bridge in bridges:
     if bridge.mastodon_access_code:
         mastodonhost = bridge.mastodon_host
 
-        mast_api = Mastodon(
-                client_id=mastodonhost.client_id,
-                client_secret=mastodonhost.client_secret,
-                api_base_url=f"https://{mastodonhost.hostname}",
-                access_token=bridge.mastodon_access_code,
-                debug_requests=False,
-                request_timeout=15,
-                ratelimit_method='throw'
-        )
+        mast_api = clients.mastodon(mastodonhost,
+                                    bridge.mastodon_access_code,
+                                    request_timeout=15,
+                                    ratelimit_method='throw')
 
         try:
             profile = mast_api.account_verify_credentials()
@@ -2,34 +2,36 @@ import argparse
 import importlib
 import logging
 import os
+import signal
 import smtplib
 import sys
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta
 from http.client import IncompleteRead
 from pathlib import Path
 from typing import Any, List
 
 import psutil
 import requests
-import twitter
-from httplib2 import ServerNotFoundError
-from instagram import InstagramAPI, InstagramAPIError, InstagramClientError
-from instagram.helper import datetime_to_timestamp
-from mastodon import Mastodon
 from mastodon.Mastodon import MastodonAPIError, MastodonNetworkError, MastodonRatelimitError, MastodonServerError
 from requests import ConnectionError
-from sentry_sdk.integrations.flask import FlaskIntegration
-from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
-from sqlalchemy import create_engine, exc, func
+from sqlalchemy import create_engine, exc
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 from sqlalchemy.orm.exc import ObjectDeletedError
 from twitter import TwitterError
 
+from moa.clients import ClientFactory
 from moa.helpers import email_deferral, MoaMediaUploadException, FORMAT
 from moa.insta import Insta
-from moa.models import Bridge, WorkerStat, DEFER_OK, DEFER_FAILED, BridgeStat, BridgeMetadata
+from moa.mappings import MappingBuffer
+from moa.media import MediaCache
+from moa.models import Bridge, DEFER_OK, DEFER_FAILED, BridgeMetadata
+from moa.scheduler import BridgeScheduler, claim_bridges, due_bridges, lease_owner, load_bridges, release_bridge, \
+    record_time, schedule_next_poll, timestamp, with_related, worker_bridges
+from moa.stats import StatsAggregator
 from moa.toot import Toot
 from moa.toot_poster import TootPoster
 from moa.tweet import Tweet
@@ -42,7 +44,9 @@ c = getattr(importlib.import_module('config'), moa_config)
 
 if c.SENTRY_DSN:
     import sentry_sdk
+    from sentry_sdk.integrations.flask import FlaskIntegration
     from sentry_sdk.integrations.logging import LoggingIntegration
+    from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 
     sentry_logging = LoggingIntegration(
             level=logging.INFO,  # Capture info and above as breadcrumbs
@@ -54,10 +58,26 @@ if c.SENTRY_DSN:
 
 parser = argparse.ArgumentParser(description='Moa Worker')
 parser.add_argument('--worker', dest='worker', type=int, required=False, default=1)
+parser.add_argument('--concurrency', dest='concurrency', type=int, required=False, default=c.WORKER_CONCURRENCY,
+                    help='Number of bridges to process at the same time')
+parser.add_argument('--daemon', dest='daemon', action='store_true',
+                    help='Keep running and poll each bridge on its own schedule instead of exiting after one pass')
+parser.add_argument('--lease', dest='lease', action='store_true', default=c.WORKER_LEASES,
+                    help='Claim due bridges from all workers\' bridges instead of only those assigned to --worker')
 args = parser.parse_args()
 
-worker_stat = WorkerStat(worker=args.worker)
-worker_stat.time = 0
+# shared by all the bridge threads and written to the DB every now and then
+stats = StatsAggregator(args.worker)
+stopping = threading.Event()
+
+# API clients and their HTTP connections are kept between polls and shared by bridges on the same host
+clients = ClientFactory(c.TWITTER_CONSUMER_KEY, c.TWITTER_CONSUMER_SECRET, pool_size=c.HTTP_POOL_SIZE)
+
+# attachments that are posted again by another bridge or on a retry are only downloaded once
+media_cache = None
+
+if c.MEDIA_CACHE_DIR:
+    media_cache = MediaCache(c.MEDIA_CACHE_DIR, c.MEDIA_CACHE_SIZE, c.MEDIA_CACHE_TTL)
 
 logging.basicConfig(format=FORMAT)
 
@@ -71,7 +91,13 @@ else:
 # logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
 l.info("Starting up…")
-engine = create_engine(c.SQLALCHEMY_DATABASE_URI)
+engine_options = {}
+
+if 'sqlite' not in c.SQLALCHEMY_DATABASE_URI:
+    # Each bridge thread checks out its own connection
+    engine_options['pool_size'] = args.concurrency + 1
+
+engine = create_engine(c.SQLALCHEMY_DATABASE_URI, **engine_options)
 try:
     db_connection = engine.connect()
 except OperationalError as e:
@@ -90,18 +116,32 @@ session = Session(engine)
 lockfile = Path(f'worker_{args.worker}.lock')
 
 
-def check_worker_stop():
+def worker_stop_requested():
+    """ Tell the bridge threads to stop if a worker_stop file has been created """
     if Path('worker_stop').exists():
         l.info("Worker paused...exiting")
-        session.add(worker_stat)
-        session.commit()
-        session.close()
-        try:
-            lockfile.unlink()
-        except FileNotFoundError:
-            pass
+        stopping.set()
+        return True
+
+    return False
+
+
+def stop_worker():
+    """ Save the stats and release the lock, only once no bridges are running """
+    stats.add_time(time.time() - start_time, runs=1)
+    stats.flush(session)
+    session.close()
+    try:
+        lockfile.unlink()
+    except FileNotFoundError:
+        pass
+
+    exit(0)
+
 
-        exit(0)
+def check_worker_stop():
+    if worker_stop_requested():
+        stop_worker()
 
 
 check_worker_stop()
@@ -131,27 +171,78 @@ with lockfile.open('wt') as f:
 if not c.SEND:
     l.warning("SENDING IS NOT ENABLED")
 
-bridges = session.query(Bridge).filter_by(enabled=True).filter(BridgeMetadata.worker_id == args.worker).filter(BridgeMetadata.id == Bridge.metadata_id)
+owner = lease_owner()
 
-l.info(f"Working on {bridges.count()} bridges")
+if args.lease:
+    l.info(f"Claiming due bridges as {owner}")
+else:
+    bridges = worker_bridges(session, args.worker)
 
-if 'sqlite' not in c.SQLALCHEMY_DATABASE_URI and not c.DEVELOPMENT:
-    bridges = bridges.order_by(func.rand())
+    if not args.daemon:
+        # the daemon keeps track of due times itself
+        bridges = due_bridges(bridges)
 
-bridge_count = 0
+    l.info(f"Working on {bridges.count()} bridges")
 
-for bridge in bridges:
-    # l.debug(bridge.t_settings.__dict__)
-    total_time = time.time() - start_time
 
-    if total_time > 60 * 4.5:
-        continue
+def run_bridge(bridge):
+    """
+    Process a single bridge in its own session. Runs on the worker thread pool so every
+    bridge gets a private session and its messages are still posted in order.
+
+    The bridge comes detached from a batch query that already loaded its host, settings
+    and metadata, and is merged into the thread's session without going back to the DB.
+
+    Returns the time the bridge is next due, or a false value if it wasn't processed.
+    """
+    metadata_id = bridge.metadata_id
+    processed = False
+
+    try:
+        if stopping.is_set():
+            return False
+
+        bridge_start_time = time.time()
+        total_time = bridge_start_time - start_time
+
+        if not args.daemon and total_time > 60 * 4.5:
+            return False
+
+        bridge_session = Session(engine)
+
+        try:
+            bridge = bridge_session.merge(bridge, load=False)
+            processed = True
+
+            return process_bridge(bridge_session, bridge)
+
+        finally:
+            bridge_session.close()
+
+            if args.daemon:
+                # a daemon's stats record how long it was busy rather than how long it ran
+                stats.add_time(time.time() - bridge_start_time)
+    finally:
+        if args.lease:
+            # bridges that were skipped stay due for the next worker
+            retry_at = datetime.utcnow() + timedelta(seconds=c.POLL_RETRY_INTERVAL) if processed else None
+            release_bridge(engine, metadata_id, owner, retry_at)
+
+
+def process_bridge(session, bridge):
+    """
+    Poll a bridge, post what's new and schedule its next poll. A poll that stops early,
+    by returning or raising, is retried after POLL_RETRY_INTERVAL at the soonest.
+
+    Returns the time the bridge is next due.
+    """
+    bridge_start_time = time.time()
 
     try:
         _ = bridge.id
     except ObjectDeletedError:
         # in case the row is removed during a run
-        continue
+        return False
 
     except OperationalError as e:
         # MySQL might be down
@@ -161,10 +252,42 @@ for bridge in bridges:
     if not bridge.md:
         bridge.md = BridgeMetadata()
 
+    mappings = MappingBuffer(session)
+    completed = False
+
+    try:
+        completed = transfer_messages(session, bridge, mappings)
+
+    except BaseException:
+        # the session can't be trusted after an error, what was posted is committed already
+        session.rollback()
+        raise
+
+    finally:
+        mappings.flush()
+        next_poll = schedule_next_poll(bridge.md, c, failed=not completed)
+        # balance.py spreads bridges over the workers by how long they take
+        record_time(bridge.md, time.time() - bridge_start_time)
+
+        try:
+            session.commit()
+        except OperationalError as e:
+            # MySQL might be down
+            l.error(e)
+            sys.exit()
+
+    return next_poll
+
+
+def transfer_messages(session, bridge, mappings):
+    """ Fetch a bridge's new messages and post them. Returns False if it had to stop early. """
+    # l.debug(bridge.t_settings.__dict__)
+
     #
     # Fetch from Mastodon
     #
     new_toots: List[Any] = []
+    latest_toot_id = None
 
     if not bridge.mastodon_access_code:
         bridge.enabled = False
@@ -175,17 +298,12 @@ for bridge in bridges:
 
         if mastodonhost.defer_until and mastodonhost.defer_until > datetime.now():
             l.warning(f"Deferring connections to {mastodonhost.hostname}")
-            continue
-
-        mast_api = Mastodon(
-                client_id=mastodonhost.client_id,
-                client_secret=mastodonhost.client_secret,
-                api_base_url=f"https://{mastodonhost.hostname}",
-                access_token=bridge.mastodon_access_code,
-                debug_requests=False,
-                request_timeout=15,
-                ratelimit_method='throw'
-        )
+            return False
+
+        mast_api = clients.mastodon(mastodonhost,
+                                    bridge.mastodon_access_code,
+                                    request_timeout=15,
+                                    ratelimit_method='throw')
 
         try:
             new_toots = mast_api.account_statuses(
@@ -216,7 +334,7 @@ for bridge in bridges:
 
             session.commit()
 
-            continue
+            return False
 
         # except MastodonServerError as e:
         #     msg = f"{bridge.mastodon_user}@{mastodonhost.hostname} MastodonServerError: {e}"
@@ -242,7 +360,7 @@ for bridge in bridges:
         #
         #     session.commit()
         #
-        #     continue
+        #     return
 
         # except MastodonNetworkError as e:
         #     msg = f"{bridge.mastodon_user}@{mastodonhost.hostname} MastodonNetworkError: {e}"
@@ -268,7 +386,7 @@ for bridge in bridges:
         #
         #     session.commit()
         #
-        #     continue
+        #     return
 
         except MastodonRatelimitError as e:
             l.error(f"{bridge.mastodon_user}@{mastodonhost.hostname}: {e}")
@@ -279,11 +397,9 @@ for bridge in bridges:
 
         if c.SEND and len(new_toots) != 0:
             try:
-                bridge.mastodon_last_id = int(new_toots[0]['id'])
+                latest_toot_id = int(new_toots[0]['id'])
             except ValueError:
-                continue
-
-            bridge.updated = datetime.now()
+                return False
 
         new_toots.reverse()
         mastodonhost.defer_reset()
@@ -295,13 +411,7 @@ for bridge in bridges:
     if bridge.twitter_oauth_token:
         twitter_last_id = bridge.twitter_last_id
 
-        twitter_api = twitter.Api(
-                consumer_key=c.TWITTER_CONSUMER_KEY,
-                consumer_secret=c.TWITTER_CONSUMER_SECRET,
-                access_token_key=bridge.twitter_oauth_token,
-                access_token_secret=bridge.twitter_oauth_secret,
-                tweet_mode='extended'  # Allow tweets longer than 140 raw characters
-        )
+        twitter_api = clients.twitter(bridge.twitter_oauth_token, bridge.twitter_oauth_secret)
 
         try:
             new_tweets = twitter_api.GetUserTimeline(
@@ -313,7 +423,7 @@ for bridge in bridges:
             l.error(f"@{bridge.twitter_handle}: {e}")
 
             if 'Unknown' in e.message:
-                continue
+                return False
             # elif 'OAuthAccessTokenException' in e.message:
             #     l.warning(f"Disabling bridge for Twitter user {bridge.twitter_handle}")
             #     bridge.enabled = False
@@ -325,10 +435,10 @@ for bridge in bridges:
                     bridge.twitter_oauth_secret = None
                     bridge.enabled = False
 
-            continue
+            return False
 
         except ConnectionError as e:
-            continue
+            return False
 
         if len(new_tweets) > c.MAX_MESSAGES_PER_RUN:
             l.error(f"@{bridge.twitter_handle}: Limiting to {c.MAX_MESSAGES_PER_RUN} messages")
@@ -340,6 +450,11 @@ for bridge in bridges:
 
         new_tweets.reverse()
 
+    # set once both sides were fetched so a failed Twitter fetch can't skip any toots
+    if latest_toot_id:
+        bridge.mastodon_last_id = latest_toot_id
+        bridge.updated = datetime.now()
+
     #
     # Instagram
     #
@@ -367,7 +482,7 @@ for bridge in bridges:
     #
     #     except (ConnectionResetError, IncompleteRead, ServerNotFoundError) as e:
     #         l.error(f"{e}")
-    #         continue
+    #         return
     #
     #     else:
     #         for media in recent_media:
@@ -386,8 +501,6 @@ for bridge in bridges:
     # Post Toots to Twitter
     #
 
-    bridge_stat = None
-
     try:
         settings = bridge.t_settings
     except OperationalError as e:
@@ -396,19 +509,17 @@ for bridge in bridges:
         sys.exit()
 
     if bridge.twitter_oauth_token:
-        tweet_poster = TweetPoster(c.SEND, session, twitter_api, bridge)
+        tweet_poster = TweetPoster(c.SEND, session, twitter_api, bridge, media_cache, mappings)
 
         if bridge.mastodon_access_code:
             l.info(f"{bridge.id}: M - {bridge.mastodon_user}@{mastodonhost.hostname}")
 
-            tweet_poster = TweetPoster(c.SEND, session, twitter_api, bridge)
+            tweet_poster = TweetPoster(c.SEND, session, twitter_api, bridge, media_cache, mappings)
 
             if settings.post_to_twitter_enabled and len(new_toots) > 0:
 
                 l.info(f"{len(new_toots)} new toots found")
 
-                bridge_stat = BridgeStat(bridge.id)
-
                 for toot in new_toots:
 
                     t = Toot(settings, toot, c)
@@ -419,18 +530,17 @@ for bridge in bridges:
                         continue
 
                     if result:
-                        worker_stat.add_toot()
-                        bridge_stat.add_toot()
+                        stats.add(bridge.id, toots=1)
 
+                    # the poster has committed last_id if anything was sent, this can wait for the end
                     bridge.md.last_toot = t.data['created_at']
-                    session.commit()
 
     #
     # Post Tweets to Mastodon
     #
 
     if bridge.mastodon_access_code:
-        toot_poster = TootPoster(c.SEND, session, mast_api, bridge)
+        toot_poster = TootPoster(c.SEND, session, mast_api, bridge, media_cache, mappings)
 
         if bridge.twitter_oauth_token:
             l.info(f"{bridge.id}: T - @{bridge.twitter_handle}")
@@ -438,12 +548,11 @@ for bridge in bridges:
             if settings.post_to_mastodon_enabled and len(new_tweets) > 0:
                 l.info(f"{len(new_tweets)} new tweets found")
 
-                if not bridge_stat:
-                    bridge_stat = BridgeStat(bridge.id)
+                tweets = [Tweet(settings, status, twitter_api) for status in new_tweets]
+                # a single request for the alt text of the tweets that will be posted
+                Tweet.load_media([tweet for tweet in tweets if not tweet.should_skip], twitter_api)
 
-                for status in new_tweets:
-
-                    tweet = Tweet(settings, status, twitter_api)
+                for tweet in tweets:
 
                     try:
                         result = toot_poster.post(tweet)
@@ -452,11 +561,9 @@ for bridge in bridges:
                         continue
 
                     if result:
-                        worker_stat.add_tweet()
-                        bridge_stat.add_tweet()
+                        stats.add(bridge.id, tweets=1)
 
                     bridge.md.last_tweet = tweet.created_at
-                    session.commit()
 
 
     #
@@ -469,27 +576,24 @@ for bridge in bridges:
         if settings.instagram_post_to_mastodon or settings.instagram_post_to_twitter:
             l.info(f"{len(new_instas)} new instas found")
 
-            if not bridge_stat:
-                bridge_stat = BridgeStat(bridge.id)
-
             for data in new_instas:
                 stat_recorded = False
 
                 insta = Insta(settings, data)
 
                 if not insta.should_skip_mastodon and bridge.mastodon_access_code:
-                    toot_poster = TootPoster(c.SEND, session, mast_api, bridge)
+                    toot_poster = TootPoster(c.SEND, session, mast_api, bridge, media_cache, mappings)
                     try:
                         result = toot_poster.post(insta)
                     except MoaMediaUploadException as e:
                         continue
 
                     if result:
-                        worker_stat.add_insta()
+                        stats.add(bridge.id, instas=1)
                         stat_recorded = True
 
                 if not insta.should_skip_twitter and bridge.twitter_oauth_token:
-                    tweet_poster = TweetPoster(c.SEND, session, twitter_api, bridge)
+                    tweet_poster = TweetPoster(c.SEND, session, twitter_api, bridge, media_cache, mappings)
 
                     try:
                         result = tweet_poster.post(insta)
@@ -497,39 +601,254 @@ for bridge in bridges:
                         continue
 
                     if result and not stat_recorded:
-                        worker_stat.add_insta()
-                        bridge_stat.add_insta()
+                        stats.add(bridge.id, instas=1)
 
-    if bridge_stat and bridge_stat.items > 0:
-        session.add(bridge_stat)
+    return True
 
-    if c.SEND:
+
+def ping_healthcheck():
+    if len(c.HEALTHCHECKS) >= args.worker:
+        url = c.HEALTHCHECKS[args.worker - 1]
         try:
-            session.commit()
-        except OperationalError as e:
-            # MySQL might be down
-            l.error(e)
-            sys.exit()
+            requests.get(url)
+        except Exception:
+            pass
+
+
+def run_once():
+    bridge_count = 0
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    batch = with_related(bridges).all()
+
+    # the bridge threads merge these into their own sessions
+    session.expunge_all()
+
+    futures = [executor.submit(run_bridge, bridge) for bridge in batch]
+    stopped = False
+
+    try:
+        for future in as_completed(futures):
+            if future.result():
+                bridge_count = bridge_count + 1
+
+            if worker_stop_requested():
+                stopped = True
+                break
+    finally:
+        # let the bridges that are still running finish but don't start any new ones
+        stopping.set()
+        executor.shutdown()
+
+    if stopped:
+        stop_worker()
+
+    finish_run(bridge_count)
+
+
+def finish_run(bridge_count):
+    ping_healthcheck()
+
+    stats.add_time(time.time() - start_time, runs=1)
+
+    l.info(f"-- All done -> Total time: {stats.formatted_time} / {stats.items} items / {bridge_count} Bridges")
+    log_media_cache()
+
+    stats.flush(session)
+    session.close()
+    db_connection.close()
+
+    lockfile.unlink()
+
+
+def log_media_cache():
+    if media_cache:
+        l.info(f"-- Media cache: {media_cache.hits} hits / {media_cache.misses} misses")
+
+
+def flush_worker_stat():
+    """ Save the stats gathered since the last flush and start counting again """
+    # for a daemon every stats interval counts as a run
+    stats.add_time(0, runs=1)
+
+    l.info(f"-- Busy time: {stats.formatted_time} / {stats.items} items")
+    log_media_cache()
+
+    stats.flush(session)
+
+
+def handle_shutdown(signum, frame):
+    l.info(f"Received signal {signum}, shutting down…")
+    stopping.set()
+
+
+def run_daemon():
+    scheduler = BridgeScheduler(c.POLL_RETRY_INTERVAL)
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    in_flight = {}
+    last_refresh = 0
+    last_flush = time.time()
+
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+
+    l.info(f"Running as a daemon with {args.concurrency} threads")
+
+    try:
+        while not stopping.is_set():
+            now = time.time()
+
+            if now - last_refresh >= c.DAEMON_REFRESH_INTERVAL:
+                due_times = bridges.with_entities(Bridge.id, BridgeMetadata.next_poll)
+                scheduler.refresh({bridge_id: next_poll and timestamp(next_poll) for bridge_id, next_poll in due_times}, now)
+                # end the read transaction so the next refresh sees new bridges
+                session.commit()
+                last_refresh = now
+                l.info(f"Working on {len(scheduler)} bridges")
+
+            due_ids = scheduler.pop_due(now)
 
-    end_time = time.time()
-    worker_stat.time = end_time - start_time
-    bridge_count = bridge_count + 1
+            if due_ids:
+                batch = load_bridges(session, due_ids)
+                session.expunge_all()
 
-    check_worker_stop()
+                for bridge in batch:
+                    in_flight[executor.submit(run_bridge, bridge)] = bridge.id
+
+                for bridge_id in set(due_ids) - set(in_flight.values()):
+                    # disabled or deleted since the last refresh
+                    scheduler.reschedule(bridge_id)
+
+            next_due = scheduler.next_due() or now + 1
+            timeout = min(max(next_due - now, 0), 1)
+
+            if in_flight:
+                done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    bridge_id = in_flight.pop(future)
+
+                    next_poll = None
+
+                    try:
+                        next_poll = future.result()
+                    except Exception as e:
+                        # one broken bridge shouldn't take the whole daemon down
+                        l.exception(f"{bridge_id}: {e}")
+
+                    if next_poll:
+                        # process_bridge has already backed off if the poll failed
+                        scheduler.reschedule(bridge_id, delay=timestamp(next_poll) - time.time())
+                    else:
+                        # it raised or wasn't processed, try again after POLL_RETRY_INTERVAL
+                        scheduler.reschedule(bridge_id)
+            else:
+                stopping.wait(timeout)
+
+            if now - last_flush >= c.DAEMON_STATS_INTERVAL:
+                flush_worker_stat()
+                ping_healthcheck()
+                last_flush = now
+    finally:
+        stopping.set()
+        executor.shutdown()
+
+        finish_daemon()
+
+
+def finish_daemon():
+    flush_worker_stat()
+    session.close()
+    db_connection.close()
 
-if len(c.HEALTHCHECKS) >= args.worker:
-    url = c.HEALTHCHECKS[args.worker - 1]
     try:
-        requests.get(url)
-    except Exception:
+        lockfile.unlink()
+    except FileNotFoundError:
         pass
 
-l.info(f"-- All done -> Total time: {worker_stat.formatted_time} / {worker_stat.items} items / {bridge_count} Bridges")
 
-session.add(worker_stat)
+def run_leased():
+    """
+    Claim due bridges from the shared pool a few at a time, until none are left or, as a
+    daemon, until stopped. Only enough bridges for two rounds of the thread pool are
+    leased at once so leases don't run out while their bridges wait in the queue.
+    """
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    in_flight = set()
+    bridge_count = 0
+    next_claim = 0
+    last_flush = time.time()
+    stopped = False
+
+    if args.daemon:
+        signal.signal(signal.SIGTERM, handle_shutdown)
+        signal.signal(signal.SIGINT, handle_shutdown)
+
+        l.info(f"Running as a daemon with {args.concurrency} threads")
+
+    try:
+        while not stopping.is_set():
+            now = time.time()
+
+            if not args.daemon and now - start_time > 60 * 4.5:
+                break
 
-session.commit()
-session.close()
-db_connection.close()
+            wanted = 2 * args.concurrency - len(in_flight)
 
-lockfile.unlink()
+            if wanted > 0 and now >= next_claim:
+                bridge_ids = claim_bridges(session, owner, wanted, c.LEASE_TIME)
+                # bridges disabled since they were claimed are skipped, their leases just expire
+                batch = load_bridges(session, bridge_ids)
+                session.expunge_all()
+
+                for bridge in batch:
+                    in_flight.add(executor.submit(run_bridge, bridge))
+
+                if len(bridge_ids) < wanted:
+                    # everything that's due is taken, don't hammer the DB looking for more
+                    next_claim = now + c.LEASE_POLL_INTERVAL
+
+            if not in_flight:
+                if not args.daemon:
+                    break
+
+                stopping.wait(max(next_claim - now, 0))
+                continue
+
+            done, _ = wait(in_flight, timeout=1, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                in_flight.discard(future)
+
+                try:
+                    if future.result():
+                        bridge_count = bridge_count + 1
+                except Exception as e:
+                    l.exception(e)
+
+            if args.daemon:
+                if now - last_flush >= c.DAEMON_STATS_INTERVAL:
+                    flush_worker_stat()
+                    ping_healthcheck()
+                    last_flush = now
+            else:
+                stopped = worker_stop_requested()
+    finally:
+        stopping.set()
+        executor.shutdown()
+
+        if args.daemon:
+            finish_daemon()
+
+    if stopped:
+        stop_worker()
+
+    if not args.daemon:
+        finish_run(bridge_count)
+
+
+if args.lease:
+    run_leased()
+elif args.daemon:
+    run_daemon()
+else:
+    run_once()
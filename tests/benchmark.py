@@ -0,0 +1,190 @@
+"""
+Rough timings for the hot paths of the worker. Run from the top of the repo with
+
+    python -m tests.benchmark [name ...]
+"""
+import argparse
+import ast
+import html
+import importlib
+import json
+import os
+import re
+import subprocess
+import sys
+import timeit
+
+from moa.models import TSettings
+from moa.toot import Toot, html_to_text
+from tests.test_toots import SAMPLES, TextToot, reference_sanitize, reference_split
+
+LOREM = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit https://example.com/lorem/ipsum?dolor=1 "
+         "sed do eiusmod tempor incididunt ut labore et dolore magna aliqua 🐘\n")
+
+
+def config():
+    moa_config = os.environ.get('MOA_CONFIG', 'DevelopmentConfig')
+    return getattr(importlib.import_module('config'), moa_config)
+
+
+def best_of(stmt, number=3):
+    return min(timeit.repeat(stmt, number=1, repeat=number))
+
+
+def bench_split_toot():
+    """ Toot.split_toot should grow linearly with the length of the toot """
+    settings = TSettings()
+    settings.split_twitter_messages = True
+    c = config()
+
+    print(f"{'chars':>8} {'split_toot':>12} {'per char':>14} {'original':>12}")
+
+    for repeat in [5, 10, 20, 40, 80]:
+        toot = TextToot(settings, c, LOREM * repeat)
+        chars = len(toot.clean_content)
+
+        new = best_of(lambda: toot.split_toot(280))
+        old = best_of(lambda: reference_split(toot, 280))
+
+        print(f"{chars:>8} {new * 1000:>10.2f}ms {new * 1000000 / chars:>12.1f}µs {old * 1000:>10.2f}ms")
+
+
+def reference_clean_content(toot):
+    """ The HTML conversion clean_content used to do, one pass per step """
+    media_regexp = re.compile(re.escape(toot.instance_url) + r"/media/[\w-]+\s?")
+
+    content = re.sub(r'<a [^>]*href="([^"]+)">[^<]*</a>', r'\g<1>', toot.raw_content)
+    content = "\n".join(re.compile(r'<br ?/?>', re.IGNORECASE).split(content))
+    content = "\n\n".join(re.compile(r'</p><p>', re.IGNORECASE).split(content))
+    content = html.unescape(str(re.compile(r'<.*?>').sub("", content).strip()))
+    content = re.sub(media_regexp, "", content)
+
+    for mention in toot.mentions:
+        content = re.sub(f'@({mention[0]})(?!@)', f"{mention[1]}", content)
+
+    return content
+
+
+def bench_clean_content():
+    """ The HTML to text conversion in Toot.clean_content for each of the sample toots """
+    settings = TSettings()
+    c = config()
+    toots = [Toot(settings, sample, c) for sample in SAMPLES]
+    number = 200
+
+    def convert_all():
+        for toot in toots:
+            html_to_text(toot.raw_content, toot.instance_url, toot.mentions)
+
+    def reference_all():
+        for toot in toots:
+            reference_clean_content(toot)
+
+    new = best_of(lambda: [convert_all() for _ in range(number)]) / number / len(toots)
+    old = best_of(lambda: [reference_all() for _ in range(number)]) / number / len(toots)
+
+    print(f"html_to_text: {new * 1000000:.1f}µs per toot, original: {old * 1000000:.1f}µs")
+
+
+def bench_sanitize():
+    """ Toot.sanitize_twitter_handles on toots with more and more mentions """
+    toot = Toot(TSettings(), SAMPLES[0], config())
+
+    print(f"{'mentions':>8} {'sanitize':>12} {'original':>12}")
+
+    for repeat in [5, 20, 80, 320]:
+        text = "@bot@pdx.social thread for @someone and @other https://pdx.social/@moa " * repeat
+
+        def sanitize():
+            toot.content = text
+            toot.sanitize_twitter_handles()
+
+        new = best_of(sanitize)
+        old = best_of(lambda: reference_sanitize(text))
+
+        print(f"{repeat * 4:>8} {new * 1000:>10.2f}ms {old * 1000:>10.2f}ms")
+
+
+ENTRY_POINTS = ['app.py', 'moa/worker.py', 'moa/cleanup.py', 'moa/rollup.py', 'moa/balance.py',
+                'moa/update_metadata.py', 'moa/stats_poster.py']
+
+TIME_IMPORTS = """
+import json, sys, time
+
+times = []
+
+for statement in json.loads(sys.argv[1]):
+    start = time.perf_counter()
+
+    try:
+        exec(statement)
+    except ImportError as e:
+        times.append((statement, None, str(e)))
+    else:
+        times.append((statement, time.perf_counter() - start, None))
+
+print(json.dumps(times))
+"""
+
+
+def top_level_imports(path):
+    """ The import statements a script runs at startup, without running the rest of it """
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+
+    statements = []
+
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            statements.append('import ' + ', '.join(a.name for a in node.names))
+
+        elif isinstance(node, ast.ImportFrom):
+            names = ', '.join(a.name for a in node.names)
+            statements.append(f"from {'.' * node.level}{node.module or ''} import {names}")
+
+    return statements
+
+
+def time_imports(statements):
+    """ How long each statement takes in a fresh interpreter """
+    output = subprocess.run([sys.executable, '-c', TIME_IMPORTS, json.dumps(statements)],
+                            stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+
+    return json.loads(output)
+
+
+def bench_imports():
+    """ The startup cost of the modules each entry point imports, and its slowest import """
+    print(f"{'entry point':<24} {'imports':>10}  slowest")
+
+    for path in ENTRY_POINTS:
+        runs = [time_imports(top_level_imports(path)) for _ in range(3)]
+        best = [min(run[i][1] or 0 for run in runs) for i in range(len(runs[0]))]
+        slowest = max(range(len(best)), key=best.__getitem__)
+        missing = [error for _, t, error in runs[0] if t is None]
+
+        print(f"{path:<24} {sum(best) * 1000:>8.1f}ms  {runs[0][slowest][0]} ({best[slowest] * 1000:.1f}ms)")
+
+        for error in missing:
+            print(f"{'':<24} not installed: {error}")
+
+
+BENCHMARKS = {
+    'split_toot': bench_split_toot,
+    'clean_content': bench_clean_content,
+    'sanitize': bench_sanitize,
+    'imports': bench_imports,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Moa benchmarks')
+    parser.add_argument('names', nargs='*', help=f"Benchmarks to run, out of {', '.join(BENCHMARKS)}. All by default.")
+    args = parser.parse_args()
+
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+
+    for name in args.names or BENCHMARKS:
+        print(f"-- {name}")
+        BENCHMARKS[name]()
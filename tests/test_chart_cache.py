@@ -0,0 +1,94 @@
+import tempfile
+import unittest
+from unittest import mock
+
+from flask import Flask, Response, request
+
+from moa.chart_cache import CacheEntry, ChartCache, FileBackend, MemoryBackend
+
+
+class ChartCacheTestCase(unittest.TestCase):
+    backend = None
+
+    def setUp(self):
+        self.renders = 0
+        self.cache = ChartCache(self.make_backend(), ttl=60)
+        app = Flask(__name__)
+
+        @app.route('/stats/counts.svg')
+        @self.cache.cached
+        def count_graph():
+            self.renders += 1
+            return Response(f"<svg>{request.args.get('hours', 24)} {self.renders}</svg>", mimetype='image/svg+xml')
+
+        self.client = app.test_client()
+
+    def make_backend(self):
+        return MemoryBackend(1024)
+
+    def test_charts_are_rendered_once(self):
+        first = self.client.get('/stats/counts.svg?hours=24')
+        second = self.client.get('/stats/counts.svg')
+
+        self.assertEqual(self.renders, 1)
+        self.assertEqual(first.data, b"<svg>24 1</svg>")
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.mimetype, 'image/svg+xml')
+        self.assertEqual(second.headers['Cache-Control'], 'public, max-age=60')
+
+        self.client.get('/stats/counts.svg?hours=168')
+        self.assertEqual(self.renders, 2)
+
+    def test_etag(self):
+        etag = self.client.get('/stats/counts.svg').headers['ETag']
+        response = self.client.get('/stats/counts.svg', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(self.renders, 1)
+
+    def test_expired_charts_are_rendered_again(self):
+        with mock.patch('moa.chart_cache.time.time', return_value=1000):
+            etag = self.client.get('/stats/counts.svg').headers['ETag']
+
+        with mock.patch('moa.chart_cache.time.time', return_value=1061):
+            response = self.client.get('/stats/counts.svg', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.renders, 2)
+
+
+class TestFileChartCache(ChartCacheTestCase):
+
+    def make_backend(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        return FileBackend(self.directory.name, 1024)
+
+
+class TestBackendSizes(unittest.TestCase):
+
+    def entry(self, size):
+        return CacheEntry(0, 'etag', 'image/svg+xml', b"x" * size)
+
+    def test_memory_backend_drops_least_recently_used(self):
+        backend = MemoryBackend(250)
+        backend.set('a', self.entry(100))
+        backend.set('b', self.entry(100))
+        backend.get('a')
+        backend.set('c', self.entry(100))
+
+        self.assertIsNotNone(backend.get('a'))
+        self.assertIsNone(backend.get('b'))
+        self.assertIsNotNone(backend.get('c'))
+
+    def test_file_backend_stays_under_its_size(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = FileBackend(directory, 500)
+
+            for key in 'abcdefgh':
+                backend.set(key, self.entry(100))
+
+            self.assertIsNotNone(backend.get('h'))
+            self.assertLessEqual(sum(1 for key in 'abcdefgh' if backend.get(key)), 4)
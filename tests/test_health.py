@@ -0,0 +1,77 @@
+import threading
+import unittest
+
+from moa.health import HealthMonitor
+
+
+class TestHealthMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.up = True
+        self.checks = 0
+        self.checked = threading.Event()
+
+    def check(self):
+        self.checks += 1
+        self.checked.set()
+
+        if not self.up:
+            raise ConnectionError("database is down")
+
+    def monitor(self, interval=60):
+        monitor = HealthMonitor(self.check, interval)
+        self.addCleanup(monitor.stop)
+
+        return monitor
+
+    def test_healthy_is_cached(self):
+        monitor = self.monitor()
+
+        self.assertTrue(monitor.healthy)
+        self.up = False
+
+        for _ in range(10):
+            self.assertTrue(monitor.healthy)
+
+        self.assertEqual(self.checks, 1)
+
+    def test_first_check_runs_before_answering(self):
+        self.up = False
+        monitor = self.monitor()
+
+        self.assertFalse(monitor.healthy)
+        self.assertIsNotNone(monitor.last_checked)
+
+    def test_check_now(self):
+        monitor = self.monitor()
+        self.assertTrue(monitor.healthy)
+
+        self.up = False
+        self.assertFalse(monitor.check_now())
+        self.assertFalse(monitor.healthy)
+
+        self.up = True
+        self.assertTrue(monitor.check_now())
+        self.assertTrue(monitor.healthy)
+
+    def test_failed_lasts_until_the_next_check(self):
+        monitor = self.monitor()
+        self.assertTrue(monitor.healthy)
+
+        monitor.failed()
+        self.assertFalse(monitor.healthy)
+
+        monitor.check_now()
+        self.assertTrue(monitor.healthy)
+
+    def test_checks_in_the_background(self):
+        monitor = self.monitor(interval=0.01)
+        self.assertTrue(monitor.healthy)
+
+        self.up = False
+        self.checked.clear()
+        self.assertTrue(self.checked.wait(5))
+        self.checked.clear()
+        self.assertTrue(self.checked.wait(5))
+
+        self.assertFalse(monitor.healthy)
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+import unittest
+
+# Loaded by the worker or the web app only when they are needed
+HEAVY = ['flask', 'flask_mail', 'twitter', 'mastodon', 'pygal', 'pandas', 'instagram']
+
+
+class TestImports(unittest.TestCase):
+
+    def loaded(self, module):
+        code = f"import sys, {module}; print(' '.join(sys.modules))"
+        output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True,
+                                universal_newlines=True).stdout
+
+        return set(output.split())
+
+    def test_script_modules_stay_light(self):
+        for module in ['moa.helpers', 'moa.models', 'moa.stats', 'moa.scheduler']:
+            with self.subTest(module=module):
+                self.assertFalse(self.loaded(module) & set(HEAVY))
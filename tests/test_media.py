@@ -0,0 +1,164 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from moa.helpers import MoaMediaUploadException
+from moa.media import MediaCache, download
+
+BODY = os.urandom(200 * 1024)
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    # paths under /flaky/ that have already failed once
+    failed = set()
+
+    def do_GET(self):
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+
+        if self.path.startswith('/flaky/') and self.path not in self.failed:
+            self.failed.add(self.path)
+            self.send_error(500)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+
+        if self.path != '/unknown-length':
+            self.send_header('Content-Length', str(len(BODY)))
+
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class MediaServerTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), MediaHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+class TestDownload(MediaServerTestCase):
+
+    def test_download(self):
+        file_name, response = download(f"{self.url}/image.png", len(BODY))
+
+        try:
+            with open(file_name, 'rb') as f:
+                self.assertEqual(f.read(), BODY)
+
+            self.assertEqual(response.headers['Content-Type'], 'image/png')
+        finally:
+            os.unlink(file_name)
+
+    def test_too_big(self):
+        with self.assertRaises(MoaMediaUploadException):
+            download(f"{self.url}/image.png", len(BODY) - 1)
+
+    def test_too_big_without_content_length(self):
+        with self.assertRaises(MoaMediaUploadException):
+            download(f"{self.url}/unknown-length", 1000)
+
+    def test_error_status(self):
+        with self.assertRaisesRegex(MoaMediaUploadException, '404'):
+            download(f"{self.url}/missing", 1000)
+
+    def test_connection_error(self):
+        with self.assertRaises(MoaMediaUploadException):
+            download("http://127.0.0.1:1/image.png", 1000)
+
+
+class TestMediaCache(MediaServerTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = MediaCache(self.directory, max_size=len(BODY) * 2, ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fetch(self, path):
+        file_name, content_type = self.cache.fetch(f"{self.url}{path}", len(BODY))
+
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), BODY)
+
+        self.assertEqual(content_type, 'image/png')
+
+        # callers own their copy
+        os.unlink(file_name)
+
+    def test_second_fetch_is_a_hit(self):
+        self.fetch('/a.png')
+        self.fetch('/a.png')
+
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_same_content_is_stored_once(self):
+        self.fetch('/a.png')
+        self.fetch('/b.png')
+
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, 'files'))), 1)
+
+    def test_expired_entries_are_fetched_again(self):
+        self.fetch('/a.png')
+        self.cache.ttl = -1
+        self.fetch('/a.png')
+
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_expired_entries_are_dropped_on_lookup(self):
+        self.fetch('/a.png')
+        self.cache.ttl = -1
+
+        self.assertIsNone(self.cache._lookup(f"{self.url}/a.png"))
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'urls')), [])
+
+    def test_expired_files_are_evicted_when_the_cache_fits(self):
+        self.fetch('/a.png')
+        self.cache.evict(now=time.time() + 120)
+
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'urls')), [])
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'files')), [])
+
+    def test_recently_used_files_are_kept(self):
+        self.fetch('/a.png')
+        files = os.path.join(self.directory, 'files')
+        used = time.time() + 40
+        os.utime(os.path.join(files, os.listdir(files)[0]), (used, used))
+        self.cache.evict(now=time.time() + 80)
+
+        self.assertEqual(len(os.listdir(files)), 1)
+
+    def test_errors_are_not_cached(self):
+        with self.assertRaises(MoaMediaUploadException):
+            self.cache.fetch(f"{self.url}/flaky/a.png", len(BODY))
+
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'files')), [])
+
+        self.fetch('/flaky/a.png')
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_least_recently_used_files_are_evicted(self):
+        self.fetch('/a.png')
+        self.cache.max_size = 0
+        self.cache.evict()
+
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'files')), [])
+        self.fetch('/a.png')
+        self.assertEqual(self.cache.misses, 2)
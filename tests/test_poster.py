@@ -0,0 +1,204 @@
+import itertools
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from moa.helpers import MoaMediaUploadException
+from moa.models import Base, Bridge, Mapping, MediaUpload, TSettings
+from moa.poster import Poster
+from moa.tweet_poster import TweetPoster
+
+
+class FakePost:
+
+    def __init__(self, urls):
+        self.media_attachments = [{'url': url} for url in urls]
+
+
+class FakePoster(Poster):
+    """ Attachments named slow-* take a while, empty-* are skipped and ones with fail in their name fail to upload """
+
+    def __init__(self, session=None):
+        super().__init__(True, session)
+        self.uploaded = []
+        self.lock = threading.Lock()
+
+    def download_attachment(self, attachment):
+        url = attachment['url']
+
+        if url.startswith('slow'):
+            time.sleep(0.2)
+
+        if url.startswith('empty'):
+            return None
+
+        fd, file_name = tempfile.mkstemp()
+        os.close(fd)
+
+        return file_name
+
+    def upload_attachment(self, attachment, file_name):
+        url = attachment['url']
+
+        if 'fail' in url:
+            raise MoaMediaUploadException(url)
+
+        with self.lock:
+            self.uploaded.append(url)
+
+        return f"id-{url}"
+
+
+class TestMediaTransfer(unittest.TestCase):
+
+    def test_media_ids_keep_attachment_order(self):
+        poster = FakePoster()
+        poster.transfer_attachments(FakePost(['slow-1', '2', 'empty-3', '4']))
+
+        self.assertEqual(poster.media_ids, ['id-slow-1', 'id-2', 'id-4'])
+        # the fast ones didn't wait for the slow one
+        self.assertEqual(poster.uploaded[-1], 'slow-1')
+
+    def test_failure_cancels_the_other_transfers(self):
+        poster = FakePoster()
+
+        with self.assertRaises(MoaMediaUploadException):
+            poster.transfer_attachments(FakePost(['slow-1', 'fail-2', 'slow-3']))
+
+        self.assertEqual(poster.uploaded, [])
+        self.assertEqual(poster.media_ids, [])
+
+    def test_no_attachments(self):
+        poster = FakePoster()
+
+        self.assertTrue(poster.transfer_attachments(FakePost([])))
+        self.assertEqual(poster.media_ids, [])
+
+
+class UploadRecordingPoster(FakePoster):
+    media_target = 'twitter'
+    media_id_type = int
+
+    def __init__(self, session, bridge, ids):
+        super().__init__(session)
+        self.bridge = bridge
+        self.ids = ids
+
+    def upload_attachment(self, attachment, file_name):
+        super().upload_attachment(attachment, file_name)
+
+        # every upload gets a new id, like it would from Twitter
+        return next(self.ids)
+
+
+class TestUploadReuse(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+
+        self.session = Session(engine)
+        self.bridge = Bridge(enabled=True)
+        self.session.add(self.bridge)
+        self.session.commit()
+
+    def test_retry_reuses_uploads(self):
+        ids = itertools.count(100)
+        poster = UploadRecordingPoster(self.session, self.bridge, ids)
+
+        with self.assertRaises(MoaMediaUploadException):
+            poster.transfer_attachments(FakePost(['1', 'slow-fail-2']))
+
+        self.assertEqual(poster.uploaded, ['1'])
+        self.session.commit()
+
+        # the second attempt only uploads what's missing
+        poster = UploadRecordingPoster(self.session, self.bridge, ids)
+        poster.transfer_attachments(FakePost(['1', 'slow-2']))
+
+        self.assertEqual(poster.uploaded, ['slow-2'])
+        # the first attachment keeps the id from the failed attempt
+        self.assertEqual(poster.media_ids, [100, 101])
+
+        poster.forget_uploads()
+        self.session.commit()
+
+        self.assertEqual(self.session.query(MediaUpload).count(), 0)
+
+
+class ThreadToot:
+    """ A toot split over several tweets """
+    type = 'Toot'
+    should_skip = False
+    is_sensitive = False
+    is_self_reply = False
+    media_attachments = []
+
+    def __init__(self, id, parts):
+        self.id = id
+        self.message_parts = parts
+
+    def prepare_for_post(self, length):
+        pass
+
+
+class FlakyTwitter:
+    """ Tweets get ids from 100 up until it has posted `fail_after` of them """
+
+    def __init__(self, fail_after):
+        self.fail_after = fail_after
+        self.posted = 0
+
+    def PostUpdate(self, status, **kwargs):
+        if self.posted == self.fail_after:
+            raise ConnectionError("Twitter went away")
+
+        self.posted += 1
+
+        return type('Status', (), {'id': 99 + self.posted})
+
+
+class TestMappingCommits(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+
+        self.session = Session(self.engine)
+        self.bridge = Bridge(enabled=True, t_settings=TSettings())
+        self.session.add(self.bridge)
+        self.session.commit()
+
+    def test_mappings_are_committed_with_last_id(self):
+        poster = TweetPoster(True, self.session, FlakyTwitter(fail_after=2), self.bridge)
+
+        with self.assertRaises(ConnectionError):
+            poster.post(ThreadToot(1, ['one', 'two', 'three']))
+
+        # what a crashed worker leaves behind
+        self.session.rollback()
+        committed = Session(self.engine)
+
+        self.assertEqual(committed.query(Bridge.twitter_last_id).scalar(), 101)
+        self.assertEqual(sorted(t for t, in committed.query(Mapping.twitter_id).filter_by(mastodon_id=1)), [100, 101])
+
+    def test_each_part_is_inserted_as_it_is_posted(self):
+        inserts = []
+
+        def count_insert(conn, cursor, statement, *args):
+            if statement.startswith('INSERT INTO mapping'):
+                inserts.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', count_insert)
+        self.addCleanup(event.remove, self.engine, 'before_cursor_execute', count_insert)
+
+        poster = TweetPoster(True, self.session, FlakyTwitter(fail_after=10), self.bridge)
+        self.assertTrue(poster.post(ThreadToot(1, ['one', 'two', 'three'])))
+
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(self.session.query(Mapping).count(), 3)
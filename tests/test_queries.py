@@ -0,0 +1,176 @@
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from moa.mappings import MappingBuffer
+from moa.models import Base, Bridge, BridgeMetadata, Mapping, MastodonHost, TSettings
+from moa.scheduler import claim_bridges, due_bridges, load_bridges, release_bridge, with_related, worker_bridges
+
+
+class TestBridgeQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+
+        session = Session(self.engine)
+        hosts = [MastodonHost(hostname=f"host{i}.social", client_id='id', client_secret='secret') for i in range(2)]
+
+        for i in range(10):
+            bridge = Bridge(enabled=True, mastodon_access_code='code', mastodon_user=f"user{i}")
+            bridge.mastodon_host = hosts[i % 2]
+            bridge.t_settings = TSettings()
+            bridge.md = BridgeMetadata(worker_id=1 + i % 2)
+            session.add(bridge)
+
+        session.commit()
+        session.close()
+
+        self.queries = 0
+        event.listen(self.engine, 'before_cursor_execute', self.count_query)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self.count_query)
+
+    def count_query(self, *args):
+        self.queries += 1
+
+    def touch(self, bridge):
+        # everything the worker reads before it talks to the APIs
+        return (bridge.md.worker_id,
+                bridge.md.last_toot,
+                bridge.t_settings.post_to_twitter_enabled,
+                bridge.mastodon_host.hostname,
+                bridge.mastodon_host.defer_until)
+
+    def test_worker_batch_is_one_query(self):
+        session = Session(self.engine)
+        batch = with_related(due_bridges(worker_bridges(session, 1))).all()
+
+        for bridge in batch:
+            self.touch(bridge)
+
+        self.assertEqual(len(batch), 5)
+        self.assertEqual(self.queries, 1)
+
+    def test_merged_bridges_need_no_queries(self):
+        session = Session(self.engine)
+        batch = load_bridges(session, [1, 2, 3, 4])
+        session.expunge_all()
+
+        self.assertEqual(self.queries, 1)
+
+        thread_session = Session(self.engine)
+
+        for bridge in batch:
+            self.touch(thread_session.merge(bridge, load=False))
+
+        self.assertEqual(self.queries, 1)
+
+    def test_most_overdue_bridges_come_first(self):
+        now = datetime(2020, 5, 1, 12, 0, 0)
+        session = Session(self.engine)
+
+        for bridge in worker_bridges(session, 1):
+            # bridges 1, 3 and 5 are due, 7 and 9 aren't
+            bridge.md.next_poll = now + timedelta(minutes=bridge.id - 6)
+
+        session.query(BridgeMetadata).filter_by(id=3).update({'next_poll': None})
+        session.commit()
+
+        due = [b.id for b in due_bridges(worker_bridges(session, 1), now=now)]
+
+        self.assertEqual(due, [3, 1, 5])
+
+    def test_leases_split_due_bridges_between_workers(self):
+        now = datetime(2020, 5, 1, 12, 0, 0)
+        session = Session(self.engine)
+
+        first = claim_bridges(session, 'a:1', 4, 600, now=now)
+        second = claim_bridges(session, 'b:1', 10, 600, now=now)
+
+        self.assertEqual(first, [1, 2, 3, 4])
+        self.assertEqual(second, [5, 6, 7, 8, 9, 10])
+        self.assertEqual(claim_bridges(session, 'c:1', 10, 600, now=now), [])
+
+    def test_released_and_expired_leases_can_be_claimed(self):
+        now = datetime(2020, 5, 1, 12, 0, 0)
+        session = Session(self.engine)
+
+        claim_bridges(session, 'a:1', 10, 600, now=now)
+        release_bridge(self.engine, 2, 'a:1')
+        # only the owner can release a lease
+        release_bridge(self.engine, 3, 'b:1')
+
+        self.assertEqual(claim_bridges(session, 'b:1', 10, 600, now=now), [2])
+        self.assertEqual(claim_bridges(session, 'c:1', 10, 600, now=now + timedelta(minutes=11)),
+                         list(range(1, 11)))
+
+    def test_failed_bridges_are_not_claimed_straight_back(self):
+        now = datetime(2020, 5, 1, 12, 0, 0)
+        retry_at = now + timedelta(minutes=5)
+        session = Session(self.engine)
+
+        claim_bridges(session, 'a:1', 2, 600, now=now)
+        # 1 died before it was rescheduled, 2 was rescheduled for later than the retry
+        session.query(BridgeMetadata).filter_by(id=2).update({'next_poll': now + timedelta(minutes=30)})
+        session.commit()
+
+        release_bridge(self.engine, 1, 'a:1', retry_at, now=now)
+        release_bridge(self.engine, 2, 'a:1', retry_at, now=now)
+
+        self.assertEqual(claim_bridges(session, 'b:1', 10, 600, now=now), list(range(3, 11)))
+        self.assertEqual(session.query(BridgeMetadata.next_poll).filter_by(id=1).scalar(), retry_at)
+        self.assertEqual(session.query(BridgeMetadata.next_poll).filter_by(id=2).scalar(), now + timedelta(minutes=30))
+
+
+class TestMappings(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+
+        self.queries = 0
+        event.listen(self.engine, 'before_cursor_execute', self.count_query)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self.count_query)
+
+    def count_query(self, *args):
+        self.queries += 1
+
+    def test_flush_writes_pending_mappings_in_one_insert(self):
+        session = Session(self.engine)
+        mappings = MappingBuffer(session)
+
+        # a toot split over three tweets and a reply to it
+        for twitter_id in [11, 12, 13]:
+            mappings.add(1, twitter_id)
+
+        self.assertEqual(mappings.twitter_id(1), 13)
+        mappings.add(2, 14)
+        self.assertEqual(self.queries, 0)
+
+        mappings.flush()
+        session.commit()
+
+        self.assertEqual(self.queries, 1)
+        self.assertEqual(session.query(Mapping).count(), 4)
+
+    def test_lookups_are_remembered(self):
+        session = Session(self.engine)
+        session.add_all([Mapping(mastodon_id=1, twitter_id=11, created=datetime(2020, 1, 1)),
+                         Mapping(mastodon_id=1, twitter_id=12, created=datetime(2020, 1, 1, 0, 1))])
+        session.commit()
+        self.queries = 0
+
+        mappings = MappingBuffer(session)
+
+        for _ in range(3):
+            self.assertEqual(mappings.twitter_id(1), 12)
+            self.assertEqual(mappings.mastodon_id(11), 1)
+            self.assertIsNone(mappings.twitter_id(2))
+
+        self.assertEqual(self.queries, 3)
@@ -0,0 +1,112 @@
+import unittest
+
+from datetime import datetime, timedelta, timezone
+
+from moa.models import BridgeMetadata
+from moa.scheduler import BridgeScheduler, bridge_cost, pack_bridges, record_time, schedule_next_poll
+
+
+class TestBridgeScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = BridgeScheduler(interval=60)
+        self.scheduler.refresh(dict.fromkeys([1, 2, 3]), now=1000)
+
+    def test_new_bridges_are_due_immediately(self):
+        self.assertEqual(sorted(self.scheduler.pop_due(now=1000)), [1, 2, 3])
+        self.assertEqual(self.scheduler.pop_due(now=1000), [])
+
+    def test_reschedule(self):
+        self.scheduler.pop_due(now=1000)
+        self.scheduler.reschedule(2, now=1010)
+
+        self.assertEqual(self.scheduler.next_due(), 1070)
+        self.assertEqual(self.scheduler.pop_due(now=1069), [])
+        self.assertEqual(self.scheduler.pop_due(now=1070), [2])
+
+    def test_running_bridge_is_not_handed_out_twice(self):
+        self.scheduler.pop_due(now=1000)
+        self.scheduler.refresh(dict.fromkeys([1, 2, 3]), now=1000)
+
+        self.assertEqual(self.scheduler.pop_due(now=1000), [])
+        self.assertEqual(len(self.scheduler), 3)
+
+    def test_removed_bridges_are_forgotten(self):
+        self.scheduler.pop_due(now=1000)
+        self.scheduler.reschedule(1, now=1000)
+        self.scheduler.refresh({2: None, 4: None}, now=1000)
+        self.scheduler.reschedule(3, now=1000)
+
+        self.assertEqual(self.scheduler.pop_due(now=5000), [4])
+        self.assertEqual(len(self.scheduler), 2)
+
+    def test_refresh_uses_stored_due_time(self):
+        self.scheduler.refresh({1: None, 2: None, 3: None, 4: 2000}, now=1000)
+
+        self.assertEqual(sorted(self.scheduler.pop_due(now=1000)), [1, 2, 3])
+        self.assertEqual(self.scheduler.pop_due(now=2000), [4])
+
+
+class PollConfig:
+    POLL_INTERVAL_MIN = 60
+    POLL_INTERVAL_MAX = 30 * 60
+    POLL_RETRY_INTERVAL = 5 * 60
+
+
+class TestAdaptivePolling(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime(2020, 5, 1, 12, 0, 0)
+
+    def next_poll_in(self, last_toot=None, last_tweet=None, failed=False):
+        md = BridgeMetadata(last_toot=last_toot, last_tweet=last_tweet)
+        return (schedule_next_poll(md, PollConfig, now=self.now, failed=failed) - self.now).total_seconds()
+
+    def test_active_account_is_polled_quickly(self):
+        self.assertEqual(self.next_poll_in(last_toot=self.now - timedelta(minutes=2)), 60)
+
+    def test_idle_account_backs_off(self):
+        self.assertEqual(self.next_poll_in(last_tweet=self.now - timedelta(hours=1)), 360)
+        self.assertEqual(self.next_poll_in(last_tweet=self.now - timedelta(days=30)), 30 * 60)
+        self.assertEqual(self.next_poll_in(), 30 * 60)
+
+    def test_most_recent_activity_wins(self):
+        # aware datetimes from the APIs are compared in UTC
+        last_toot = (self.now - timedelta(minutes=1)).replace(tzinfo=timezone.utc)
+
+        self.assertEqual(self.next_poll_in(last_toot=last_toot, last_tweet=self.now - timedelta(days=2)), 60)
+
+    def test_failed_polls_back_off(self):
+        self.assertEqual(self.next_poll_in(last_toot=self.now - timedelta(minutes=2), failed=True), 5 * 60)
+        # but never come around sooner than they would have anyway
+        self.assertEqual(self.next_poll_in(failed=True), 30 * 60)
+
+
+class TestBalancing(unittest.TestCase):
+
+    def test_heavy_bridges_are_spread_out(self):
+        costs = {1: 10, 2: 10, 3: 4, 4: 3, 5: 3, 6: 2, 7: 2, 8: 2}
+        assignment, loads = pack_bridges(costs, 3)
+
+        self.assertNotEqual(assignment[1], assignment[2])
+        self.assertEqual(sorted(loads.values()), [12, 12, 12])
+        self.assertEqual(sum(loads.values()), sum(costs.values()))
+
+    def test_more_workers_than_bridges(self):
+        assignment, loads = pack_bridges({1: 5}, 3)
+
+        self.assertEqual(assignment, {1: 1})
+        self.assertEqual(loads, {1: 5, 2: 0, 3: 0})
+
+    def test_cost_is_run_time_times_poll_rate(self):
+        now = datetime(2020, 5, 1, 12, 0, 0)
+        md = BridgeMetadata(last_toot=now - timedelta(minutes=2))
+
+        # never timed, polled every minute
+        self.assertEqual(bridge_cost(md, PollConfig, 2, now=now), 120)
+
+        record_time(md, 4)
+        record_time(md, 9)
+
+        self.assertEqual(md.avg_time, 5)
+        self.assertEqual(bridge_cost(md, PollConfig, 2, now=now), 300)
@@ -0,0 +1,224 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import Session
+
+from moa.models import Base, Bridge, BridgeStat, StatRollup, UserRollup, WorkerStat
+from moa.stats import StatsAggregator, add_to_row, average_time, hourly_message_counts, rollup_users, rollup_worker_stats, \
+    worker_series
+
+
+class TestStatsAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.session = Session(self.engine)
+
+    def test_counts_go_into_hourly_rows(self):
+        stats = StatsAggregator(worker=2)
+        first = datetime(2020, 6, 1, 10, 5)
+        later = datetime(2020, 6, 1, 10, 55)
+        next_hour = datetime(2020, 6, 1, 11, 1)
+
+        for bridge_id in [1, 1, 2]:
+            stats.add(bridge_id, toots=1, now=first)
+
+        stats.add(1, tweets=2, now=later)
+        stats.add_time(30, runs=1, now=later)
+
+        self.assertEqual(stats.items, 5)
+        stats.flush(self.session)
+
+        # adds to the rows written by the last flush
+        stats.add(1, toots=1, now=later)
+        stats.add(2, instas=1, now=next_hour)
+        stats.add_time(10, runs=1, now=next_hour)
+        stats.flush(self.session)
+
+        workers = self.session.query(WorkerStat).order_by(WorkerStat.created).all()
+        self.assertEqual([(w.worker, w.created.hour, w.toots, w.tweets, w.instas, w.time, w.runs) for w in workers],
+                         [(2, 10, 4, 2, 0, 30, 1), (2, 11, 0, 0, 1, 10, 1)])
+        self.assertEqual([w.avg for w in workers], [5, 10])
+
+        bridges = self.session.query(BridgeStat).order_by(BridgeStat.created, BridgeStat.bridge_id).all()
+        self.assertEqual([(b.bridge_id, b.created.hour, b.toots, b.tweets, b.instas) for b in bridges],
+                         [(1, 10, 3, 2, 0), (2, 10, 1, 0, 0), (2, 11, 0, 0, 1)])
+
+    def test_flush_without_counts_writes_nothing(self):
+        stats = StatsAggregator(worker=1)
+        stats.flush(self.session)
+
+        self.assertEqual(self.session.query(WorkerStat).count(), 0)
+        self.assertEqual(stats.items, 0)
+
+    def test_insert_race_adds_to_the_other_row(self):
+        table = WorkerStat.__table__
+        hour = datetime(2020, 6, 1, 10)
+
+        raced = []
+
+        def insert_first(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('INSERT') and not raced:
+                # another worker inserts the same hour between our UPDATE and INSERT
+                raced.append(statement)
+                cursor.execute("INSERT INTO workerstat (worker, created, toots, tweets, instas, time, runs) "
+                               "VALUES (1, ?, 2, 0, 0, 10, 1)", (hour.isoformat(" ", "microseconds"),))
+
+        event.listen(self.engine, 'before_cursor_execute', insert_first)
+        self.addCleanup(event.remove, self.engine, 'before_cursor_execute', insert_first)
+        add_to_row(self.session, table, {'worker': 1, 'created': hour}, {'toots': 2, 'time': 20, 'runs': 1},
+                   computed={'avg': average_time})
+
+        rows = self.session.query(WorkerStat).all()
+        self.assertEqual(len(raced), 1)
+        self.assertEqual([(w.toots, w.time, w.runs, w.avg) for w in rows], [(4, 30, 2, 7.5)])
+
+    def test_mysql_upserts(self):
+        session = mock.Mock()
+        session.bind.dialect.name = 'mysql'
+
+        add_to_row(session, WorkerStat.__table__, {'worker': 1, 'created': datetime(2020, 6, 1, 10)},
+                   {'toots': 2, 'time': 20}, computed={'avg': average_time})
+
+        statement, = session.execute.call_args[0]
+        sql = str(statement.compile(dialect=mysql.dialect()))
+
+        self.assertEqual(session.execute.call_count, 1)
+        self.assertIn('ON DUPLICATE KEY UPDATE avg = ', sql)
+        # MySQL assigns left to right so avg has to be worked out from the old values
+        self.assertLess(sql.index('avg = '), sql.index('toots = '))
+
+
+class TestHourlyMessageCounts(unittest.TestCase):
+    """ The counts moa.stats_poster posts, which it used to work out with pandas """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = Session(engine)
+
+        # rows from before the stats were hourly, hourly rows, and rows outside the graph
+        for worker, created, toots, tweets, instas in [(1, datetime(2020, 5, 31, 23), 9, 9, 9),
+                                                       (1, datetime(2020, 6, 1, 1, 15), 1, 0, 0),
+                                                       (2, datetime(2020, 6, 1, 1, 45), 2, 1, 0),
+                                                       (1, datetime(2020, 6, 1, 2), 3, 2, 1),
+                                                       (2, datetime(2020, 6, 1, 2), 1, 0, 0),
+                                                       (1, datetime(2020, 6, 1, 4), 0, 5, 0),
+                                                       (1, datetime(2020, 6, 1, 6), 9, 9, 9)]:
+            stat = WorkerStat(worker)
+            stat.created, stat.toots, stat.tweets, stat.instas = created, toots, tweets, instas
+            self.session.add(stat)
+
+        self.session.commit()
+
+        self.since = datetime(2020, 6, 1, 0, 30)
+        self.until = datetime(2020, 6, 1, 5, 10)
+
+    def test_every_hour_is_counted(self):
+        self.assertEqual(hourly_message_counts(self.session, self.since, self.until),
+                         [(0, 0, 0), (3, 1, 0), (4, 2, 1), (0, 0, 0), (0, 5, 0), (0, 0, 0)])
+
+    def test_same_as_pandas(self):
+        try:
+            import pandas as pd
+        except ImportError:
+            self.skipTest("pandas isn't installed")
+
+        # what stats_poster did before
+        stats_query = self.session.query(WorkerStat) \
+            .filter(WorkerStat.created > self.since, WorkerStat.created <= self.until) \
+            .with_entities(WorkerStat.created, WorkerStat.toots, WorkerStat.tweets, WorkerStat.instas)
+        df = pd.read_sql(stats_query.statement, stats_query.session.bind)
+        df.set_index(['created'], inplace=True)
+        r = df.resample('h').sum().fillna(0)
+        expected = list(zip(r['toots'].tolist(), r['tweets'].tolist(), r['instas'].tolist()))
+
+        counts = hourly_message_counts(self.session, self.since, self.until)
+        # pandas only covers the hours from the first row to the last one
+        self.assertEqual(counts[1:5], expected)
+        self.assertEqual(sum(map(sum, counts)), df.to_numpy().sum())
+
+
+class TestRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.session = Session(self.engine)
+
+    def add_stat(self, created, worker=1, toots=1, time=10.0, runs=1):
+        stat = WorkerStat(worker=worker)
+        stat.created, stat.toots, stat.time, stat.runs = created, toots, time, runs
+        self.session.add(stat)
+        self.session.commit()
+
+    def rollups(self, period):
+        rows = self.session.query(StatRollup).filter_by(period=period).order_by(StatRollup.start, StatRollup.worker)
+        return [(r.start, r.worker, r.toots, r.time, r.runs) for r in rows]
+
+    def test_rollups_are_incremental(self):
+        # per run rows from before stats were hourly
+        self.add_stat(datetime(2020, 6, 1, 10, 5))
+        self.add_stat(datetime(2020, 6, 1, 10, 10), worker=2, toots=3)
+        self.add_stat(datetime(2020, 6, 1, 10, 15), toots=2, time=20.0)
+
+        rollup_worker_stats(self.session, 'hour')
+        rollup_worker_stats(self.session, 'day')
+
+        self.assertEqual(self.rollups('hour'), [(datetime(2020, 6, 1, 10), 1, 3, 30.0, 2),
+                                                (datetime(2020, 6, 1, 10), 2, 3, 10.0, 1)])
+
+        # more stats for the latest hour and the next one
+        self.add_stat(datetime(2020, 6, 1, 10, 50))
+        self.add_stat(datetime(2020, 6, 1, 11, 0))
+
+        # an old bucket that isn't recomputed any more
+        self.add_stat(datetime(2020, 6, 1, 2, 0))
+
+        rollup_worker_stats(self.session, 'hour')
+        rollup_worker_stats(self.session, 'day')
+
+        self.assertEqual(self.rollups('hour'), [(datetime(2020, 6, 1, 10), 1, 4, 40.0, 3),
+                                                (datetime(2020, 6, 1, 10), 2, 3, 10.0, 1),
+                                                (datetime(2020, 6, 1, 11), 1, 1, 10.0, 1)])
+        self.assertEqual(self.rollups('day'), [(datetime(2020, 6, 1), 1, 6, 60.0, 5),
+                                               (datetime(2020, 6, 1), 2, 3, 10.0, 1)])
+
+    def test_graphs_read_the_right_period(self):
+        now = datetime(2020, 6, 10, 12, 30)
+        self.add_stat(now - timedelta(hours=3))
+        self.add_stat(now - timedelta(days=20))
+
+        rollup_worker_stats(self.session, 'hour')
+        rollup_worker_stats(self.session, 'day')
+
+        starts, rows = worker_series(self.session, 24, now=now)
+        self.assertEqual(len(starts), 25)
+        self.assertEqual([r.start for r in rows], [datetime(2020, 6, 10, 9)])
+
+        starts, rows = worker_series(self.session, 24 * 30, now=now)
+        self.assertEqual(len(starts), 31)
+        self.assertEqual(sorted(r.start for r in rows), [datetime(2020, 5, 21), datetime(2020, 6, 10)])
+
+    def test_users_by_day(self):
+        for day, enabled in [(1, True), (1, True), (2, False), (3, True)]:
+            self.session.add(Bridge(enabled=enabled, created=datetime(2020, 6, day, 12)))
+
+        self.session.commit()
+        rollup_users(self.session)
+
+        rows = self.session.query(UserRollup).order_by(UserRollup.start)
+        self.assertEqual([(r.start.day, r.users) for r in rows], [(1, 2), (3, 1)])
+
+        # disabled long after it was created
+        self.session.query(Bridge).filter_by(id=1).update({'enabled': False})
+        self.session.add(Bridge(enabled=True, created=datetime(2020, 6, 30, 12)))
+        self.session.commit()
+        rollup_users(self.session)
+
+        rows = self.session.query(UserRollup).order_by(UserRollup.start)
+        self.assertEqual([(r.start.day, r.users) for r in rows], [(1, 1), (3, 1), (30, 1)])
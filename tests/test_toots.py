@@ -1,13 +1,21 @@
 import importlib
 import logging
 import os
+import random
+import re
 import unittest
+from unittest import mock
+from urllib.parse import urlparse
 
 from moa.toot import Toot
 from moa.tweet_poster import TWEET_LENGTH
 from moa.models import TSettings
 from tests.toot_samples import *
 
+SAMPLES = [boost, boost_w_attachments, twitter_mention, image_with_description, toot_with_mention,
+           toot_double_mention, toot_with_cw, toot_with_many_urls, toot_with_bogus_url, toot_incorrectly_truncated,
+           sanitize_test, long_toot, long_toot_with_link, long_toot_with_two_links]
+
 """
 To add a toot to the sample list stop worker in the debug and copy the value of toot.data
 """
@@ -134,3 +142,141 @@ And on the other end I just had to make sure to turn on IPv6 delegation on the L
         toot.split_toot(TWEET_LENGTH)
 
         self.assertEqual(toot.message_parts[0], part_1)
+
+    def test_clean_content_html(self):
+        data = dict(toot_with_mention)
+        data['content'] = ('<p>Hi <span class="h-card"><a href="https://pdx.social/@foozmeat" class="u-url mention">'
+                           '@<span>foozmeat</span></a></span> and @foozmeatX,<br />see <a href="https://example.com/?a=1&amp;b=2">'
+                           'link</a></p><P>https://pdx.social/media/abc-123 https://mastodon.social/media/xyz &lt;3</p>')
+
+        toot = Toot(self.settings, data, self.c)
+
+        self.assertEqual(toot.clean_content,
+                         # @foozmeatX isn't the mentioned account, it is sanitized like any other Twitter handle
+                         "Hi @foozmeat@pdx.social and foozmeatX,\nsee https://example.com/?a=1&b=2\n\n"
+                         "https://mastodon.social/media/xyz <3")
+
+    def test_properties_are_memoized(self):
+        toot = Toot(self.settings, boost, self.c)
+
+        with mock.patch('moa.toot.urlparse', wraps=urlparse) as parse:
+            for _ in range(3):
+                self.assertEqual(toot.instance_url, 'https://pdx.social')
+                self.assertEqual(toot.boost_author, '@foozmeat@pdx.social')
+
+        # the toot's URL and the boosted author's, once each
+        self.assertEqual(parse.call_count, 2)
+        self.assertFalse(hasattr(toot, '__dict__'))
+
+
+def reference_split(toot, max_length):
+    """ The original word by word splitter that re-measures the whole part for every word """
+    parts = []
+    current_part = ""
+
+    for next_word in toot.clean_content.split(" "):
+
+        possible_part = f"{current_part} {next_word}".lstrip()
+
+        if toot.expected_status_length(possible_part) > max_length - 6:
+            parts.append(f"{current_part} XXXXX".lstrip())
+            current_part = next_word
+        else:
+            current_part = possible_part
+
+    if len(current_part.strip().encode('utf-8')) != 0:
+        parts.append(f"{current_part} XXXXX".lstrip().strip())
+
+    return [msg.replace('XXXXX', f"({i + 1}/{len(parts)})") for i, msg in enumerate(parts)]
+
+
+def reference_sanitize(content):
+    """ The original sanitizer that checks every Twitter handle against every masto handle """
+    content = re.sub(r'@?(\w{1,15})@twitter.com', r'\g<1>', content)
+
+    tm = list(re.finditer(r'@(\w{1,15})', content))
+    mm = list(re.finditer(r'@\w+@[\w.]+', content))
+    mm += list(re.finditer(r'https://[\w.]+/@[\w.]+', content))
+
+    handles = set(tm)
+
+    for m in mm:
+        ms = m.span()
+        handles &= {t for t in tm if (t.span()[-1] < ms[0]) or (ms[-1] < t.span()[0])}
+
+    for h in sorted(handles, key=lambda x: x.span()[0], reverse=True):
+        content = content[:h.span()[0]] + h.group(1) + content[h.span()[1]:]
+
+    return content
+
+
+class TestSanitize(unittest.TestCase):
+
+    def setUp(self):
+        moa_config = os.environ.get('MOA_CONFIG', 'DevelopmentConfig')
+        self.c = getattr(importlib.import_module('config'), moa_config)
+
+    def sanitized(self, text):
+        toot = Toot(TSettings(), long_toot, self.c)
+        toot.content = text
+        toot.sanitize_twitter_handles()
+
+        return toot.content
+
+    def test_mentions_sanitize_like_before(self):
+        rng = random.Random(4321)
+        words = ['word', '@user', '@user@pdx.social', '@moa_party@twitter.com', 'moa@twitter.com',
+                 'https://pdx.social/@user', 'https://pdx.social/@user.name', '@', '@@', 'a@b',
+                 '@averyveryverylonghandle', '.', '\n', '']
+        separators = [' ', '', '\n', ':']
+
+        for n in range(500):
+            text = "".join(rng.choice(words) + rng.choice(separators) for _ in range(rng.randint(1, 40)))
+
+            with self.subTest(text=text):
+                self.assertEqual(self.sanitized(text), reference_sanitize(text))
+
+
+class TextToot(Toot):
+
+    def __init__(self, settings, config, text):
+        super().__init__(settings, long_toot, config)
+        self.text = text
+
+    @property
+    def clean_content(self):
+        return self.text
+
+
+class TestSplitToot(unittest.TestCase):
+
+    def setUp(self):
+        moa_config = os.environ.get('MOA_CONFIG', 'DevelopmentConfig')
+        self.c = getattr(importlib.import_module('config'), moa_config)
+
+        self.settings = TSettings()
+        self.settings.split_twitter_messages = True
+
+    def assertSplitMatches(self, toot, max_length):
+        if toot.expected_status_length(toot.clean_content) <= max_length:
+            return
+
+        toot.split_toot(max_length)
+        self.assertEqual(toot.message_parts, reference_split(toot, max_length))
+
+    def test_samples_split_like_before(self):
+        for sample in SAMPLES:
+            for max_length in range(20, 300, 7):
+                with self.subTest(sample=sample['id'], max_length=max_length):
+                    self.assertSplitMatches(Toot(self.settings, sample, self.c), max_length)
+
+    def test_awkward_text_splits_like_before(self):
+        rng = random.Random(1234)
+        words = ['a', 'word', '', ' ', '\n', '\nline', 'line\n', '\n\n', '🐘', 'émoji🎉',
+                 'https://example.com/some/long/path?x=1&y=2', 'moa.party', 'a.b.c.de/f', '@user@twitter.com']
+
+        for n in range(300):
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(1, 80)))
+
+            with self.subTest(text=text):
+                self.assertSplitMatches(TextToot(self.settings, self.c, text), rng.randint(15, 120))
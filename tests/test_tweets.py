@@ -4,10 +4,11 @@ import os
 import unittest
 import twitter
 import json
+from unittest import mock
 
 from twitter import UserStatus, Status
 
-from moa.tweet import Tweet
+from moa.tweet import Tweet, choose_variant, lookup_statuses
 from moa.models import TSettings
 
 """
@@ -88,3 +89,154 @@ https://twitter.com/EPhilippePM/status/1118472220509126661"""
 
         self.assertEqual(expected_content, tweet.clean_content)
 
+    def test_entities(self):
+        text = "Fish &amp; chips @MOA_Party https://t.co/abc https://t.co/def https://t.co/img"
+        data = {'id': 1, 'full_text': text, 'entities': {
+            'user_mentions': [{'screen_name': 'moa_party', 'indices': [17, 27]}],
+            'urls': [{'url': 'https://t.co/abc', 'expanded_url': 'https://example.com/?a=1&copy=2', 'indices': [28, 44]},
+                     # indices that don't match the text
+                     {'url': 'https://t.co/def', 'expanded_url': 'https://example.org/', 'indices': [0, 16]}]},
+                'extended_entities': {'media': [{'id': 2, 'type': 'photo', 'url': 'https://t.co/img', 'indices': [62, 78]}]}}
+
+        tweet = Tweet(self.settings, Status.NewFromJsonDict(data), self.api)
+
+        self.assertEqual('Fish & chips @moa_party https://example.com/?a=1&copy=2 https://example.org/ ', tweet.clean_content)
+
+    def test_quoted_tweet_links(self):
+        quoted = {'id': 2, 'full_text': 'Big news https://t.co/news', 'user': {'id': 3, 'screen_name': 'newsroom'},
+                  'entities': {'user_mentions': [], 'urls': [{'url': 'https://t.co/news', 'expanded_url': 'https://example.com/news',
+                                         'indices': [9, 26]}]}}
+        data = {'id': 1, 'full_text': 'Read this https://t.co/news https://t.co/quote', 'user': {'id': 4, 'screen_name': 'moa_party'},
+                'is_quote_status': True, 'quoted_status': quoted,
+                'entities': {'user_mentions': [], 'urls': [{'url': 'https://t.co/quote', 'expanded_url': 'https://twitter.com/newsroom/status/2',
+                                       'indices': [28, 46]}]}}
+
+        tweet = Tweet(self.settings, Status.NewFromJsonDict(data), self.api)
+
+        self.assertEqual('Read this https://example.com/news \n---\nRT @newsroom\nBig news https://example.com/news\n'
+                         'https://twitter.com/newsroom/status/2', tweet.clean_content)
+
+
+class TestVideoVariants(unittest.TestCase):
+
+    def video_info(self, duration_millis=None):
+        info = {'variants': [
+            {'content_type': 'application/x-mpegURL', 'url': 'https://video.twimg.com/playlist.m3u8'},
+            {'bitrate': 256000, 'content_type': 'video/mp4', 'url': 'https://video.twimg.com/256.mp4'},
+            {'bitrate': 2176000, 'content_type': 'video/mp4', 'url': 'https://video.twimg.com/2176.mp4'},
+            {'bitrate': 832000, 'content_type': 'video/mp4', 'url': 'https://video.twimg.com/832.mp4'},
+        ]}
+
+        if duration_millis:
+            info['duration_millis'] = duration_millis
+
+        return info
+
+    @mock.patch('moa.tweet.probe_size')
+    def test_short_video_needs_no_probes(self, probe_size):
+        self.assertEqual(choose_variant(self.video_info(10000)), 'https://video.twimg.com/2176.mp4')
+        probe_size.assert_not_called()
+
+    @mock.patch('moa.tweet.probe_size')
+    def test_clearly_too_large_variants_are_skipped(self, probe_size):
+        # over 70 seconds 2176k is ~19MB, 832k is ~7MB which is close enough to the limit to check
+        probe_size.return_value = 9 * 1024 * 1024
+
+        self.assertEqual(choose_variant(self.video_info(70000)), 'https://video.twimg.com/256.mp4')
+        probe_size.assert_called_once_with('https://video.twimg.com/832.mp4')
+
+    @mock.patch('moa.tweet.probe_size')
+    def test_unknown_duration_stops_at_the_first_fit(self, probe_size):
+        sizes = {'https://video.twimg.com/2176.mp4': 9 * 1024 * 1024,
+                 'https://video.twimg.com/832.mp4': 3 * 1024 * 1024,
+                 'https://video.twimg.com/256.mp4': 1024 * 1024}
+        probe_size.side_effect = sizes.get
+
+        self.assertEqual(choose_variant(self.video_info()), 'https://video.twimg.com/832.mp4')
+        self.assertEqual([args[0] for args, _ in probe_size.call_args_list],
+                         ['https://video.twimg.com/2176.mp4', 'https://video.twimg.com/832.mp4'])
+
+    @mock.patch('moa.tweet.probe_size')
+    def test_nothing_small_enough(self, probe_size):
+        probe_size.return_value = 20 * 1024 * 1024
+
+        self.assertIsNone(choose_variant(self.video_info()))
+        self.assertEqual(probe_size.call_count, 3)
+
+
+class TestTweetMedia(unittest.TestCase):
+
+    def status(self, status_id, alt_text=None, media=True):
+        data = {'id': status_id, 'full_text': 'media', 'entities': {}}
+
+        if media:
+            photo = {'id': status_id * 10, 'type': 'photo', 'media_url': f'https://pbs.twimg.com/{status_id}.jpg'}
+
+            if alt_text is not None:
+                photo['ext_alt_text'] = alt_text
+
+            data['extended_entities'] = {'media': [photo]}
+
+        return Status.NewFromJsonDict(data)
+
+    @mock.patch('moa.tweet.lookup_statuses')
+    def test_batch_costs_one_lookup(self, lookup_statuses):
+        lookup_statuses.return_value = [self.status(3, alt_text='three'), self.status(4, alt_text='four')]
+
+        tweets = [Tweet(TSettings(), self.status(1, media=False), None),
+                  Tweet(TSettings(), self.status(2, alt_text='two'), None),
+                  Tweet(TSettings(), self.status(3), None),
+                  Tweet(TSettings(), self.status(4), None)]
+
+        Tweet.load_media(tweets, None)
+
+        lookup_statuses.assert_called_once_with(None, [3, 4])
+        self.assertEqual([[m.ext_alt_text for m in t.media] for t in tweets], [[], ['two'], ['three'], ['four']])
+
+    @mock.patch('moa.tweet.lookup_statuses')
+    def test_failed_lookup_uses_timeline_media(self, lookup_statuses):
+        lookup_statuses.side_effect = twitter.TwitterError('Over capacity')
+        tweet = Tweet(TSettings(), self.status(5), None)
+
+        self.assertEqual([m.id for m in tweet.media], [50])
+        # and doesn't try again
+        self.assertEqual([m.id for m in tweet.media], [50])
+        self.assertEqual(lookup_statuses.call_count, 1)
+
+
+class TestLookupStatuses(unittest.TestCase):
+    """ lookup_statuses relies on python-twitter internals, these fail if an upgrade changes them """
+
+    def setUp(self):
+        self.api = twitter.Api(consumer_key='key', consumer_secret='secret',
+                               access_token_key='token', access_token_secret='token secret')
+
+    def test_batch_lookup_includes_alt_text(self):
+        photo = {'id': 30, 'type': 'photo', 'media_url': 'https://pbs.twimg.com/3.jpg', 'ext_alt_text': 'three'}
+        body = json.dumps([{'id': 3, 'full_text': 'media', 'extended_entities': {'media': [photo]}}])
+
+        with mock.patch.object(self.api, '_RequestUrl') as request:
+            request.return_value.content = body.encode('utf-8')
+            statuses = lookup_statuses(self.api, [3, 4])
+
+        url, method = request.call_args[0]
+        self.assertEqual((url, method), ('https://api.twitter.com/1.1/statuses/lookup.json', 'GET'))
+        self.assertEqual(request.call_args[1]['data']['id'], '3,4')
+        self.assertTrue(request.call_args[1]['data']['include_ext_alt_text'])
+        self.assertEqual([[m.ext_alt_text for m in s.media] for s in statuses], [['three']])
+
+    def test_errors_are_raised(self):
+        body = json.dumps({'errors': [{'code': 130, 'message': 'Over capacity'}]})
+
+        with mock.patch.object(self.api, '_RequestUrl') as request:
+            request.return_value.content = body.encode('utf-8')
+
+            with self.assertRaises(twitter.TwitterError):
+                lookup_statuses(self.api, [3])
+
+    def test_falls_back_to_public_lookups(self):
+        api = mock.Mock(spec=['GetStatus'])
+        api.GetStatus.side_effect = lambda status_id, **kwargs: status_id
+
+        self.assertEqual(lookup_statuses(api, [3, 4]), [3, 4])
+        api.GetStatus.assert_called_with(4, trim_user=True, include_ext_alt_text=True)